@@ -9,6 +9,10 @@ def create_app(config_class=Config):
     app = Flask(__name__, static_folder='../static')
     app.config.from_object(config_class)
     
+    # Shared cache store for the service-level ttl_cache decorators
+    from .utils import configure_cache_backend
+    configure_cache_backend(app.config)
+
     # Enable CORS for frontend communication
     CORS(app)
 
@@ -16,6 +20,15 @@ def create_app(config_class=Config):
     from .api.routes import api_bp
     app.register_blueprint(api_bp, url_prefix='/api')
 
+    # Daily precompute of captions and images (CLI command + scheduler)
+    from .services import precompute_service
+    app.cli.add_command(precompute_service.precompute_command)
+    precompute_service.start_scheduler(app)
+
+    # Duplicate scan of the image library (CLI command)
+    from .services import image_service
+    app.cli.add_command(image_service.scan_duplicates_command)
+
     # Fix for Render/Heroku proxy (to ensure https urls)
     from werkzeug.middleware.proxy_fix import ProxyFix
     app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_prefix=1)
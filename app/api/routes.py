@@ -1,13 +1,79 @@
+import datetime
+import os
 from flask import Blueprint, jsonify, request, send_file, current_app
-from app.services import square_service, weather_service, holiday_service, openai_service, instagram_service, image_service, settings_service
+from app.services import square_service, weather_service, holiday_service, openai_service, instagram_service, image_service, settings_service, dashboard_service, precompute_service
+from app import metrics
+from app.utils import get_cache_stats, clear_caches, sse_event, sse_response
 
 
 api_bp = Blueprint('api', __name__)
 
+@api_bp.route('/dashboard', methods=['GET'])
+def get_dashboard():
+    # Sales, weather, forecast and holiday in one round trip, fetched concurrently
+    return jsonify(dashboard_service.get_dashboard())
+
+@api_bp.route('/content-pool', methods=['GET', 'POST'])
+def content_pool():
+    # GET: today's precomputed captions and images. POST builds it now
+    # (?force=1 rebuilds), e.g. from an external cron.
+    if request.method == 'POST':
+        pool = precompute_service.build_content_pool(force=request.args.get('force') == '1')
+        if pool is None:
+            return jsonify({"error": "Content pool is already being built"}), 409
+        return jsonify(pool)
+    pool = precompute_service.get_content_pool()
+    if pool is None:
+        return jsonify({"error": "Content pool not built yet"}), 404
+    return jsonify(pool)
+
 @api_bp.route('/sales/top-dishes', methods=['GET'])
 def get_top_dishes():
-    dishes = square_service.get_top_dishes()
-    return jsonify(dishes)
+    # Without a range this keeps returning yesterday's top 5 as a plain list
+    if not any(k in request.args for k in ('start', 'end', 'limit', 'granularity', 'locations')):
+        dishes = square_service.get_top_dishes()
+        return jsonify(dishes)
+
+    try:
+        yesterday = datetime.datetime.utcnow().date() - datetime.timedelta(days=1)
+        end = datetime.date.fromisoformat(request.args['end']) if request.args.get('end') else yesterday
+        start = datetime.date.fromisoformat(request.args['start']) if request.args.get('start') else end
+        limit = int(request.args.get('limit', 5))
+    except ValueError:
+        return jsonify({"error": "start/end must be YYYY-MM-DD and limit an integer"}), 400
+
+    granularity = request.args.get('granularity') or None
+    if granularity not in (None, 'day', 'week', 'month'):
+        return jsonify({"error": "granularity must be day, week or month"}), 400
+    if start > end or limit < 1:
+        return jsonify({"error": "Invalid date range or limit"}), 400
+
+    # Optional subset of locations, e.g. ?locations=L1,L2
+    locations = [location_id for location_id in request.args.get('locations', '').split(',') if location_id] or None
+    if locations and not set(locations) <= set(square_service.get_location_ids()):
+        return jsonify({"error": "Unknown location"}), 400
+    report = square_service.get_sales_report(start, end, limit=min(limit, 100), granularity=granularity,
+                                             location_ids=locations)
+    if report is None:
+        return jsonify({"error": "Sales data unavailable"}), 502
+    return jsonify(report)
+
+@api_bp.route('/sales/sync', methods=['POST'])
+def sync_sales():
+    try:
+        return jsonify(square_service.resync())
+    except Exception as e:
+        return jsonify({"error": str(e)}), 502
+
+@api_bp.route('/weather', methods=['GET'])
+def get_weather_batch():
+    # ?cities=New York,Boston,Philadelphia
+    cities = [c for c in request.args.get('cities', '').split(',') if c.strip()]
+    if not cities:
+        return jsonify({"error": "cities required"}), 400
+    if len(cities) > current_app.config.get('WEATHER_MAX_CITIES', 20):
+        return jsonify({"error": "Too many cities"}), 400
+    return jsonify(weather_service.get_weather_for_cities(cities))
 
 @api_bp.route('/weather/current', methods=['GET'])
 def get_weather():
@@ -16,6 +82,13 @@ def get_weather():
 
 @api_bp.route('/weather/forecast', methods=['GET'])
 def get_forecast():
+    # Optional ?date=YYYY-MM-DD for any day in the 5-day window
+    if request.args.get('date'):
+        try:
+            day = datetime.date.fromisoformat(request.args['date'])
+        except ValueError:
+            return jsonify({"error": "date must be YYYY-MM-DD"}), 400
+        return jsonify(weather_service.get_day_forecast(day))
     forecast = weather_service.get_tomorrow_forecast()
     return jsonify(forecast)
 
@@ -24,11 +97,41 @@ def get_holiday():
     holiday = holiday_service.get_holiday_info()
     return jsonify(holiday)
 
+@api_bp.route('/holidays/upcoming', methods=['GET'])
+def get_upcoming_holidays():
+    # ?countries=US,VN&days=30&types=national,observance,local
+    countries = list(dict.fromkeys(c.strip().upper() for c in request.args.get('countries', '').split(',') if c.strip()))
+    if not countries:
+        countries = current_app.config.get('HOLIDAY_COUNTRIES', ['US'])
+    if len(countries) > current_app.config.get('HOLIDAY_MAX_COUNTRIES', 10):
+        return jsonify({"error": "Too many countries"}), 400
+    invalid = [c for c in countries if not holiday_service.is_country_code(c)]
+    if invalid:
+        return jsonify({"error": f"Invalid country codes: {', '.join(invalid)}"}), 400
+    types = holiday_service.resolve_types(request.args.get('types', 'national').split(','))
+    try:
+        days = int(request.args.get('days', 30))
+    except ValueError:
+        return jsonify({"error": "days must be an integer"}), 400
+    if not 1 <= days <= 366 or not types:
+        return jsonify({"error": "days must be 1-366 and at least one type given"}), 400
+    return jsonify(holiday_service.get_upcoming_holidays(countries, days=days, types=types))
+
 @api_bp.route('/generate/caption', methods=['POST'])
 def generate_caption():
     data = request.json
     mode = data.get('mode') # 'sales', 'weather', 'holiday'
-    
+
+    if data.get('variant') and mode in openai_service.CAPTION_MODES:
+        # "Regenerate": a different caption for the same input
+        result = openai_service.regenerate_caption(mode, data)
+        return jsonify(result if isinstance(result, dict) else {"caption": result})
+
+    # Precomputed this morning, if today's content pool has it
+    pooled = precompute_service.pooled_caption(mode, data)
+    if pooled is not None:
+        return jsonify(pooled)
+
     if mode == 'sales':
         dish_name = data.get('dish_name')
         result = openai_service.generate_caption(dish_name)
@@ -46,11 +149,54 @@ def generate_caption():
     else:
         return jsonify({"error": "Invalid mode"}), 400
 
+@api_bp.route('/generate/caption/stream', methods=['POST'])
+def generate_caption_stream():
+    # Same body as /generate/caption; the caption arrives as server-sent
+    # "token" events followed by a "done" event with the full result
+    data = request.json or {}
+    mode = data.get('mode')
+    if mode not in ('sales', 'weather', 'holiday'):
+        return jsonify({"error": "Invalid mode"}), 400
+    pooled = precompute_service.pooled_caption(mode, data)
+
+    def events():
+        if pooled is not None:
+            yield sse_event(pooled, event="done")
+            return
+        for event, payload in openai_service.stream_caption(mode, data):
+            yield sse_event(payload, event=event)
+    return sse_response(events())
+
+@api_bp.route('/generate/captions', methods=['POST'])
+def generate_captions():
+    # {"dish_names": [...], "stream": false}. With stream=true each caption
+    # is sent as a server-sent event as soon as it is ready.
+    data = request.json or {}
+    dish_names = data.get('dish_names') or []
+    if not isinstance(dish_names, list) or not dish_names:
+        return jsonify({"error": "dish_names must be a non-empty list"}), 400
+    if len(dish_names) > current_app.config.get('CAPTION_BATCH_MAX', 20):
+        return jsonify({"error": "Too many dishes"}), 400
+
+    if not data.get('stream'):
+        return jsonify({"captions": openai_service.generate_captions(dish_names)})
+
+    def events():
+        for dish_name, result, cached in openai_service.iter_captions(dish_names):
+            yield sse_event(dict(result, dish_name=dish_name, cached=cached), event="caption")
+        yield sse_event({}, event="done")
+    return sse_response(events())
+
 @api_bp.route('/generate/image', methods=['POST'])
 def generate_image():
     data = request.json
     mode = data.get('mode')
-    
+
+    # Built this morning, if today's content pool has it
+    image_url = precompute_service.pooled_image(mode, data)
+    if image_url:
+        return jsonify({"image_url": image_url})
+
     if mode == 'sales':
         dish_name = data.get('dish_name')
         # Use library image
@@ -72,8 +218,7 @@ def generate_image():
              
     elif mode == 'holiday':
         caption = data.get('caption')
-        prompt = f"A festive Vietnamese dish celebration. {caption}. Professional food photography."
-        image_url = openai_service.generate_image(prompt)
+        image_url = openai_service.generate_image(openai_service.holiday_image_prompt(caption), mode='holiday')
     else:
         return jsonify({"error": "Invalid mode"}), 400
         
@@ -125,20 +270,139 @@ def get_images():
     images = image_service.get_all_images()
     return jsonify(images)
 
+@api_bp.route('/images/dishes', methods=['GET'])
+def get_image_dishes():
+    # Dish names from the in-memory catalog, without listing Cloudinary
+    try:
+        return jsonify({
+            "dishes": list(image_service.get_dish_names()),
+            "with_images": list(image_service.get_dishes_with_images())
+        })
+    except Exception as e:
+        print(f"❌ Error loading dish catalog: {e}")
+        return jsonify({"error": "Dish catalog unavailable"}), 503
+
+@api_bp.route('/images/sync', methods=['POST'])
+def sync_images():
+    # Pull new Cloudinary uploads into the local mirror; ?full=1 re-reads
+    # every page and drops images deleted outside the app
+    try:
+        result = image_service.resync_catalog(full=request.args.get('full') == '1')
+    except Exception as e:
+        print(f"❌ Error syncing Cloudinary catalog: {e}")
+        return jsonify({"error": str(e)}), 502
+    return jsonify(result)
+
+@api_bp.errorhandler(413)
+def request_too_large(e):
+    return jsonify({"error": "Upload too large"}), 413
+
+def _too_large(file):
+    # Uploaded files are spooled to memory or disk, so their size is known
+    # before they are read
+    file.stream.seek(0, os.SEEK_END)
+    size = file.stream.tell()
+    file.stream.seek(0)
+    return size > current_app.config.get('IMAGE_MAX_UPLOAD_BYTES', 20 * 1024 * 1024)
+
 @api_bp.route('/images/upload', methods=['POST'])
 def upload_image():
     if 'image' not in request.files:
         return jsonify({"error": "No image file"}), 400
         
     file = request.files['image']
+    if _too_large(file):
+        return jsonify({"error": "Image file too large"}), 413
     dish_name = request.form.get('dish_name', 'Uncategorized')
+    # reject, flag or allow near-duplicates (default IMAGE_DUPLICATE_MODE)
+    duplicates = request.form.get('duplicates')
+    if duplicates and duplicates not in image_service.DUPLICATE_MODES:
+        return jsonify({"error": "Invalid duplicates mode"}), 400
     
-    success, result = image_service.upload_image(file, dish_name)
+    success, result = image_service.upload_image(file, dish_name, duplicates)
     if success:
-        return jsonify(result) # Returns {url, public_id}
+        return jsonify(result) # Returns {url, public_id}, plus duplicates when flagged
+    elif isinstance(result, dict):
+        return jsonify(result), 409 # Rejected as a near-duplicate
     else:
         return jsonify({"error": result}), 500
 
+@api_bp.route('/images/upload/bulk', methods=['POST'])
+def upload_images_bulk():
+    # Multipart form: any number of "images" files, "dish_names" in the same
+    # order (or one "dish_name" for all) and optionally "duplicates" (reject,
+    # flag or allow). With ?stream=1 each file's result is sent as a
+    # server-sent event as soon as it is uploaded.
+    files = [f for f in request.files.getlist('images') if f and f.filename]
+    if not files:
+        return jsonify({"error": "No image files"}), 400
+    if len(files) > current_app.config.get('IMAGE_BULK_MAX_FILES', 50):
+        return jsonify({"error": "Too many files"}), 400
+    too_large = [f.filename for f in files if _too_large(f)]
+    if too_large:
+        return jsonify({"error": "Image files too large", "files": too_large}), 413
+    duplicates = request.form.get('duplicates')
+    if duplicates and duplicates not in image_service.DUPLICATE_MODES:
+        return jsonify({"error": "Invalid duplicates mode"}), 400
+    default_dish = request.form.get('dish_name') or 'Uncategorized'
+    dish_names = request.form.getlist('dish_names')
+    # Read now: uploaded files are closed once this view returns, before a
+    # streamed response has run
+    items = [
+        (f.filename, f.read(), (dish_names[i] if i < len(dish_names) else '').strip() or default_dish)
+        for i, f in enumerate(files)
+    ]
+
+    if request.args.get('stream') != '1':
+        results = sorted(image_service.iter_bulk_upload(items, duplicates), key=lambda r: r['index'])
+        uploaded = sum(1 for r in results if r['ok'])
+        return jsonify({"results": results, "uploaded": uploaded, "failed": len(results) - uploaded})
+
+    def events():
+        uploaded = 0
+        for result in image_service.iter_bulk_upload(items, duplicates):
+            uploaded += result['ok']
+            yield sse_event(result, event="image")
+        yield sse_event({"uploaded": uploaded, "failed": len(items) - uploaded}, event="done")
+    return sse_response(events())
+
+def _max_distance_arg():
+    # ?max_distance= within what the hash index serves without a full scan;
+    # None when absent, False when invalid
+    max_distance = request.args.get('max_distance')
+    if max_distance is None:
+        return None
+    if not max_distance.isdigit() or int(max_distance) > image_service.MAX_DISTANCE:
+        return False
+    return int(max_distance)
+
+@api_bp.route('/images/duplicates', methods=['GET'])
+def get_duplicate_images():
+    # Groups of near-identical images among those already hashed
+    max_distance = _max_distance_arg()
+    if max_distance is False:
+        return jsonify({"error": f"max_distance must be 0-{image_service.MAX_DISTANCE}"}), 400
+    return jsonify({"groups": image_service.find_duplicates(max_distance)})
+
+@api_bp.route('/images/duplicates/scan', methods=['POST'])
+def scan_duplicate_images():
+    # Hashes the next batch (?limit=, at most IMAGE_HASH_SCAN_BATCH) of
+    # library images that have no hash yet, then reports the groups; call
+    # again while "remaining" is above zero
+    max_distance = _max_distance_arg()
+    if max_distance is False:
+        return jsonify({"error": f"max_distance must be 0-{image_service.MAX_DISTANCE}"}), 400
+    batch = current_app.config.get('IMAGE_HASH_SCAN_BATCH', 200)
+    limit = request.args.get('limit', batch, type=int)
+    if limit < 1:
+        return jsonify({"error": "limit must be positive"}), 400
+    try:
+        result = image_service.scan_duplicates(max_distance, min(limit, batch))
+    except Exception as e:
+        print(f"❌ Error scanning for duplicate images: {e}")
+        return jsonify({"error": str(e)}), 502
+    return jsonify(result)
+
 @api_bp.route('/images', methods=['DELETE'])
 def delete_image():
     public_id = request.args.get('public_id')
@@ -198,11 +462,32 @@ def debug_files():
         
     return jsonify(info)
 
+@api_bp.route('/debug/cache', methods=['GET', 'DELETE'])
+def debug_cache():
+    if request.method == 'DELETE':
+        # Optional ?name=app.services.weather_service.get_current_weather
+        cleared = clear_caches(request.args.get('name'))
+        return jsonify({"success": True, "cleared": cleared})
+    return jsonify(get_cache_stats())
+
+@api_bp.route('/debug/openai', methods=['GET', 'DELETE'])
+def debug_openai():
+    # Latency/token histograms and call, token, cost and cache counters for
+    # OpenAI calls made by this worker, labelled by mode and route
+    if request.method == 'DELETE':
+        metrics.reset("openai_")
+        return jsonify({"success": True})
+    return jsonify(openai_service.get_metrics())
+
 @api_bp.route('/settings', methods=['GET', 'POST'])
 def settings():
     if request.method == 'POST':
         data = request.json
+        if 'dish_aliases' in data and not isinstance(data['dish_aliases'], dict):
+            return jsonify({"error": "dish_aliases must be an object"}), 400
         settings_service.save_settings(data)
         return jsonify({"success": True})
     else:
-        return jsonify(settings_service.get_settings())
+        settings = settings_service.get_settings()
+        settings.setdefault("dish_aliases", settings_service.get_dish_aliases())
+        return jsonify(settings)
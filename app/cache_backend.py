@@ -0,0 +1,100 @@
+import time
+import pickle
+import random
+import hashlib
+
+from app.db import SQLiteDB
+
+# Shared (L2) stores that sit behind the per-process TTLCache (L1) in
+# app.utils.ttl_cache. Selected with Config.CACHE_BACKEND.
+
+
+def hash_key(key):
+    # Frozen keys only contain str/int/float/None/tuples, so their repr is
+    # stable across worker processes and restarts.
+    return hashlib.sha256(repr(key).encode("utf-8")).hexdigest()
+
+
+class SQLiteBackend:
+    def __init__(self, path, max_entries=5000):
+        self.path = path
+        self.max_entries = max_entries
+        self.db = SQLiteDB(path, schema=(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " namespace TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " value BLOB NOT NULL,"
+            " stored_at REAL NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key))",
+            "CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed_at)",
+        ))
+
+    def get(self, namespace, key):
+        now = time.time()
+        hashed = hash_key(key)
+        conn = self.db.conn()
+        row = conn.execute(
+            "SELECT value, stored_at, expires_at FROM cache WHERE namespace = ? AND key = ?",
+            (namespace, hashed),
+        ).fetchone()
+        if row is None:
+            return None
+        value, stored_at, expires_at = row
+        if expires_at <= now:
+            conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, hashed))
+            return None
+        conn.execute(
+            "UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ?",
+            (now, namespace, hashed),
+        )
+        return pickle.loads(value), stored_at
+
+    def set(self, namespace, key, value, stored_at, expires_at):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        # Written inside a transaction, so readers in other workers see
+        # either the old row or the new one, never a partial write.
+        with self.db.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, stored_at, expires_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (namespace, hash_key(key), blob, stored_at, expires_at, time.time()),
+            )
+        # Sweep occasionally rather than on every write
+        if random.random() < 0.05:
+            self.evict()
+
+    def evict(self):
+        with self.db.transaction() as conn:
+            conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+            conn.execute(
+                "DELETE FROM cache WHERE rowid IN ("
+                " SELECT rowid FROM cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def clear(self, namespace=None):
+        if namespace is None:
+            self.db.execute("DELETE FROM cache")
+        else:
+            self.db.execute("DELETE FROM cache WHERE namespace = ?", (namespace,))
+
+    def stats(self, namespace):
+        row = self.db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM cache WHERE namespace = ?",
+            (namespace,),
+        ).fetchone()
+        return {"backend": "sqlite", "entries": row[0], "bytes": row[1]}
+
+
+def create_backend(config):
+    kind = (config.get("CACHE_BACKEND") or "memory").lower()
+    if kind == "memory":
+        return None
+    if kind == "sqlite":
+        return SQLiteBackend(
+            config["CACHE_SQLITE_PATH"],
+            max_entries=config.get("CACHE_SQLITE_MAX_ENTRIES", 5000),
+        )
+    raise ValueError(f"Unknown CACHE_BACKEND: {kind}")
@@ -8,6 +8,10 @@ class Config:
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
     SQUARE_ACCESS_TOKEN = os.getenv("SQUARE_ACCESS_TOKEN")
     SQUARE_LOCATION_ID = os.getenv("SQUARE_LOCATION_ID")
+    # Comma-separated list for groups with several locations; defaults to the single location
+    SQUARE_LOCATION_IDS = [location_id.strip() for location_id in os.getenv("SQUARE_LOCATION_IDS", "").split(",")
+                           if location_id.strip()] \
+        or ([SQUARE_LOCATION_ID] if SQUARE_LOCATION_ID else [])
     WEATHER_API_KEY = os.getenv("WEATHER_API_KEY")
     HOLIDAY_API_KEY = os.getenv("HOLIDAY_API_KEY")
     IG_USER_ID = os.getenv("IG_USER_ID")
@@ -17,3 +21,83 @@ class Config:
     CLOUDINARY_API_SECRET = os.getenv("CLOUDINARY_API_SECRET")
     UPLOAD_FOLDER = os.path.join(os.getcwd(), 'static/images/dishes')
     ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif'}
+    # "memory" keeps caches per worker process; "sqlite" adds a shared store
+    # that all gunicorn workers read through and that survives restarts
+    CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+    CACHE_SQLITE_PATH = os.getenv("CACHE_SQLITE_PATH", os.path.join(os.getcwd(), 'instance', 'cache.sqlite3'))
+    CACHE_SQLITE_MAX_ENTRIES = int(os.getenv("CACHE_SQLITE_MAX_ENTRIES", "5000"))
+    # /api/dashboard fan-out: worker threads and how long to wait for slow sections
+    DASHBOARD_MAX_WORKERS = int(os.getenv("DASHBOARD_MAX_WORKERS", "8"))
+    DASHBOARD_TIMEOUT = float(os.getenv("DASHBOARD_TIMEOUT", "8"))
+    # Outbound HTTP (app/http_client.py)
+    HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3.05"))
+    HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "15"))
+    HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", "10"))
+    HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "2"))
+    HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "0.5"))
+    HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", "8"))
+    # Local copy of Square orders, synced incrementally (square_service.sync_orders)
+    ORDER_STORE_PATH = os.getenv("ORDER_STORE_PATH", os.path.join(os.getcwd(), 'instance', 'orders.sqlite3'))
+    SQUARE_SYNC_LOOKBACK_DAYS = int(os.getenv("SQUARE_SYNC_LOOKBACK_DAYS", "7"))
+    # How far back sales reports may backfill older orders (once per location)
+    SQUARE_BACKFILL_MAX_DAYS = int(os.getenv("SQUARE_BACKFILL_MAX_DAYS", "366"))
+    # /api/weather?cities=... batch lookups
+    WEATHER_MAX_CITIES = int(os.getenv("WEATHER_MAX_CITIES", "20"))
+    WEATHER_MAX_CONCURRENCY = int(os.getenv("WEATHER_MAX_CONCURRENCY", "8"))
+    # Calendarific calendars, one JSON file per (country, year)
+    HOLIDAY_CACHE_DIR = os.getenv("HOLIDAY_CACHE_DIR", os.path.join(os.getcwd(), 'instance', 'holidays'))
+    HOLIDAY_CALENDAR_MAX_AGE_DAYS = int(os.getenv("HOLIDAY_CALENDAR_MAX_AGE_DAYS", "30"))
+    # Calendar downloads (prefetch and /api/holidays/upcoming) per worker
+    HOLIDAY_MAX_CONCURRENCY = int(os.getenv("HOLIDAY_MAX_CONCURRENCY", "4"))
+    # Default countries for /api/holidays/upcoming, and how many one request may ask for
+    HOLIDAY_COUNTRIES = [c.strip().upper() for c in os.getenv("HOLIDAY_COUNTRIES", "US,VN").split(",") if c.strip()]
+    HOLIDAY_MAX_COUNTRIES = int(os.getenv("HOLIDAY_MAX_COUNTRIES", "10"))
+    # /api/generate/captions: parallel GPT calls per worker and dishes per batch
+    CAPTION_MAX_CONCURRENCY = int(os.getenv("CAPTION_MAX_CONCURRENCY", "3"))
+    CAPTION_BATCH_MAX = int(os.getenv("CAPTION_BATCH_MAX", "20"))
+    # Persistent caption store: GPT completions keyed by (model, prompt), a few
+    # variants per key for "regenerate", pruned by age and total size
+    CAPTION_STORE_PATH = os.getenv("CAPTION_STORE_PATH", os.path.join(os.getcwd(), 'instance', 'captions.sqlite3'))
+    CAPTION_VARIANTS_PER_KEY = int(os.getenv("CAPTION_VARIANTS_PER_KEY", "3"))
+    CAPTION_RETENTION_DAYS = int(os.getenv("CAPTION_RETENTION_DAYS", "30"))
+    CAPTION_STORE_MAX_BYTES = int(os.getenv("CAPTION_STORE_MAX_BYTES", str(20 * 1024 * 1024)))
+    # Daily content pool (precompute_service): set CONTENT_POOL_RUN_AT (UTC
+    # "HH:MM") to build it with an in-process scheduler; off by default, as
+    # each build calls OpenAI. `flask --app run precompute-content` works
+    # from cron too.
+    CONTENT_POOL_DIR = os.getenv("CONTENT_POOL_DIR", os.path.join(os.getcwd(), 'instance', 'content_pool'))
+    CONTENT_POOL_RUN_AT = os.getenv("CONTENT_POOL_RUN_AT", "")
+    CONTENT_POOL_KEEP_DAYS = int(os.getenv("CONTENT_POOL_KEEP_DAYS", "7"))
+    # OpenAI (app/openai_client.py): one shared client per worker, at most
+    # OPENAI_MAX_CONCURRENCY calls in flight, retries following rate-limit headers
+    OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "4"))
+    OPENAI_QUEUE_TIMEOUT = float(os.getenv("OPENAI_QUEUE_TIMEOUT", "30"))
+    OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+    OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+    OPENAI_BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE", "1"))
+    OPENAI_BACKOFF_MAX = float(os.getenv("OPENAI_BACKOFF_MAX", "30"))
+    # In-memory dish catalog (image_service): full Cloudinary re-listing interval
+    DISH_CATALOG_REFRESH_SECONDS = int(os.getenv("DISH_CATALOG_REFRESH_SECONDS", "600"))
+    # Local mirror of the Cloudinary dish library (image_service.sync_catalog)
+    IMAGE_STORE_PATH = os.getenv("IMAGE_STORE_PATH", os.path.join(os.getcwd(), 'instance', 'images.sqlite3'))
+    IMAGE_CATALOG_FULL_SYNC_HOURS = int(os.getenv("IMAGE_CATALOG_FULL_SYNC_HOURS", "24"))
+    # Upload image processing (app/image_pipeline.py): worker processes per
+    # gunicorn worker, per-image timeout and output size/quality
+    IMAGE_PROCESS_WORKERS = int(os.getenv("IMAGE_PROCESS_WORKERS", "2"))
+    IMAGE_PROCESS_TIMEOUT = float(os.getenv("IMAGE_PROCESS_TIMEOUT", "60"))
+    IMAGE_MAX_WIDTH = int(os.getenv("IMAGE_MAX_WIDTH", "1440"))
+    IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+    # Upload size limits: per image file and per request (Flask answers
+    # 413 above MAX_CONTENT_LENGTH before the body is read)
+    IMAGE_MAX_UPLOAD_BYTES = int(os.getenv("IMAGE_MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+    MAX_CONTENT_LENGTH = int(os.getenv("MAX_CONTENT_LENGTH", str(100 * 1024 * 1024)))
+    # Bulk uploads (/api/images/upload/bulk): files per request and
+    # concurrent Cloudinary uploads per worker
+    IMAGE_BULK_MAX_FILES = int(os.getenv("IMAGE_BULK_MAX_FILES", "50"))
+    IMAGE_UPLOAD_CONCURRENCY = int(os.getenv("IMAGE_UPLOAD_CONCURRENCY", "4"))
+    # Near-duplicate uploads (dHash): reject, flag or allow them, and how
+    # many of the 64 bits two hashes may differ by to count as duplicates
+    IMAGE_DUPLICATE_MODE = os.getenv("IMAGE_DUPLICATE_MODE", "reject")
+    IMAGE_DUPLICATE_MAX_DISTANCE = int(os.getenv("IMAGE_DUPLICATE_MAX_DISTANCE", "6"))
+    # Library images hashed per /api/images/duplicates/scan request
+    IMAGE_HASH_SCAN_BATCH = int(os.getenv("IMAGE_HASH_SCAN_BATCH", "200"))
@@ -0,0 +1,46 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Small helper for the local SQLite stores (shared cache, order store, ...).
+# Connections are per thread and reopened after gunicorn forks a worker;
+# WAL mode lets every worker read while one writes.
+
+
+class SQLiteDB:
+    def __init__(self, path, schema=()):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self.conn()
+        for statement in schema:
+            conn.execute(statement)
+
+    def conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def execute(self, sql, params=()):
+        return self.conn().execute(sql, params)
+
+    @contextmanager
+    def transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front so concurrent
+        # writers queue on busy_timeout instead of failing mid-transaction
+        conn = self.conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
@@ -0,0 +1,115 @@
+import os
+import time
+import random
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from flask import current_app, has_app_context
+
+# Shared HTTP layer for the service modules: one keep-alive session per
+# host and process, default timeouts, a per-host connection cap and a
+# jittered retry policy for idempotent calls.
+
+DEFAULTS = {
+    "HTTP_CONNECT_TIMEOUT": 3.05,
+    "HTTP_READ_TIMEOUT": 15,
+    "HTTP_MAX_CONNECTIONS_PER_HOST": 10,
+    "HTTP_MAX_RETRIES": 2,
+    "HTTP_BACKOFF_BASE": 0.5,
+    "HTTP_BACKOFF_MAX": 8,
+}
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_sessions = {}
+_limits = {}
+_lock = threading.Lock()
+_pid = os.getpid()
+
+
+def _setting(name):
+    if has_app_context():
+        return current_app.config.get(name, DEFAULTS[name])
+    return DEFAULTS[name]
+
+
+def _reset_after_fork():
+    # Connections must not be shared with the parent process
+    global _pid
+    if _pid != os.getpid():
+        _sessions.clear()
+        _limits.clear()
+        _pid = os.getpid()
+
+
+def _get_session(host):
+    with _lock:
+        _reset_after_fork()
+        session = _sessions.get(host)
+        if session is None:
+            max_connections = _setting("HTTP_MAX_CONNECTIONS_PER_HOST")
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections, max_retries=0)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[host] = session
+            _limits[host] = threading.BoundedSemaphore(max_connections)
+        return session, _limits[host]
+
+
+def _retry_delay(attempt, response=None):
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after:
+            try:
+                return min(float(retry_after), _setting("HTTP_BACKOFF_MAX"))
+            except ValueError:
+                pass
+    # Exponential backoff with full jitter
+    cap = min(_setting("HTTP_BACKOFF_MAX"), _setting("HTTP_BACKOFF_BASE") * (2 ** attempt))
+    return random.uniform(0, cap)
+
+
+def request(method, url, idempotent=None, retries=None, **kwargs):
+    # idempotent=True lets callers opt POSTs that are really reads (e.g.
+    # Square's orders/search) into the retry policy.
+    method = method.upper()
+    if idempotent is None:
+        idempotent = method in IDEMPOTENT_METHODS
+    if retries is None:
+        retries = _setting("HTTP_MAX_RETRIES") if idempotent else 0
+    kwargs.setdefault("timeout", (_setting("HTTP_CONNECT_TIMEOUT"), _setting("HTTP_READ_TIMEOUT")))
+
+    host = urlsplit(url).netloc
+    session, limit = _get_session(host)
+
+    attempt = 0
+    while True:
+        # Waiting for a free connection slot counts against the connect timeout
+        connect_timeout = kwargs["timeout"][0] if isinstance(kwargs["timeout"], tuple) else kwargs["timeout"]
+        if not limit.acquire(timeout=connect_timeout):
+            raise requests.exceptions.ConnectTimeout(f"Connection limit reached for {host}")
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if attempt >= retries:
+                raise
+            response = None
+        finally:
+            limit.release()
+
+        if response is not None and (response.status_code not in RETRY_STATUSES or attempt >= retries):
+            return response
+        time.sleep(_retry_delay(attempt, response))
+        attempt += 1
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
@@ -0,0 +1,211 @@
+import io
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from PIL import Image, ImageOps
+from flask import current_app, has_app_context
+
+# CPU-heavy image work for uploads, run in a process pool so request
+# threads only move bytes. JPEGs are decoded at reduced scale (draft mode)
+# and other formats shrunk with reduce() before the final LANCZOS resize,
+# so a 12 MP photo is never fully decoded. Each upload also gets a 64-bit
+# difference hash (dHash) for near-duplicate detection.
+
+DEFAULTS = {
+    "IMAGE_PROCESS_WORKERS": 2,
+    "IMAGE_PROCESS_TIMEOUT": 60,
+    "IMAGE_MAX_WIDTH": 1440,
+    "IMAGE_JPEG_QUALITY": 85,
+}
+
+# EXIF orientations that swap width and height
+TRANSPOSED = {5, 6, 7, 8}
+
+# dHash compares HASH_SIZE + 1 columns of HASH_SIZE rows: 64 bits
+HASH_SIZE = 8
+
+_pool = None
+_pool_pid = None
+_lock = threading.Lock()
+
+
+def _setting(name):
+    if has_app_context():
+        return current_app.config.get(name, DEFAULTS[name])
+    return DEFAULTS[name]
+
+
+def dhash(img):
+    # One bit per horizontally adjacent pair of a 9x8 grayscale thumbnail:
+    # is the left pixel brighter? Survives resizing, recompression and small
+    # colour changes, so re-uploads of the same photo land a few bits apart.
+    small = img.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.BOX)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            value = value << 1 | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hash_image(data):
+    # dHash of image bytes, e.g. a thumbnail of an image already in the library
+    img = Image.open(io.BytesIO(data))
+    img.draft("L", (64, 64))
+    return dhash(ImageOps.exif_transpose(img))
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def _normalize_mode(img):
+    # reduce() only takes a few modes (not palette, 1-bit or 16-bit), so
+    # everything else is converted first, as the upload path always has
+    if img.mode in ("RGB", "L", "RGBA", "LA"):
+        return img
+    if img.mode.startswith("I;16"):
+        # Scale 16-bit samples down rather than clip them to white
+        return img.convert("I").point(lambda value: value / 256).convert("L")
+    if img.mode == "P" and "transparency" in img.info:
+        return img.convert("RGBA")
+    return img.convert("RGB")
+
+
+def process_image(data, max_width=1440, quality=85):
+    # Bytes in, (JPEG bytes, dHash) out: at most max_width wide, upright, RGB.
+    # Runs in the worker processes, so it must stay a plain top-level function.
+    img = Image.open(io.BytesIO(data))
+    is_jpeg = img.format == "JPEG"
+    orientation = img.getexif().get(0x0112, 1)
+    width, height = img.size
+    # The width after applying EXIF orientation is what max_width limits
+    final_width = height if orientation in TRANSPOSED else width
+    scale = max_width / final_width
+
+    if not is_jpeg:
+        img = _normalize_mode(img)
+
+    if scale < 1:
+        if is_jpeg:
+            # Let libjpeg decode at 1/2, 1/4 or 1/8 scale, never below the target
+            img.draft("RGB", (int(width * scale) + 1, int(height * scale) + 1))
+        else:
+            factor = int(1 / scale)
+            if factor >= 2:
+                img = img.reduce(factor)
+
+    # Applied once, on the already reduced image
+    img = ImageOps.exif_transpose(img)
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+
+    if img.width > max_width:
+        new_height = int(img.height * max_width / img.width)
+        img = img.resize((max_width, new_height), Image.Resampling.LANCZOS)
+
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=quality)
+    return out.getvalue(), dhash(img)
+
+
+def _get_pool():
+    global _pool, _pool_pid
+    with _lock:
+        # A pool inherited through fork (gunicorn) is unusable; start a new one
+        if _pool is None or _pool_pid != os.getpid():
+            # spawn, not fork: forking a process with live threads can deadlock
+            _pool = ProcessPoolExecutor(
+                max_workers=_setting("IMAGE_PROCESS_WORKERS"),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _discard_pool(pool):
+    global _pool
+    with _lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _forget_if_broken(pool, future):
+    # Done-callback: once a worker has died every future of the pool fails
+    # with BrokenProcessPool, so the next submit() starts a new pool. The
+    # broken one has already shut itself down.
+    global _pool
+    if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+        with _lock:
+            if _pool is pool:
+                _pool = None
+
+
+def submit(data):
+    # Future with (JPEG bytes, dHash), see process_image
+    for attempt in range(2):
+        pool = _get_pool()
+        try:
+            future = pool.submit(process_image, data, _setting("IMAGE_MAX_WIDTH"), _setting("IMAGE_JPEG_QUALITY"))
+        except BrokenProcessPool:
+            _discard_pool(pool)
+            if attempt:
+                raise
+            continue
+        future.add_done_callback(lambda done: _forget_if_broken(pool, done))
+        return future
+
+
+def _terminate(pool):
+    # Stops a pool whose workers may be stuck on an image: shutdown() alone
+    # would leave them running. Other images still in it fail with
+    # BrokenProcessPool.
+    global _pool
+    with _lock:
+        if _pool is pool:
+            _pool = None
+    terminate_workers = getattr(pool, "terminate_workers", None)
+    if terminate_workers is not None:
+        # Python 3.14+
+        terminate_workers()
+        return
+    processes = list((pool._processes or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+
+
+def restart():
+    # Running tasks can't be cancelled: after a timeout, the pool's workers
+    # are terminated and later work goes to a new pool
+    with _lock:
+        pool = _pool
+    if pool is not None:
+        _terminate(pool)
+
+
+def process(data):
+    # Blocks the calling thread only while waiting. If the pool has died
+    # (e.g. a worker was OOM-killed) it is replaced and the image is tried
+    # once more; if the image takes longer than IMAGE_PROCESS_TIMEOUT the
+    # pool is restarted and TimeoutError raised.
+    timeout = _setting("IMAGE_PROCESS_TIMEOUT")
+    for attempt in range(2):
+        pool = _get_pool()
+        try:
+            future = pool.submit(process_image, data, _setting("IMAGE_MAX_WIDTH"), _setting("IMAGE_JPEG_QUALITY"))
+            return future.result(timeout=timeout)
+        except BrokenProcessPool:
+            _discard_pool(pool)
+            if attempt:
+                raise
+            print("❌ Image process pool died, restarting it")
+        except FutureTimeout:
+            _terminate(pool)
+            raise TimeoutError(f"Image processing took longer than {timeout:g} seconds")
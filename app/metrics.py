@@ -0,0 +1,117 @@
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+from flask import has_request_context, request
+
+# In-process counters and bucketed histograms, labelled like
+# ("openai_calls", mode="sales", route="api.generate_caption"). Each gunicorn
+# worker keeps its own numbers; /api/debug/openai shows the current worker's.
+
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 20000, 30000, 60000)
+TOKEN_BUCKETS = (50, 100, 200, 400, 800, 1600, 3200, 6400)
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+
+# Route of the request that started the work, carried into pool threads by
+# utils.submit_in_app_context
+_route = contextvars.ContextVar("metrics_route", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        bounds = list(self.buckets) + ["inf"]
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 3),
+            "mean": round(self.sum / self.count, 3) if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": [{"le": bound, "count": count} for bound, count in zip(bounds, self.counts)],
+        }
+
+
+def _series_key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    key = _series_key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, buckets=LATENCY_BUCKETS_MS, **labels):
+    key = _series_key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+
+def snapshot(prefix=""):
+    with _lock:
+        counters = {}
+        for (name, labels), value in sorted(_counters.items()):
+            if name.startswith(prefix):
+                counters.setdefault(name, []).append({"labels": dict(labels), "value": round(value, 6)})
+        histograms = {}
+        for (name, labels), histogram in sorted(_histograms.items(), key=lambda item: item[0]):
+            if name.startswith(prefix):
+                histograms.setdefault(name, []).append(dict(histogram.snapshot(), labels=dict(labels)))
+    return {"counters": counters, "histograms": histograms}
+
+
+def reset(prefix=""):
+    with _lock:
+        for series in (_counters, _histograms):
+            for key in [k for k in series if k[0].startswith(prefix)]:
+                del series[key]
+
+
+def current_route():
+    if has_request_context():
+        return request.endpoint or request.path
+    return _route.get() or "background"
+
+
+@contextmanager
+def route(name):
+    token = _route.set(name)
+    try:
+        yield
+    finally:
+        _route.reset(token)
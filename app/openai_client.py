@@ -0,0 +1,200 @@
+import os
+import re
+import time
+import random
+import threading
+from contextlib import contextmanager
+
+import httpx
+import openai
+from flask import current_app, has_app_context
+
+from app import metrics
+
+# Shared OpenAI access for the service modules: one client (and httpx
+# connection pool) per process and API key, a cap on concurrent calls, and
+# retries that follow the rate-limit headers. A 429 pauses every caller in
+# the process until the limit resets instead of letting them all hit it.
+
+DEFAULTS = {
+    "OPENAI_MAX_CONCURRENCY": 4,
+    "OPENAI_QUEUE_TIMEOUT": 30,
+    "OPENAI_TIMEOUT": 60,
+    "OPENAI_MAX_RETRIES": 3,
+    "OPENAI_BACKOFF_BASE": 1,
+    "OPENAI_BACKOFF_MAX": 30,
+}
+
+RETRY_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+_clients = {}
+_limit = None
+_lock = threading.Lock()
+_pid = os.getpid()
+# time.monotonic() before which no new call is started
+_paused_until = 0.0
+
+
+class QueueTimeout(openai.OpenAIError):
+    pass
+
+
+def _setting(name):
+    if has_app_context():
+        return current_app.config.get(name, DEFAULTS[name])
+    return DEFAULTS[name]
+
+
+def _reset_after_fork():
+    # Connections must not be shared with the parent process
+    global _pid, _limit, _paused_until
+    if _pid != os.getpid():
+        _clients.clear()
+        _limit = None
+        _paused_until = 0.0
+        _pid = os.getpid()
+
+
+def get_client():
+    api_key = current_app.config["OPENAI_API_KEY"]
+    with _lock:
+        _reset_after_fork()
+        client = _clients.get(api_key)
+        if client is None:
+            connections = _setting("OPENAI_MAX_CONCURRENCY")
+            client = _clients[api_key] = openai.OpenAI(
+                api_key=api_key,
+                timeout=_setting("OPENAI_TIMEOUT"),
+                # Retries are handled below so they respect the concurrency cap
+                max_retries=0,
+                http_client=openai.DefaultHttpxClient(
+                    limits=httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+                ),
+            )
+        return client
+
+
+def _get_limit():
+    global _limit
+    with _lock:
+        _reset_after_fork()
+        if _limit is None:
+            _limit = threading.BoundedSemaphore(_setting("OPENAI_MAX_CONCURRENCY"))
+        return _limit
+
+
+@contextmanager
+def _slot():
+    limit = _get_limit()
+    if not limit.acquire(timeout=_setting("OPENAI_QUEUE_TIMEOUT")):
+        raise QueueTimeout("Too many OpenAI calls in progress")
+    try:
+        yield
+    finally:
+        limit.release()
+
+
+def _parse_duration(value):
+    # "1s", "250ms", "6m0s", "1h2m3.5s" (x-ratelimit-reset-*) or plain seconds
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    parts = re.findall(r"([\d.]+)(ms|h|m|s)", value or "")
+    if not parts:
+        return None
+    scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(amount) * scale[unit] for amount, unit in parts)
+
+
+def _retry_delay(attempt, error):
+    response = getattr(error, "response", None)
+    headers = response.headers if response is not None else {}
+    delay = None
+    if headers.get("retry-after-ms"):
+        delay = _parse_duration(headers["retry-after-ms"])
+        delay = delay / 1000 if delay is not None else None
+    if delay is None and headers.get("retry-after"):
+        delay = _parse_duration(headers["retry-after"])
+    if delay is None and isinstance(error, openai.RateLimitError):
+        resets = [_parse_duration(headers.get(name)) for name in
+                  ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")]
+        resets = [reset for reset in resets if reset is not None]
+        delay = max(resets) if resets else None
+    if delay is not None:
+        # A little jitter so paused callers don't all resume at once
+        return min(delay, _setting("OPENAI_BACKOFF_MAX")) + random.uniform(0, 0.25)
+    # Exponential backoff with full jitter
+    cap = min(_setting("OPENAI_BACKOFF_MAX"), _setting("OPENAI_BACKOFF_BASE") * (2 ** attempt))
+    return random.uniform(0, cap)
+
+
+def _pause(delay):
+    global _paused_until
+    with _lock:
+        _paused_until = max(_paused_until, time.monotonic() + delay)
+
+
+def _wait_for_pause():
+    with _lock:
+        remaining = _paused_until - time.monotonic()
+    if remaining > 0:
+        time.sleep(remaining)
+
+
+def _backoff(attempt, error):
+    delay = _retry_delay(attempt, error)
+    if isinstance(error, openai.RateLimitError):
+        _pause(delay)
+    metrics.inc("openai_retries", error=type(error).__name__)
+    print(f"❌ OpenAI {type(error).__name__}, retrying in {delay:.1f}s")
+    return delay
+
+
+def call(func):
+    # func(client) makes one API call, e.g.
+    # call(lambda client: client.chat.completions.create(...))
+    retries = _setting("OPENAI_MAX_RETRIES")
+    attempt = 0
+    while True:
+        _wait_for_pause()
+        try:
+            with _slot():
+                return func(get_client())
+        except RETRY_ERRORS as e:
+            if attempt >= retries:
+                raise
+            delay = _backoff(attempt, e)
+        time.sleep(delay)
+        attempt += 1
+
+
+def stream(func):
+    # Like call() for stream=True requests: yields the chunks, holding a
+    # concurrency slot until the stream is exhausted or closed. Only
+    # opening the stream is retried.
+    retries = _setting("OPENAI_MAX_RETRIES")
+    attempt = 0
+    while True:
+        _wait_for_pause()
+        with _slot():
+            try:
+                response = func(get_client())
+            except RETRY_ERRORS as e:
+                if attempt >= retries:
+                    raise
+                delay = _backoff(attempt, e)
+            else:
+                try:
+                    yield from response
+                finally:
+                    close = getattr(response, "close", None)
+                    if close is not None:
+                        close()
+                return
+        time.sleep(delay)
+        attempt += 1
@@ -0,0 +1,149 @@
+import json
+import time
+import random
+import hashlib
+import threading
+from flask import current_app
+
+from app.db import SQLiteDB
+
+# Disk-backed store of GPT completions keyed by a hash of
+# (model, prompt, parameters). Each key keeps up to
+# CAPTION_VARIANTS_PER_KEY completions; "give me a different one" rotates
+# through them once the key is full instead of calling the API again.
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS caption_keys ("
+    " key TEXT PRIMARY KEY,"
+    " model TEXT NOT NULL,"
+    " prompt TEXT NOT NULL,"
+    " params TEXT NOT NULL,"
+    " cursor INTEGER NOT NULL DEFAULT 0,"
+    " last_used REAL NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS caption_variants ("
+    " key TEXT NOT NULL,"
+    " variant INTEGER NOT NULL,"
+    " text TEXT NOT NULL,"
+    " size INTEGER NOT NULL,"
+    " created_at REAL NOT NULL,"
+    " PRIMARY KEY (key, variant))",
+    "CREATE INDEX IF NOT EXISTS caption_keys_last_used ON caption_keys (last_used)",
+)
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store():
+    config = current_app.config
+    path = config["CAPTION_STORE_PATH"]
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = CaptionStore(
+                path,
+                max_variants=config.get("CAPTION_VARIANTS_PER_KEY", 3),
+                retention_days=config.get("CAPTION_RETENTION_DAYS", 30),
+                max_bytes=config.get("CAPTION_STORE_MAX_BYTES", 20 * 1024 * 1024),
+            )
+        return store
+
+
+def content_key(model, prompt, params=None):
+    payload = json.dumps([model, prompt, params or {}], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CaptionStore:
+    def __init__(self, path, max_variants=3, retention_days=30, max_bytes=20 * 1024 * 1024):
+        self.db = SQLiteDB(path, schema=SCHEMA)
+        self.max_variants = max_variants
+        self.retention_days = retention_days
+        self.max_bytes = max_bytes
+
+    def current(self, key):
+        # The variant most recently added or rotated to, or None
+        row = self.db.execute(
+            "SELECT v.text FROM caption_keys k JOIN caption_variants v"
+            " ON v.key = k.key AND v.variant = k.cursor WHERE k.key = ? AND v.created_at > ?",
+            (key, self._cutoff()),
+        ).fetchone()
+        if row is None:
+            return None
+        self.db.execute("UPDATE caption_keys SET last_used = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def is_full(self, key):
+        row = self.db.execute(
+            "SELECT COUNT(*) FROM caption_variants WHERE key = ? AND created_at > ?", (key, self._cutoff())
+        ).fetchone()
+        return row[0] >= self.max_variants
+
+    def rotate(self, key):
+        # Advance to the next stored variant and return it
+        with self.db.transaction() as conn:
+            variants = [row[0] for row in conn.execute(
+                "SELECT variant FROM caption_variants WHERE key = ? AND created_at > ? ORDER BY variant",
+                (key, self._cutoff()),
+            ).fetchall()]
+            if not variants:
+                return None
+            cursor = conn.execute("SELECT cursor FROM caption_keys WHERE key = ?", (key,)).fetchone()[0]
+            later = [v for v in variants if v > cursor]
+            cursor = later[0] if later else variants[0]
+            conn.execute("UPDATE caption_keys SET cursor = ?, last_used = ? WHERE key = ?", (cursor, time.time(), key))
+            return conn.execute(
+                "SELECT text FROM caption_variants WHERE key = ? AND variant = ?", (key, cursor)
+            ).fetchone()[0]
+
+    def add(self, key, text, model, prompt, params=None):
+        now = time.time()
+        with self.db.transaction() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO caption_keys (key, model, prompt, params, cursor, last_used)"
+                " VALUES (?, ?, ?, ?, 0, ?)",
+                (key, model, prompt, json.dumps(params or {}, sort_keys=True), now),
+            )
+            row = conn.execute("SELECT MAX(variant) FROM caption_variants WHERE key = ?", (key,)).fetchone()
+            variant = 0 if row[0] is None else row[0] + 1
+            conn.execute(
+                "INSERT INTO caption_variants (key, variant, text, size, created_at) VALUES (?, ?, ?, ?, ?)",
+                (key, variant, text, len(text.encode("utf-8")), now),
+            )
+            # Keep only the newest max_variants completions per key
+            conn.execute(
+                "DELETE FROM caption_variants WHERE key = ? AND variant <= ?",
+                (key, variant - self.max_variants),
+            )
+            conn.execute("UPDATE caption_keys SET cursor = ?, last_used = ? WHERE key = ?", (variant, now, key))
+        if random.random() < 0.05:
+            self.evict()
+
+    def evict(self):
+        # Drop expired completions, then least recently used keys until the
+        # store fits in max_bytes
+        with self.db.transaction() as conn:
+            conn.execute("DELETE FROM caption_variants WHERE created_at <= ?", (self._cutoff(),))
+            conn.execute("DELETE FROM caption_keys WHERE key NOT IN (SELECT DISTINCT key FROM caption_variants)")
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM caption_variants").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            rows = conn.execute(
+                "SELECT k.key, SUM(v.size) FROM caption_keys k JOIN caption_variants v ON v.key = k.key"
+                " GROUP BY k.key ORDER BY k.last_used"
+            ).fetchall()
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                conn.execute("DELETE FROM caption_variants WHERE key = ?", (key,))
+                conn.execute("DELETE FROM caption_keys WHERE key = ?", (key,))
+                total -= size
+
+    def stats(self):
+        keys, variants, size = self.db.execute(
+            "SELECT (SELECT COUNT(*) FROM caption_keys), COUNT(*), COALESCE(SUM(size), 0) FROM caption_variants"
+        ).fetchone()
+        return {"keys": keys, "variants": variants, "bytes": size, "max_bytes": self.max_bytes}
+
+    def _cutoff(self):
+        return time.time() - self.retention_days * 86400
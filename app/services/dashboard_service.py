@@ -0,0 +1,63 @@
+import time
+from concurrent.futures import wait
+from flask import current_app
+
+from app.utils import get_executor, submit_in_app_context
+from app.services import square_service, weather_service, holiday_service
+
+# Sections run on one bounded pool per process. Sections that overrun the
+# deadline keep running there and still warm the service caches.
+
+SECTIONS = {
+    "sales": square_service.get_top_dishes,
+    "weather": weather_service.get_current_weather,
+    "forecast": weather_service.get_tomorrow_forecast,
+    "holiday": holiday_service.get_holiday_info,
+}
+
+
+# The services report upstream failures in their payloads rather than
+# raising, flagged with this prefix (see square_service.get_top_dishes and
+# holiday_service.get_holiday_info)
+ERROR_MARK = "⚠️"
+
+
+def _is_error(data):
+    if data is None:
+        return True
+    if isinstance(data, dict):
+        return str(data.get("message", "")).startswith(ERROR_MARK)
+    if isinstance(data, list):
+        return any(isinstance(item, dict) and str(item.get("name", "")).startswith(ERROR_MARK) for item in data)
+    return False
+
+
+def _run_section(func):
+    start = time.perf_counter()
+    data = func()
+    return data, (time.perf_counter() - start) * 1000
+
+
+def get_dashboard():
+    timeout = current_app.config.get("DASHBOARD_TIMEOUT", 8)
+    executor = get_executor("dashboard", current_app.config.get("DASHBOARD_MAX_WORKERS", 8))
+
+    start = time.perf_counter()
+    futures = {name: submit_in_app_context(executor, _run_section, func) for name, func in SECTIONS.items()}
+    wait(futures.values(), timeout=timeout)
+
+    payload = {}
+    for name, future in futures.items():
+        if not future.done():
+            payload[name] = {"status": "timeout", "data": None, "elapsed_ms": round(timeout * 1000)}
+            continue
+        try:
+            data, elapsed_ms = future.result()
+            status = "error" if _is_error(data) else "ok"
+            payload[name] = {"status": status, "data": data, "elapsed_ms": round(elapsed_ms)}
+        except Exception as e:
+            print(f"❌ Dashboard section {name} failed: {e}")
+            payload[name] = {"status": "error", "data": None, "error": str(e), "elapsed_ms": None}
+
+    payload["elapsed_ms"] = round((time.perf_counter() - start) * 1000)
+    return payload
@@ -0,0 +1,193 @@
+import re
+import time
+import threading
+import unicodedata
+from flask import current_app
+
+from app.utils import get_executor, submit_in_app_context
+
+UNCATEGORIZED = "Uncategorized"
+
+
+def normalize(name):
+    # "Bánh  Mì!" -> "banh mi": the form every lookup below is keyed by
+    name = unicodedata.normalize("NFKD", name or "")
+    name = "".join(ch for ch in name if not unicodedata.combining(ch))
+    return " ".join(re.findall(r"\w+", name.lower()))
+
+
+class DishCatalog:
+    # In-memory index of the image library: which dish each image belongs
+    # to, plus normalized dish name -> image URLs and token -> dish names,
+    # so dish lists and image picks never need Cloudinary. load() returns
+    # {public_id: (dish_name, url)} for the whole library; it runs once on
+    # first use and again in the background every DISH_CATALOG_REFRESH_SECONDS.
+    # Uploads, deletes and recategorizations are applied write-through in
+    # between.
+
+    def __init__(self, load):
+        self.load = load
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._records = {}
+        self._counts = {}
+        self._names = ()
+        self._with_images = ()
+        self._urls_by_key = {}
+        self._keys_by_token = {}
+        self._loaded_at = None
+        self._refreshing = False
+        # Changes made while a refresh is listing the library, replayed on
+        # top of its result so they aren't lost
+        self._journal = None
+
+    def dish_names(self):
+        self._ensure_loaded()
+        return self._names
+
+    def dishes_with_images(self):
+        self._ensure_loaded()
+        return self._with_images
+
+    def image_count(self, dish_name):
+        self._ensure_loaded()
+        return self._counts.get(dish_name, 0)
+
+    def find_images(self, dish_name, aliases=None):
+        # Image URLs for a dish, best match first:
+        # 1. the dish itself (ignoring case, accents and punctuation)
+        # 2. the name with aliases applied ("Chicken Banh Mi" -> "Chicken Sandwich")
+        # 3. every dish whose name has all of its words ("Wings Chicken" -> "Chicken Wings")
+        # 4. for a single word, every dish whose name contains it ("Sandwich")
+        # Otherwise nothing: a dish sharing only some words ("Chicken Wings"
+        # vs "Chicken Sandwich") is a different dish.
+        self._ensure_loaded()
+        urls_by_key = self._urls_by_key
+        key = normalize(dish_name)
+        if not key:
+            return ()
+        candidates = [key]
+        aliased = apply_aliases(key, aliases or {})
+        if aliased != key:
+            candidates.append(aliased)
+        for candidate in candidates:
+            if candidate in urls_by_key:
+                return urls_by_key[candidate]
+
+        tokens = aliased.split()
+        keys_by_token = self._keys_by_token
+        if all(token in keys_by_token for token in tokens):
+            matches = frozenset.intersection(*(keys_by_token[token] for token in tokens))
+        else:
+            matches = frozenset()
+        if not matches and len(tokens) == 1:
+            matches = [k for k in urls_by_key if aliased in k]
+        return tuple(url for k in sorted(matches) for url in urls_by_key[k])
+
+    def add(self, public_id, dish_name, url=None):
+        self._apply(("set", public_id, (dish_name, url)))
+
+    def remove(self, public_id):
+        self._apply(("remove", public_id, None))
+
+    def refresh(self):
+        with self._lock:
+            self._journal = []
+        try:
+            records = self.load()
+        except Exception:
+            with self._lock:
+                self._journal = None
+            raise
+        with self._lock:
+            for op in self._journal:
+                self._apply_op(records, op)
+            self._journal = None
+            self._records = records
+            self._rebuild()
+            self._loaded_at = time.time()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "images": len(self._records),
+                "dishes": len(self._names),
+                "loaded_at": self._loaded_at,
+                "refreshing": self._refreshing,
+            }
+
+    def _apply(self, op):
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append(op)
+            self._apply_op(self._records, op)
+            self._rebuild()
+
+    @staticmethod
+    def _apply_op(records, op):
+        action, public_id, record = op
+        if action == "set":
+            dish_name, url = record
+            if url is None and public_id in records:
+                # Recategorized: the image itself didn't change
+                url = records[public_id][1]
+            records[public_id] = (dish_name, url)
+        else:
+            records.pop(public_id, None)
+
+    def _rebuild(self):
+        # Called with _lock held. Readers get fresh immutable objects, so
+        # lookups never need the lock.
+        counts = {}
+        urls_by_key = {}
+        for dish_name, url in self._records.values():
+            counts[dish_name] = counts.get(dish_name, 0) + 1
+            if url and dish_name != UNCATEGORIZED:
+                urls_by_key.setdefault(normalize(dish_name), []).append(url)
+        keys_by_token = {}
+        for key in urls_by_key:
+            for token in key.split():
+                keys_by_token.setdefault(token, set()).add(key)
+        self._counts = counts
+        self._names = tuple(sorted(counts))
+        self._with_images = tuple(name for name in self._names if name != UNCATEGORIZED)
+        self._urls_by_key = {key: tuple(urls) for key, urls in urls_by_key.items()}
+        self._keys_by_token = {token: frozenset(keys) for token, keys in keys_by_token.items()}
+
+    def _ensure_loaded(self):
+        if self._loaded_at is None:
+            # First use: wait for one listing (shared by concurrent callers)
+            with self._load_lock:
+                if self._loaded_at is None:
+                    self.refresh()
+            return
+        if time.time() - self._loaded_at > current_app.config.get("DISH_CATALOG_REFRESH_SECONDS", 600):
+            self._schedule_refresh()
+
+    def _schedule_refresh(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"❌ Error refreshing dish catalog: {e}")
+                # Try again after another interval rather than on every read
+                self._loaded_at = time.time()
+            finally:
+                with self._lock:
+                    self._refreshing = False
+        submit_in_app_context(get_executor("dish_catalog", 1), run)
+
+
+def apply_aliases(key, aliases):
+    # aliases: {alias: dish}; whole-word replacement on normalized names
+    padded = f" {key} "
+    for alias, dish in aliases.items():
+        alias, dish = normalize(alias), normalize(dish)
+        if alias and f" {alias} " in padded:
+            padded = padded.replace(f" {alias} ", f" {dish} ")
+    return padded.strip()
@@ -0,0 +1,168 @@
+import threading
+from itertools import combinations
+
+from app.image_pipeline import hamming
+
+# Bands of a 64-bit hash; see HashIndex
+BANDS = 4
+BAND_BITS = 64 // BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+# Beyond this many bits per band, probing costs more than scanning
+MAX_BAND_RADIUS = 2
+# Largest max_distance callers should ask for; above it lookups fall back to
+# comparing against every hash
+MAX_DISTANCE = MAX_BAND_RADIUS * BANDS
+
+
+def _bands(value):
+    return [(band, (value >> (band * BAND_BITS)) & BAND_MASK) for band in range(BANDS)]
+
+
+def _neighbours(bits, radius):
+    # Every band value within radius bits of bits, itself included
+    yield bits
+    for flips in range(1, radius + 1):
+        for positions in combinations(range(BAND_BITS), flips):
+            value = bits
+            for position in positions:
+                value ^= 1 << position
+            yield value
+
+
+class HashIndex:
+    # In-memory near-duplicate lookup over the library's 64-bit perceptual
+    # hashes (multi-index hashing). Each hash is filed under its four 16-bit
+    # bands. Two hashes at most d bits apart have a band at most d // 4 bits
+    # apart, so a lookup probes the few band values that close to the
+    # query's and only compares the hashes filed there, instead of the whole
+    # library. load() returns {key: hash} and runs on first use and on
+    # refresh(); uploads and deletes are applied write-through. When the
+    # hashes are shared with other processes, version() returns a number
+    # that changes with them and the index reloads whenever it has moved.
+    # Keys added by claim() live only here until removed, and survive
+    # reloads.
+
+    def __init__(self, load, version=None):
+        self.load = load
+        self.version = version
+        self._lock = threading.Lock()
+        self._hashes = None
+        self._buckets = {}
+        self._loaded_version = None
+        self._claims = set()
+
+    def find(self, value, max_distance):
+        # [(distance, key)] within max_distance bits, closest first
+        with self._lock:
+            self._ensure_loaded()
+            return self._find(value, max_distance)
+
+    def claim(self, key, value, max_distance, exclusive=True):
+        # Looks for near-duplicates and adds the hash in one step, so two
+        # copies uploaded at the same time can't both miss each other. With
+        # exclusive=True the hash is only added when nothing matched.
+        with self._lock:
+            self._ensure_loaded()
+            matches = self._find(value, max_distance)
+            if not (matches and exclusive):
+                self._add(key, value)
+                self._claims.add(key)
+            return matches
+
+    def add(self, key, value):
+        with self._lock:
+            self._ensure_loaded()
+            self._add(key, value)
+
+    def remove(self, key):
+        with self._lock:
+            self._claims.discard(key)
+            if self._hashes is not None:
+                self._remove(key)
+
+    def refresh(self):
+        version = self.version() if self.version else None
+        hashes = self.load()
+        with self._lock:
+            self._replace(hashes)
+            self._loaded_version = version
+
+    def groups(self, max_distance):
+        # Sets of keys linked by near-duplicate pairs, largest first
+        with self._lock:
+            self._ensure_loaded()
+            parent = {}
+
+            def root(key):
+                parent.setdefault(key, key)
+                while parent[key] != key:
+                    parent[key] = parent[parent[key]]
+                    key = parent[key]
+                return key
+
+            for key, value in self._hashes.items():
+                for _, other in self._find(value, max_distance):
+                    if other != key:
+                        parent[root(other)] = root(key)
+            groups = {}
+            for key in parent:
+                groups.setdefault(root(key), set()).add(key)
+        return sorted(groups.values(), key=len, reverse=True)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._hashes or {})
+
+    def _ensure_loaded(self):
+        # Called with _lock held. The version is read before loading, so a
+        # change made in between only costs another reload.
+        version = self.version() if self.version else None
+        if self._hashes is None or version != self._loaded_version:
+            self._replace(self.load())
+            self._loaded_version = version
+
+    def _replace(self, hashes):
+        claimed = {key: self._hashes[key] for key in self._claims if key in (self._hashes or {})}
+        self._hashes = {}
+        self._buckets = {}
+        for key, value in hashes.items():
+            self._add(key, value)
+        for key, value in claimed.items():
+            self._add(key, value)
+
+    def _find(self, value, max_distance):
+        radius = max_distance // BANDS
+        if radius > MAX_BAND_RADIUS:
+            candidates = self._hashes
+        else:
+            candidates = set()
+            buckets = self._buckets
+            for band, bits in _bands(value):
+                for probe in _neighbours(bits, radius):
+                    bucket = buckets.get((band, probe))
+                    if bucket:
+                        candidates.update(bucket)
+        matches = []
+        for key in candidates:
+            distance = hamming(value, self._hashes[key])
+            if distance <= max_distance:
+                matches.append((distance, key))
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+    def _add(self, key, value):
+        self._remove(key)
+        self._hashes[key] = value
+        for band in _bands(value):
+            self._buckets.setdefault(band, set()).add(key)
+
+    def _remove(self, key):
+        value = self._hashes.pop(key, None)
+        if value is None:
+            return
+        for band in _bands(value):
+            bucket = self._buckets.get(band)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band]
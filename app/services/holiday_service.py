@@ -1,65 +1,273 @@
-import requests
+import os
+import re
+import json
+import time
+import bisect
 import datetime
+import threading
 from flask import current_app
-from app.utils import ttl_cache
+from app import http_client
+from app.utils import ttl_cache, SingleFlight, get_executor, submit_in_app_context, write_json_atomic
+
+CALENDAR_URL = "https://calendarific.com/api/v2/holidays"
+NATIONAL = "National holiday"
+ALL_TYPES = "*"
+# ISO 3166-1 alpha-2, as Calendarific expects. Codes become upstream calls
+# and file names, so nothing else gets through.
+COUNTRY_CODE = re.compile(r"^[A-Z]{2}$")
+
+# Short names accepted by /api/holidays/upcoming?types=
+TYPE_ALIASES = {
+    "national": NATIONAL,
+    "observance": "Observance",
+    "local": "Local holiday",
+    "common_local": "Common local holiday",
+    "religious": "Religious",
+    "season": "Season",
+}
+
+# (country, year) -> HolidayCalendar, backed by one JSON file per calendar
+# in HOLIDAY_CACHE_DIR so restarts don't re-download the year
+_calendars = {}
+_calendars_lock = threading.Lock()
+_flight = SingleFlight(timeout=20)
+
+
+class HolidayCalendar:
+    def __init__(self, country, year, holidays, fetched_at):
+        self.country = country
+        self.year = year
+        self.fetched_at = fetched_at
+        self.holidays = sorted(holidays, key=lambda h: h["date"])
+        # Precomputed per holiday type (plus ALL_TYPES): sorted date
+        # ordinals for bisect and the matching holidays
+        self._indexes = {}
+        for holiday in self.holidays:
+            ordinal = datetime.date.fromisoformat(holiday["date"]).toordinal()
+            for holiday_type in list(holiday["type"]) + [ALL_TYPES]:
+                ordinals, matches = self._indexes.setdefault(holiday_type, ([], []))
+                ordinals.append(ordinal)
+                matches.append(holiday)
+
+    def index(self, holiday_type):
+        return self._indexes.get(holiday_type, ([], []))
+
+    def types(self):
+        return sorted(t for t in self._indexes if t != ALL_TYPES)
+
+    def on(self, day, holiday_type=NATIONAL):
+        ordinals, matches = self.index(holiday_type)
+        lo = bisect.bisect_left(ordinals, day.toordinal())
+        hi = bisect.bisect_right(ordinals, day.toordinal())
+        return matches[lo:hi]
+
+    def between(self, start, end, holiday_type=NATIONAL):
+        # Holidays with start <= date <= end
+        ordinals, matches = self.index(holiday_type)
+        lo = bisect.bisect_left(ordinals, start.toordinal())
+        hi = bisect.bisect_right(ordinals, end.toordinal())
+        return matches[lo:hi]
+
+    def next_after(self, day, holiday_type=NATIONAL):
+        ordinals, matches = self.index(holiday_type)
+        i = bisect.bisect_right(ordinals, day.toordinal())
+        return matches[i] if i < len(matches) else None
+
+
+def _calendar_path(country, year):
+    return os.path.join(current_app.config["HOLIDAY_CACHE_DIR"], f"{country}-{year}.json")
 
-@ttl_cache(ttl_seconds=600)
-def get_holiday_info(country="US"):
-    api_key = current_app.config["HOLIDAY_API_KEY"]
-    tomorrow = datetime.datetime.utcnow().date() + datetime.timedelta(days=1)
 
-    url = "https://calendarific.com/api/v2/holidays"
-    
-    # Check tomorrow
+def _is_expired(fetched_at):
+    max_age = current_app.config.get("HOLIDAY_CALENDAR_MAX_AGE_DAYS", 30) * 86400
+    return time.time() - fetched_at > max_age
+
+
+def _read_from_disk(country, year):
+    path = _calendar_path(country, year)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+        return HolidayCalendar(country, year, data["holidays"], data["fetched_at"])
+    except (OSError, ValueError, KeyError) as e:
+        print(f"❌ Ignoring unreadable holiday calendar {path}: {e}")
+        return None
+
+
+def _write_to_disk(calendar):
+    write_json_atomic(_calendar_path(calendar.country, calendar.year),
+                      {"fetched_at": calendar.fetched_at, "holidays": calendar.holidays})
+
+
+def _download(country, year):
     params = {
-        "api_key": api_key,
+        "api_key": current_app.config["HOLIDAY_API_KEY"],
         "country": country,
-        "year": tomorrow.year,
-        "month": tomorrow.month,
-        "day": tomorrow.day
+        "year": year
     }
+    response = http_client.get(CALENDAR_URL, params=params)
+    response.raise_for_status()
+    holidays = response.json().get("response", {}).get("holidays", [])
+    return [
+        {
+            "name": h.get("name", "Holiday"),
+            "date": h["date"]["iso"][:10],
+            "type": h.get("type", []),
+            "locations": h.get("locations"),
+        }
+        for h in holidays
+    ]
+
+
+def _load_calendar(country, year):
+    key = (country, year)
+    with _calendars_lock:
+        calendar = _calendars.get(key)
+    if calendar is not None and not _is_expired(calendar.fetched_at):
+        return calendar
+
+    fallback = calendar
+    disk = _read_from_disk(country, year)
+    if disk is not None:
+        if not _is_expired(disk.fetched_at):
+            with _calendars_lock:
+                _calendars[key] = disk
+            return disk
+        fallback = disk
+
+    try:
+        calendar = HolidayCalendar(country, year, _download(country, year), time.time())
+    except Exception:
+        # An old calendar beats no calendar
+        if fallback is not None:
+            return fallback
+        raise
+    try:
+        _write_to_disk(calendar)
+    except Exception as e:
+        print(f"❌ Error saving holiday calendar: {e}")
+    with _calendars_lock:
+        _calendars[key] = calendar
+    return calendar
+
+
+def is_country_code(country):
+    return bool(COUNTRY_CODE.match(country))
+
+
+def get_calendar(country, year):
+    country = country.upper()
+    if not is_country_code(country):
+        raise ValueError(f"Invalid country code: {country!r}")
+    with _calendars_lock:
+        calendar = _calendars.get((country, year))
+    if calendar is not None and not _is_expired(calendar.fetched_at):
+        return calendar
+    return _flight.do((country, year), _load_calendar, country, year)
+
+
+def _prefetch(country, year):
+    with _calendars_lock:
+        if (country.upper(), year) in _calendars:
+            return
+
+    def run():
+        try:
+            get_calendar(country, year)
+        except Exception as e:
+            print(f"❌ Error prefetching {year} holidays: {e}")
+    submit_in_app_context(get_executor("holiday", current_app.config.get("HOLIDAY_MAX_CONCURRENCY", 4)), run)
+
+
+@ttl_cache(ttl_seconds=600, max_entries=16, flight_timeout=20,
+           stale_seconds=3600, max_age=3600)
+def get_holiday_info(country="US"):
+    tomorrow = datetime.datetime.utcnow().date() + datetime.timedelta(days=1)
 
     try:
-        response = requests.get(url, params=params)
-        holidays = response.json().get("response", {}).get("holidays", [])
-        
-        # Filter for National holidays only
-        holidays = [h for h in holidays if 'National holiday' in h.get('type', [])]
-        
+        calendar = get_calendar(country, tomorrow.year)
+        if tomorrow.month == 12:
+            # Have next year ready before the rollover
+            _prefetch(country, tomorrow.year + 1)
+
+        holidays = calendar.on(tomorrow)
         if holidays:
             name = holidays[0].get("name", "Holiday")
             return {
                 "is_holiday": True,
                 "message": f"🎉 Tomorrow is {name}!"
             }
-            
-        # If not holiday, find next one
-        upcoming_params = {
-            "api_key": api_key,
-            "country": country,
-            "year": tomorrow.year
-        }
-        upcoming_response = requests.get(url, params=upcoming_params)
-        all_holidays = upcoming_response.json().get("response", {}).get("holidays", [])
-        
-        # Filter for National holidays only
-        all_holidays = [h for h in all_holidays if 'National holiday' in h.get('type', [])]
-        
-        future_holidays = [h for h in all_holidays if datetime.date.fromisoformat(h["date"]["iso"][:10]) > tomorrow]
-        future_holidays.sort(key=lambda h: datetime.date.fromisoformat(h["date"]["iso"][:10]))
-        
-        if future_holidays:
-            next_holiday = future_holidays[0]
-            next_date = datetime.date.fromisoformat(next_holiday["date"]["iso"][:10])
+
+        # If not holiday, find next one (possibly early next year)
+        next_holiday = calendar.next_after(tomorrow)
+        if next_holiday is None:
+            try:
+                next_holiday = get_calendar(country, tomorrow.year + 1).next_after(tomorrow)
+            except Exception as e:
+                print(f"❌ Error fetching next year's holidays: {e}")
+
+        if next_holiday:
+            next_date = datetime.date.fromisoformat(next_holiday["date"])
             delta = (next_date - tomorrow).days
             return {
                 "is_holiday": False,
                 "next_holiday_in_days": delta,
                 "message": f"🗓️ Tomorrow is not a holiday. {delta} days left until {next_holiday['name']}."
             }
-            
+
         return {"is_holiday": False, "message": "No upcoming holidays found."}
-        
+
     except Exception as e:
         print(f"❌ Error fetching holiday: {e}")
         return {"is_holiday": False, "message": "⚠️ Error fetching holiday info."}
+
+
+def resolve_types(names):
+    return [TYPE_ALIASES.get(name.strip().lower(), name.strip()) for name in names if name.strip()]
+
+
+def get_upcoming_holidays(countries, days=30, types=(NATIONAL,)):
+    # Holidays from tomorrow through the next `days` days for every
+    # country, merged in date order. Calendars that aren't loaded yet are
+    # fetched concurrently; everything else is bisect lookups.
+    start = datetime.datetime.utcnow().date() + datetime.timedelta(days=1)
+    end = start + datetime.timedelta(days=days - 1)
+    countries = list(dict.fromkeys(c.strip().upper() for c in countries if c.strip()))
+    years = range(start.year, end.year + 1)
+
+    executor = get_executor("holiday", current_app.config.get("HOLIDAY_MAX_CONCURRENCY", 4))
+    futures = {
+        (country, year): submit_in_app_context(executor, get_calendar, country, year)
+        for country in countries for year in years
+    }
+
+    results = []
+    errors = {}
+    for (country, year), future in futures.items():
+        try:
+            calendar = future.result()
+        except Exception as e:
+            print(f"❌ Error fetching {country} {year} holidays: {e}")
+            errors[country] = str(e)
+            continue
+        seen = set()
+        for holiday_type in types:
+            for holiday in calendar.between(start, end, holiday_type):
+                # A holiday listed under several requested types counts once
+                if id(holiday) in seen:
+                    continue
+                seen.add(id(holiday))
+                holiday_date = datetime.date.fromisoformat(holiday["date"])
+                results.append({
+                    "country": country,
+                    "name": holiday["name"],
+                    "date": holiday["date"],
+                    "type": holiday["type"],
+                    "locations": holiday.get("locations"),
+                    "days_until": (holiday_date - start).days + 1
+                })
+
+    results.sort(key=lambda h: (h["date"], h["country"], h["name"]))
+    return {"start": start.isoformat(), "end": end.isoformat(), "holidays": results, "errors": errors}
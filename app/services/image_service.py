@@ -1,11 +1,21 @@
 import os
-import random
 import io
-from PIL import Image
+import time
+import random
+import uuid
+from concurrent.futures import wait, as_completed, FIRST_COMPLETED
+import click
 from flask import current_app
+from flask.cli import with_appcontext
 import cloudinary
 import cloudinary.uploader
 import cloudinary.api
+import cloudinary.search
+import cloudinary.utils
+
+from app import image_pipeline, http_client
+from app.utils import ttl_cache, get_executor, submit_in_app_context
+from app.services import dish_catalog, hash_index, image_store, settings_service
 
 # No longer needed
 # DISH_IMAGE_MAP_PATH = 'dish_image_map.json'
@@ -17,101 +27,302 @@ def _configure_cloudinary():
         api_secret=current_app.config['CLOUDINARY_API_SECRET']
     )
 
-def get_all_images():
+FOLDER = "restaurant_assistant/dishes"
+SEARCH_PAGE_SIZE = 500
+
+# Ways a bulk or single upload can treat a near-duplicate of a library image
+DUPLICATE_MODES = ("reject", "flag", "allow")
+# Largest max_distance accepted for duplicate lookups
+MAX_DISTANCE = hash_index.MAX_DISTANCE
+
+class DuplicateImage(Exception):
+    def __init__(self, duplicates):
+        super().__init__("Near-duplicate of an image already in the library")
+        self.duplicates = duplicates
+
+def _context_of(resource):
+    # The Admin API nests context under "custom", the Search API doesn't
+    context = resource.get('context') or {}
+    return context.get('custom', context)
+
+def _dish_of(resource):
+    # Try to find dish name from tags
+    for tag in resource.get('tags', []):
+        if tag.startswith('dish_'):
+            return tag[5:] # Remove 'dish_' prefix
+
+    # Fallback to context if no tag (for backward compatibility or manual uploads)
+    custom = _context_of(resource)
+    if 'caption' in custom:
+        return custom['caption']
+    return dish_catalog.UNCATEGORIZED
+
+def _record_of(resource):
+    return {
+        "public_id": resource.get('public_id'),
+        "dish_name": _dish_of(resource),
+        "url": resource.get('secure_url'),
+        "created_at": resource.get('created_at'),
+        # Set by our uploads, so a rebuilt mirror keeps the hashes
+        "phash": _context_of(resource).get('phash')
+    }
+
+def sync_catalog(full=False):
+    # Mirror the Cloudinary folder into the local image store. Pages come
+    # newest first; an incremental sync stops at the first page reaching
+    # images it already has, a full sync reads every page and then drops
+    # images Cloudinary no longer has. Our own uploads, deletes and
+    # recategorizations are written through, so full syncs (every
+    # IMAGE_CATALOG_FULL_SYNC_HOURS) only catch changes made elsewhere.
     _configure_cloudinary()
+    store = image_store.get_store()
+    started = time.time()
+    last_full = store.get_state("last_full_sync")
+    max_age = current_app.config.get("IMAGE_CATALOG_FULL_SYNC_HOURS", 24) * 3600
+    full = full or last_full is None or started - float(last_full) > max_age
+    watermark = None if full else store.latest_created_at()
+
+    cursor = None
+    pages = 0
+    changed = 0
+    while True:
+        query = cloudinary.search.Search()\
+            .expression(f"resource_type:image AND folder:{FOLDER}")\
+            .with_field("tags")\
+            .with_field("context")\
+            .sort_by("created_at", "desc")\
+            .max_results(SEARCH_PAGE_SIZE)
+        if cursor:
+            query = query.next_cursor(cursor)
+        result = query.execute()
+        resources = result.get('resources', [])
+        changed += store.upsert([_record_of(r) for r in resources], started)
+        pages += 1
+        if watermark and any((r.get('created_at') or "") < watermark for r in resources):
+            break
+        cursor = result.get('next_cursor')
+        if not cursor:
+            break
+
+    removed = 0
+    if full:
+        removed = store.sweep(started)
+        store.set_state("last_full_sync", str(started))
+    store.set_state("last_sync", str(started))
+    return {"full": full, "pages": pages, "images": changed, "removed": removed}
+
+@ttl_cache(ttl_seconds=300, max_entries=1, flight_timeout=120, stale_seconds=86400)
+def ensure_catalog_synced():
+    # At most one sync every 5 minutes; once the mirror has data, later
+    # syncs run in the background while reads use what is there
+    return sync_catalog()
+
+def _synced_store():
+    store = image_store.get_store()
     try:
-        # Fetch resources from the specific folder
-        # We need tags and context to group them
-        result = cloudinary.api.resources(
-            type="upload",
-            prefix="restaurant_assistant/dishes/", # Filter by folder
-            tags=True,
-            context=True,
-            max_results=500 # Adjust as needed
-        )
-        
-        images_by_dish = {}
-        
-        for resource in result.get('resources', []):
-            # Try to find dish name from tags
-            dish_name = "Uncategorized"
-            tags = resource.get('tags', [])
-            for tag in tags:
-                if tag.startswith('dish_'):
-                    dish_name = tag[5:] # Remove 'dish_' prefix
-                    break
-            
-            # Fallback to context if no tag (for backward compatibility or manual uploads)
-            if dish_name == "Uncategorized" and 'context' in resource:
-                custom = resource['context'].get('custom', {})
-                if 'caption' in custom:
-                    dish_name = custom['caption']
-            
-            if dish_name not in images_by_dish:
-                images_by_dish[dish_name] = []
-                
-            images_by_dish[dish_name].append({
-                "url": resource.get('secure_url'),
-                "public_id": resource.get('public_id'),
-                "created_at": resource.get('created_at')
-            })
-            
-        return images_by_dish
-        
+        ensure_catalog_synced()
+    except Exception as e:
+        print(f"❌ Error syncing Cloudinary catalog: {e}")
+        if store.get_state("last_sync") is None:
+            raise
+    return store
+
+def get_all_images():
+    try:
+        return _synced_store().images_by_dish()
     except Exception as e:
         print(f"Error fetching images from Cloudinary: {e}")
         return {}
 
-def upload_image(file, dish_name):
+def _load_catalog():
+    # Unlike get_all_images, errors propagate so a failed sync never
+    # empties the catalog
+    return _synced_store().catalog_records()
+
+_catalog = dish_catalog.DishCatalog(_load_catalog)
+
+def _load_hashes():
+    return _synced_store().hashes()
+
+def _hashes_version():
+    return image_store.get_store().hashes_version()
+
+# Shared by every worker through image_hashes: each reloads when another
+# one has changed it
+_hashes = hash_index.HashIndex(_load_hashes, _hashes_version)
+
+def resync_catalog(full=False):
+    result = sync_catalog(full=full)
+    _catalog.refresh()
+    _hashes.refresh()
+    return result
+
+def get_dish_names():
+    # Every dish in the library, from memory
+    return _catalog.dish_names()
+
+def get_dishes_with_images():
+    # Dishes that have at least one image (no "Uncategorized"), from memory
+    return _catalog.dishes_with_images()
+
+def _describe_duplicates(matches):
+    # [(distance, key)] from the hash index -> what the API reports. Keys of
+    # images still being uploaded have no library entry yet.
+    found = image_store.get_store().describe(key for _, key in matches)
+    return [
+        dict(found.get(key, {}), public_id=key if key in found else None, distance=distance)
+        for distance, key in matches
+    ]
+
+def _duplicate_mode(duplicates=None):
+    mode = duplicates or current_app.config.get("IMAGE_DUPLICATE_MODE", "reject")
+    if mode not in DUPLICATE_MODES:
+        print(f"❌ Invalid IMAGE_DUPLICATE_MODE {mode!r}, rejecting duplicates")
+        return "reject"
+    return mode
+
+def _max_distance(max_distance=None):
+    # Bits two hashes may differ by, kept within what the hash index can
+    # look up without scanning every hash
+    if max_distance is None:
+        max_distance = current_app.config.get("IMAGE_DUPLICATE_MAX_DISTANCE", 6)
+    return min(max(max_distance, 0), MAX_DISTANCE)
+
+def _upload_processed(processed, dish_name, duplicates=None):
+    # Pushes an already processed (JPEG bytes, dHash) pair to Cloudinary and
+    # writes the new image through to the mirror, the catalog and the hash
+    # index. duplicates is one of DUPLICATE_MODES: near-duplicates of
+    # library images are rejected (DuplicateImage) before uploading, reported
+    # in the result, or ignored.
+    data, phash = processed
+    mode = _duplicate_mode(duplicates)
+    # Held in the index while uploading, so a copy in the same batch is caught
+    pending = f"pending:{uuid.uuid4().hex}"
+    matches = _hashes.claim(pending, phash, _max_distance(), exclusive=mode == "reject")
+    if matches and mode == "reject":
+        raise DuplicateImage(_describe_duplicates(matches))
+
+    # Tag format: dish_{dish_name}
+    # Context: caption={dish_name}, phash={dHash as hex}
+    clean_dish_name = dish_name.strip()
+    tag = f"dish_{clean_dish_name}"
+    phash = f"{phash:016x}"
+
+    try:
+        upload_result = cloudinary.uploader.upload(
+            io.BytesIO(data),
+            folder=FOLDER,
+            tags=[tag],
+            context={"caption": clean_dish_name, "phash": phash},
+            resource_type="image"
+        )
+    except Exception:
+        _hashes.remove(pending)
+        raise
+
+    record = dict(_record_of(upload_result), phash=phash)
+    # Stored first, so other workers see it, and in the index before the
+    # pending key goes, so the hash is never missing
+    image_store.get_store().upsert([record], time.time())
+    _hashes.add(record['public_id'], int(phash, 16))
+    _hashes.remove(pending)
+    _catalog.add(record['public_id'], clean_dish_name, record['url'])
+    result = {
+        "url": upload_result.get('secure_url'),
+        "public_id": upload_result.get('public_id')
+    }
+    if matches and mode == "flag":
+        result["duplicates"] = _describe_duplicates(matches)
+    return result
+
+def upload_image(file, dish_name, duplicates=None):
     _configure_cloudinary()
     if not file:
         return False, "No file provided"
     
     try:
         # Optimize image before upload (optional, Cloudinary can also do it)
-        # But let's do basic resizing here to save bandwidth
-        img = Image.open(file)
-        if img.mode in ('RGBA', 'P'):
-            img = img.convert('RGB')
-            
-        max_width = 1440
-        if img.width > max_width:
-            ratio = max_width / img.width
-            new_height = int(img.height * ratio)
-            img = img.resize((max_width, new_height), Image.Resampling.LANCZOS)
-            
-        img_io = io.BytesIO()
-        img.save(img_io, 'JPEG', quality=85)
-        img_io.seek(0)
-        
-        # Upload
-        # Tag format: dish_{dish_name}
-        # Context: caption={dish_name}
-        clean_dish_name = dish_name.strip()
-        tag = f"dish_{clean_dish_name}"
-        
-        upload_result = cloudinary.uploader.upload(
-            img_io,
-            folder="restaurant_assistant/dishes",
-            tags=[tag],
-            context={"caption": clean_dish_name},
-            resource_type="image"
-        )
-        
-        return True, {
-            "url": upload_result.get('secure_url'),
-            "public_id": upload_result.get('public_id')
-        }
-        
+        # But let's do basic resizing here to save bandwidth. Decoding and
+        # resizing run in the image process pool, not on this thread.
+        return True, _upload_processed(image_pipeline.process(file.read()), dish_name, duplicates)
+
+    except DuplicateImage as e:
+        return False, {"error": str(e), "duplicates": e.duplicates}
     except Exception as e:
         print(f"Error uploading to Cloudinary: {e}")
         return False, str(e)
 
+def iter_bulk_upload(files, duplicates=None):
+    # files: [(filename, data, dish_name)]. Yields one result dict per file
+    # as soon as it is uploaded or has failed, in completion order (see
+    # _upload_processed for duplicates). Images are resized in the process
+    # pool, no more at a time than it has workers so the timeout measures
+    # work rather than queueing, and uploaded on up to
+    # IMAGE_UPLOAD_CONCURRENCY threads at the same time.
+    _configure_cloudinary()
+    uploader = get_executor("cloudinary_upload", current_app.config.get("IMAGE_UPLOAD_CONCURRENCY", 4))
+    in_flight = current_app.config.get("IMAGE_PROCESS_WORKERS", 2)
+    timeout = current_app.config.get("IMAGE_PROCESS_TIMEOUT", 60)
+    queued = list(enumerate(files))
+    queued.reverse()
+    processing = {}
+    uploading = {}
+
+    def result(index, error=None, uploaded=None):
+        filename, _, dish_name = files[index]
+        uploaded = dict(uploaded or {})
+        if isinstance(error, DuplicateImage):
+            uploaded["duplicates"] = error.duplicates
+        elif error is not None:
+            print(f"❌ Error uploading {filename}: {error}")
+        return dict(uploaded, index=index, filename=filename, dish_name=dish_name,
+                    ok=error is None, error=str(error) if error is not None else None)
+
+    while queued or processing or uploading:
+        while queued and len(processing) < in_flight:
+            index, (_, data, _) = queued.pop()
+            try:
+                processing[image_pipeline.submit(data)] = index
+            except Exception as e:
+                yield result(index, e)
+
+        done, _ = wait(list(processing) + list(uploading), timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done:
+            # Nothing finished in time: give up on the images still being
+            # resized and move the rest of the batch to a fresh pool
+            if processing:
+                image_pipeline.restart()
+            for future, index in list(processing.items()):
+                del processing[future]
+                yield result(index, "Timed out processing image")
+            continue
+
+        for future in done:
+            if future in processing:
+                index = processing.pop(future)
+                try:
+                    processed = future.result()
+                except Exception as e:
+                    yield result(index, e)
+                    continue
+                uploading[submit_in_app_context(uploader, _upload_processed, processed, files[index][2], duplicates)] = index
+            else:
+                index = uploading.pop(future)
+                try:
+                    uploaded = future.result()
+                except Exception as e:
+                    yield result(index, e)
+                    continue
+                yield result(index, uploaded=uploaded)
+
 def delete_image(public_id, dish_name=None):
     # dish_name is unused but kept for API signature compatibility if needed
     _configure_cloudinary()
     try:
         cloudinary.uploader.destroy(public_id)
+        image_store.get_store().delete(public_id)
+        _catalog.remove(public_id)
+        _hashes.remove(public_id)
         return True
     except Exception as e:
         print(f"Error deleting from Cloudinary: {e}")
@@ -129,6 +340,8 @@ def update_image_category(public_id, old_dish, new_dish):
         cloudinary.uploader.add_tag(new_tag, [public_id])
         # Update context
         cloudinary.uploader.add_context({"caption": new_dish}, [public_id])
+        image_store.get_store().set_dish(public_id, new_dish)
+        _catalog.add(public_id, new_dish)
         
         return True
     except Exception as e:
@@ -136,85 +349,78 @@ def update_image_category(public_id, old_dish, new_dish):
         return False
 
 def get_random_image_for_dish(dish_name):
-    _configure_cloudinary()
+    # Exact, alias, word and substring matches in one in-memory lookup
+    # (see DishCatalog.find_images); aliases come from settings
     try:
-        # Use Search API to find images with the specific tag
-        # 1. Exact Match
-        tag = f"dish_{dish_name}"
-        result = _search_cloudinary(tag)
-        if result: return result
-
-        # 2. Alias / Synonym Check (Hardcoded for common mapping)
-        # e.g. "Chicken Banhmi" -> "Chicken Sandwich"
-        
-        # Define base aliases
-        aliases = {
-            "Banhmi": "Sandwich",
-            "Bánh Mì": "Sandwich",
-            "Banh Mi": "Sandwich"
-        }
-        
-        mapped_name = dish_name
-        for key, value in aliases.items():
-            if key.lower() in mapped_name.lower():
-                mapped_name = mapped_name.lower().replace(key.lower(), value).title() # Simple replace
-        
-        if mapped_name != dish_name:
-            tag = f"dish_{mapped_name}"
-            result = _search_cloudinary(tag)
-            if result: return result
-
-        # 3. Fallback: If the name contains "Sandwich", try searching for just "Sandwich" category
-        # This handles "Chicken Sandwich" -> finding "Sandwich" generic images
-        if "Sandwich" in dish_name and dish_name != "Sandwich":
-             tag = "dish_Sandwich"
-             result = _search_cloudinary(tag)
-             if result: return result
-
-        # 4. Super Fallback (Python-side filtering):
-        # If Search API fails or index is slow, we use our own list.
-        if len(dish_name.split()) == 1: 
-             all_images = get_all_images() # Uses cached result if possible or fetches fresh
-             matches = []
-             target = dish_name.lower()
-             
-             for dish_key, images in all_images.items():
-                 # Check if the dish category itself contains the target word
-                 # e.g. dish_key="Chicken Sandwich" contains "sandwich"
-                 if target in dish_key.lower():
-                     matches.extend(images)
-            
-             if matches:
-                 selected = random.choice(matches)
-                 return selected['url']
-
-        return None
-
+        urls = _catalog.find_images(dish_name, settings_service.get_dish_aliases())
     except Exception as e:
-        print(f"Error searching Cloudinary: {e}")
+        print(f"Error searching dish catalog: {e}")
         return None
+    return random.choice(urls) if urls else None
 
-def _search_cloudinary(tag, exact=True):
-    try:
-        # If exact match, use quotes for strict tag matching
-        # If broad (exact=False), use wildcard pattern
-        tag_query = f"\"{tag}\"" if exact else tag
-        
-        expression = f"resource_type:image AND tags:{tag_query} AND folder:restaurant_assistant/dishes"
-        
-        result = cloudinary.search.Search()\
-            .expression(expression)\
-            .max_results(50)\
-            .execute()
-            
-        resources = result.get('resources', [])
-        if resources:
-            selected = random.choice(resources)
-            return selected.get('secure_url')
-    except Exception as e:
-        print(f"Error searching Cloudinary for {tag}: {e}")
-    return None
-        
+def _thumbnail_hash(public_id, url):
+    # Hashing a small Cloudinary rendition is as good as the full image
+    thumbnail = cloudinary.utils.cloudinary_url(public_id, width=256, crop="limit", format="jpg", secure=True)[0]
+    response = http_client.get(thumbnail or url)
+    response.raise_for_status()
+    return image_pipeline.hash_image(response.content)
+
+def find_duplicates(max_distance=None):
+    # Groups of near-identical library images, largest first, from the
+    # hashes already stored
+    groups = _hashes.groups(_max_distance(max_distance))
+    found = image_store.get_store().describe(key for group in groups for key in group)
+    groups = [[dict(found[key], public_id=key) for key in sorted(group) if key in found] for group in groups]
+    return [group for group in groups if len(group) > 1]
+
+def scan_duplicates(max_distance=None, limit=None):
+    # Batch job for the existing library: hashes up to limit (default
+    # IMAGE_HASH_SCAN_BATCH) images uploaded before hashing existed (or
+    # outside the app), IMAGE_UPLOAD_CONCURRENCY at a time, then reports the
+    # duplicate groups and how many images are left to hash
+    _configure_cloudinary()
+    store = _synced_store()
+    missing = store.unhashed(limit or current_app.config.get("IMAGE_HASH_SCAN_BATCH", 200))
+    executor = get_executor("image_hash", current_app.config.get("IMAGE_UPLOAD_CONCURRENCY", 4))
+    futures = {submit_in_app_context(executor, _thumbnail_hash, public_id, url): public_id
+               for public_id, url in missing}
+    failed = 0
+    for future in as_completed(futures):
+        public_id = futures[future]
+        try:
+            phash = future.result()
+        except Exception as e:
+            print(f"❌ Error hashing {public_id}: {e}")
+            failed += 1
+            continue
+        store.set_hash(public_id, f"{phash:016x}")
+        _hashes.add(public_id, phash)
+    groups = find_duplicates(max_distance)
+    return {
+        "hashed": len(missing) - failed,
+        "failed": failed,
+        "remaining": store.count_unhashed(),
+        "duplicates": sum(len(group) - 1 for group in groups),
+        "groups": groups,
+    }
+
+@click.command("scan-duplicates")
+@click.option("--max-distance", type=click.IntRange(0, MAX_DISTANCE), default=None,
+              help="Bits two hashes may differ by (default IMAGE_DUPLICATE_MAX_DISTANCE).")
+@with_appcontext
+def scan_duplicates_command(max_distance):
+    # Batch after batch until everything is hashed or a batch only failed
+    hashed = failed = 0
+    while True:
+        result = scan_duplicates(max_distance)
+        hashed += result['hashed']
+        failed += result['failed']
+        click.echo(f"Hashed {hashed} images ({failed} failed), {result['remaining']} left")
+        if not result['remaining'] or not result['hashed']:
+            break
+    click.echo(f"{result['duplicates']} duplicates in {len(result['groups'])} groups")
+    for group in result['groups']:
+        click.echo("  " + ", ".join(f"{image['public_id']} ({image['dish_name']})" for image in group))
 
 
 def optimize_image_for_instagram(filename):
@@ -0,0 +1,150 @@
+import threading
+from flask import current_app
+
+from app.db import SQLiteDB
+
+# Local mirror of the Cloudinary dish library, kept in sync by
+# image_service.sync_catalog() so library reads never list Cloudinary.
+# seen_at is the start time of the last sync that saw an image; a full sync
+# deletes rows it didn't see. image_hashes holds each image's perceptual
+# hash (hex dHash) for duplicate detection; triggers count every change to
+# it in sync_state.hashes_version, so each worker's HashIndex can tell when
+# another worker has added or removed one.
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS images ("
+    " public_id TEXT PRIMARY KEY,"
+    " dish_name TEXT NOT NULL,"
+    " url TEXT,"
+    " created_at TEXT,"
+    " seen_at REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS images_dish ON images (dish_name)",
+    "CREATE TABLE IF NOT EXISTS image_hashes ("
+    " public_id TEXT PRIMARY KEY,"
+    " phash TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS sync_state ("
+    " name TEXT PRIMARY KEY,"
+    " value TEXT)",
+    "INSERT OR IGNORE INTO sync_state (name, value) VALUES ('hashes_version', '0')",
+) + tuple(
+    f"CREATE TRIGGER IF NOT EXISTS image_hashes_{event.lower()} AFTER {event} ON image_hashes BEGIN"
+    " UPDATE sync_state SET value = CAST(value AS INTEGER) + 1 WHERE name = 'hashes_version'; END"
+    for event in ("INSERT", "UPDATE", "DELETE")
+)
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store():
+    path = current_app.config["IMAGE_STORE_PATH"]
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = ImageStore(path)
+        return store
+
+
+class ImageStore:
+    def __init__(self, path):
+        self.db = SQLiteDB(path, schema=SCHEMA)
+
+    def upsert(self, images, seen_at):
+        # images: dicts with public_id, dish_name, url and created_at, and
+        # phash when it is known
+        with self.db.transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO images (public_id, dish_name, url, created_at, seen_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                [(i["public_id"], i["dish_name"], i["url"], i["created_at"], seen_at) for i in images],
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO image_hashes (public_id, phash) VALUES (?, ?)",
+                [(i["public_id"], i["phash"]) for i in images if i.get("phash")],
+            )
+        return len(images)
+
+    def delete(self, public_id):
+        with self.db.transaction() as conn:
+            conn.execute("DELETE FROM images WHERE public_id = ?", (public_id,))
+            conn.execute("DELETE FROM image_hashes WHERE public_id = ?", (public_id,))
+
+    def set_dish(self, public_id, dish_name):
+        self.db.execute("UPDATE images SET dish_name = ? WHERE public_id = ?", (dish_name, public_id))
+
+    def sweep(self, seen_before):
+        # Images a full sync didn't see have been deleted in Cloudinary
+        with self.db.transaction() as conn:
+            removed = conn.execute("DELETE FROM images WHERE seen_at < ?", (seen_before,)).rowcount
+            conn.execute("DELETE FROM image_hashes WHERE public_id NOT IN (SELECT public_id FROM images)")
+        return removed
+
+    def latest_created_at(self):
+        return self.db.execute("SELECT MAX(created_at) FROM images").fetchone()[0]
+
+    def count(self):
+        return self.db.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def images_by_dish(self):
+        # Same shape image_service.get_all_images() has always returned
+        images_by_dish = {}
+        rows = self.db.execute(
+            "SELECT dish_name, url, public_id, created_at FROM images ORDER BY dish_name, created_at DESC"
+        )
+        for dish_name, url, public_id, created_at in rows:
+            images_by_dish.setdefault(dish_name, []).append(
+                {"url": url, "public_id": public_id, "created_at": created_at}
+            )
+        return images_by_dish
+
+    def catalog_records(self):
+        # {public_id: (dish_name, url)} for the in-memory DishCatalog
+        rows = self.db.execute("SELECT public_id, dish_name, url FROM images")
+        return {public_id: (dish_name, url) for public_id, dish_name, url in rows}
+
+    def hashes(self):
+        # {public_id: dHash as int} for the in-memory HashIndex
+        rows = self.db.execute("SELECT public_id, phash FROM image_hashes")
+        return {public_id: int(phash, 16) for public_id, phash in rows}
+
+    def hashes_version(self):
+        return int(self.get_state("hashes_version"))
+
+    def set_hash(self, public_id, phash):
+        self.db.execute("INSERT OR REPLACE INTO image_hashes (public_id, phash) VALUES (?, ?)", (public_id, phash))
+
+    def unhashed(self, limit=-1):
+        # [(public_id, url)] of images the duplicate scan hasn't hashed yet
+        return self.db.execute(
+            "SELECT public_id, url FROM images"
+            " WHERE public_id NOT IN (SELECT public_id FROM image_hashes)"
+            " ORDER BY public_id LIMIT ?", (limit,)
+        ).fetchall()
+
+    def count_unhashed(self):
+        return self.db.execute(
+            "SELECT COUNT(*) FROM images"
+            " WHERE public_id NOT IN (SELECT public_id FROM image_hashes)"
+        ).fetchone()[0]
+
+    def describe(self, public_ids):
+        # {public_id: {"url", "dish_name"}} for the given images
+        public_ids = list(public_ids)
+        found = {}
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(public_ids), 500):
+            chunk = public_ids[start:start + 500]
+            rows = self.db.execute(
+                f"SELECT public_id, dish_name, url FROM images WHERE public_id IN ({','.join('?' * len(chunk))})",
+                chunk,
+            )
+            for public_id, dish_name, url in rows:
+                found[public_id] = {"url": url, "dish_name": dish_name}
+        return found
+
+    def get_state(self, name):
+        row = self.db.execute("SELECT value FROM sync_state WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_state(self, name, value):
+        self.db.execute("INSERT OR REPLACE INTO sync_state (name, value) VALUES (?, ?)", (name, value))
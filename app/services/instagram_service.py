@@ -1,4 +1,4 @@
-import requests
+from app import http_client
 import os
 from flask import current_app
 
@@ -18,7 +18,7 @@ def post_to_instagram(image_url, caption):
     }
     
     try:
-        upload_res = requests.post(upload_url, data=upload_payload)
+        upload_res = http_client.post(upload_url, data=upload_payload)
         result = upload_res.json()
         creation_id = result.get("id")
         
@@ -32,7 +32,7 @@ def post_to_instagram(image_url, caption):
             "access_token": access_token
         }
         
-        publish_res = requests.post(publish_url, data=publish_payload)
+        publish_res = http_client.post(publish_url, data=publish_payload)
         if publish_res.status_code == 200:
             return {"success": True, "id": publish_res.json().get("id")}
         else:
@@ -53,7 +53,7 @@ def refresh_access_token():
     }
     
     try:
-        response = requests.get(url, params=params)
+        response = http_client.get(url, params=params)
         data = response.json()
         
         if response.status_code == 200:
@@ -83,7 +83,7 @@ def check_token_status():
     }
     
     try:
-        response = requests.get(url, params=params)
+        response = http_client.get(url, params=params)
         data = response.json()
         
         if response.status_code == 200 and 'data' in data:
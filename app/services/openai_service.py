@@ -1,91 +1,309 @@
 import os
 import json
+import time
+import random
 import openai
+from contextlib import contextmanager
+from concurrent.futures import as_completed
 from flask import current_app
-from app.utils import ttl_cache
+from app import metrics, openai_client
+from app.utils import ttl_cache, make_key, get_executor, submit_in_app_context
 
-from app.services import settings_service, image_service
+from app.services import settings_service, image_service, caption_store
 
 # Hashtags are now fetched dynamically
 
+MODEL = "gpt-4"
+IMAGE_MODEL = "dall-e-3"
 
-def get_client():
-    return openai.OpenAI(api_key=current_app.config["OPENAI_API_KEY"])
+# Estimated USD list prices: (prompt, completion) per 1K tokens, and per
+# 1024x1024 image. Only used for the cost counters in /api/debug/openai.
+TOKEN_PRICES = {"gpt-4": (0.03, 0.06)}
+IMAGE_PRICES = {"dall-e-3": 0.04}
 
-@ttl_cache(ttl_seconds=600)
-def generate_caption(dish_name):
-    client = get_client()
-    try:
-        prompt = f"Write an Instagram caption to promote the Vietnamese dish '{dish_name}' in an appetizing, fun, and catchy way."
-        response = client.chat.completions.create(
-            model="gpt-4",
-            messages=[{"role": "user", "content": prompt}]
-        )
-        caption = response.choices[0].message.content.strip() + "\n\n" + settings_service.get_hashtags()
-        return {"caption": caption}
-    except Exception as e:
-        return {"caption": f"⚠️ Error generating caption: {str(e)}" + "\n\n" + settings_service.get_hashtags()}
 
-@ttl_cache(ttl_seconds=600)
-def generate_weather_caption(weather_data):
-    if not weather_data:
-        return {"caption": "⚠️ Weather data unavailable" + "\n\n" + settings_service.get_hashtags(), "dish_name": None}
-        
-    client = get_client()
-    
-    # Load dish map to get list of dishes
-    # Load dish map to get list of dishes
+@contextmanager
+def _instrumented(operation, model, mode):
+    # Wraps one OpenAI API call. The caller fills call["usage"] (or
+    # call["images"]); latency, tokens, estimated cost and outcome are
+    # recorded per operation, model, mode and route.
+    call = {"usage": None, "images": 0}
+    labels = {"operation": operation, "model": model, "mode": mode, "route": metrics.current_route()}
+    started = time.perf_counter()
+    status = "ok"
     try:
-        dish_image_map = image_service.get_all_images()
-        dish_list = list(dish_image_map.keys())
+        yield call
+    except GeneratorExit:
+        # Streaming client went away mid-response
+        status = "cancelled"
+        raise
+    except openai.RateLimitError:
+        status = "rate_limited"
+        raise
     except Exception:
-        dish_list = []
-        
+        status = "error"
+        raise
+    finally:
+        metrics.observe("openai_latency_ms", (time.perf_counter() - started) * 1000, **labels)
+        metrics.inc("openai_calls", status=status, **labels)
+        usage = call["usage"]
+        cost = 0.0
+        if usage is not None:
+            prompt_tokens = usage.prompt_tokens or 0
+            completion_tokens = usage.completion_tokens or 0
+            metrics.inc("openai_prompt_tokens", prompt_tokens, **labels)
+            metrics.inc("openai_completion_tokens", completion_tokens, **labels)
+            metrics.observe("openai_total_tokens", prompt_tokens + completion_tokens,
+                            buckets=metrics.TOKEN_BUCKETS, **labels)
+            prompt_price, completion_price = TOKEN_PRICES.get(model, (0, 0))
+            cost = (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+        if call["images"]:
+            metrics.inc("openai_images", call["images"], **labels)
+            cost += call["images"] * IMAGE_PRICES.get(model, 0)
+        if cost:
+            metrics.inc("openai_cost_usd", cost, **labels)
+
+def _record_cache(mode, result):
+    # result: "hit" (answered by the caption store) or "miss" (GPT called)
+    metrics.inc("openai_cache", mode=mode, result=result, route=metrics.current_route())
+
+def get_metrics():
+    stats = metrics.snapshot("openai_")
+    # Hits in the in-memory caches never reach the functions above, so take
+    # them from the caches themselves
+    stats["memory_cache"] = {
+        mode: {k: v for k, v in func.cache.stats().items() if k in ("hits", "misses", "stale_hits")}
+        for mode, (func, _, _) in CAPTION_MODES.items()
+    }
+    return stats
+
+def _sales_prompt(dish_name):
+    return f"Write an Instagram caption to promote the Vietnamese dish '{dish_name}' in an appetizing, fun, and catchy way."
+
+def _pick_weather_dish():
+    # Dishes with at least one library image, from the in-memory catalog
+    try:
+        dish_list = image_service.get_dishes_with_images()
+    except Exception as e:
+        print(f"❌ Error loading dish catalog: {e}")
+        dish_list = ()
+
     # Select a random dish if available, or just use generic
-    import random
-    selected_dish = random.choice(dish_list) if dish_list else "Vietnamese Pho"
+    return random.choice(dish_list) if dish_list else "Vietnamese Pho"
 
-    prompt = (
+def _weather_prompt(weather_data, selected_dish):
+    return (
         f"Write an Instagram caption recommending {selected_dish} for a {weather_data['description']} day "
         f"with a temperature of {weather_data['temp']}°F. "
         f"Make the caption appealing and cozy."
     )
-    
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4",
+
+def _holiday_prompt(holiday_message):
+    return (
+        f"Write an Instagram caption based on this holiday info: '{holiday_message}'. "
+        f"Connect it to enjoying delicious Vietnamese food. Make it festive and fun."
+    )
+
+def holiday_image_prompt(caption):
+    return f"A festive Vietnamese dish celebration. {caption}. Professional food photography."
+
+def _stored_completion(key, variant=False):
+    # The caption store's answer for key, or None if GPT has to be called.
+    # variant=True asks for a different completion: None (a new one) until
+    # the key holds CAPTION_VARIANTS_PER_KEY, then the stored ones in turn.
+    store = caption_store.get_store()
+    if not variant:
+        return store.current(key)
+    if store.is_full(key):
+        return store.rotate(key)
+    return None
+
+def _complete(prompt, mode, variant=False):
+    key = caption_store.content_key(MODEL, prompt)
+    text = _stored_completion(key, variant)
+    if text is not None:
+        _record_cache(mode, "hit")
+        return text
+    _record_cache(mode, "miss")
+    with _instrumented("chat", MODEL, mode) as call:
+        response = openai_client.call(lambda client: client.chat.completions.create(
+            model=MODEL,
             messages=[{"role": "user", "content": prompt}]
-        )
-        caption = response.choices[0].message.content.strip() + "\n\n" + settings_service.get_hashtags()
+        ))
+        call["usage"] = response.usage
+    text = response.choices[0].message.content.strip()
+    caption_store.get_store().add(key, text, MODEL, prompt)
+    return text
+
+def _sales_caption(dish_name, variant=False):
+    try:
+        caption = _complete(_sales_prompt(dish_name), 'sales', variant) + "\n\n" + settings_service.get_hashtags()
+        return {"caption": caption}
+    except Exception as e:
+        return {"caption": f"⚠️ Error generating caption: {str(e)}" + "\n\n" + settings_service.get_hashtags()}
+
+def _weather_caption(weather_data, variant=False):
+    if not weather_data:
+        return {"caption": "⚠️ Weather data unavailable" + "\n\n" + settings_service.get_hashtags(), "dish_name": None}
+
+    selected_dish = _pick_weather_dish()
+    prompt = _weather_prompt(weather_data, selected_dish)
+
+    try:
+        caption = _complete(prompt, 'weather', variant) + "\n\n" + settings_service.get_hashtags()
         return {"caption": caption, "dish_name": selected_dish}
     except Exception as e:
         return {"caption": f"⚠️ Error generating weather caption: {str(e)}" + "\n\n" + settings_service.get_hashtags(), "dish_name": None}
 
-@ttl_cache(ttl_seconds=600)
-def generate_holiday_caption(holiday_message):
-    client = get_client()
-    prompt = (
-        f"Write an Instagram caption based on this holiday info: '{holiday_message}'. "
-        f"Connect it to enjoying delicious Vietnamese food. Make it festive and fun."
-    )
+def _holiday_caption(holiday_message, variant=False):
+    prompt = _holiday_prompt(holiday_message)
     try:
-        response = client.chat.completions.create(
-            model="gpt-4",
-            messages=[{"role": "user", "content": prompt}]
-        )
-        return response.choices[0].message.content.strip() + "\n\n" + settings_service.get_hashtags()
+        return _complete(prompt, 'holiday', variant) + "\n\n" + settings_service.get_hashtags()
     except Exception as e:
         return f"⚠️ Error generating holiday caption: {str(e)}" + "\n\n" + settings_service.get_hashtags()
 
-def generate_image(prompt):
-    client = get_client()
+# The in-memory caches sit in front of the persistent caption store, which
+# survives restarts and their 10 minute TTL
+@ttl_cache(ttl_seconds=600, max_entries=64, max_bytes=256 * 1024, flight_timeout=60,
+           stale_seconds=3600)
+def generate_caption(dish_name):
+    return _sales_caption(dish_name)
+
+def iter_captions(dish_names):
+    # Yields (dish_name, result, cached) as each caption finishes. Cached
+    # captions come back first; the rest run concurrently, at most
+    # CAPTION_MAX_CONCURRENCY GPT calls at a time.
+    unique = list(dict.fromkeys(name for name in dish_names if name))
+    cache = generate_caption.cache
+    pending = []
+    for name in unique:
+        _, state = cache.lookup(make_key((name,), {}), record=False)
+        if state is not None:
+            # Fresh or stale-while-revalidate: answered without waiting on GPT
+            yield name, generate_caption(name), True
+        else:
+            pending.append(name)
+
+    if not pending:
+        return
+    executor = get_executor("captions", current_app.config.get("CAPTION_MAX_CONCURRENCY", 3))
+    futures = {submit_in_app_context(executor, generate_caption, name): name for name in pending}
+    for future in as_completed(futures):
+        yield futures[future], future.result(), False
+
+
+def generate_captions(dish_names):
+    return {name: dict(result, cached=cached) for name, result, cached in iter_captions(dish_names)}
+
+@ttl_cache(ttl_seconds=600, max_entries=32, max_bytes=128 * 1024, flight_timeout=60,
+           stale_seconds=3600)
+def generate_weather_caption(weather_data):
+    return _weather_caption(weather_data)
+
+@ttl_cache(ttl_seconds=600, max_entries=32, max_bytes=128 * 1024, flight_timeout=60,
+           stale_seconds=3600)
+def generate_holiday_caption(holiday_message):
+    return _holiday_caption(holiday_message)
+
+# mode -> (cached generator, uncached builder, request field)
+CAPTION_MODES = {
+    'sales': (generate_caption, _sales_caption, 'dish_name'),
+    'weather': (generate_weather_caption, _weather_caption, 'weather_data'),
+    'holiday': (generate_holiday_caption, _holiday_caption, 'holiday_message'),
+}
+
+def regenerate_caption(mode, data):
+    # "Give me a different one": bypasses the in-memory cache, takes the
+    # next variant from the caption store and makes it the cached answer
+    func, build, field = CAPTION_MODES[mode]
+    arg = data.get(field)
+    result = build(arg, variant=True)
+    func.prime(result, arg)
+    return result
+
+def stream_caption(mode, data):
+    # Streaming counterpart of the generate_*caption functions. Yields
+    # (event, payload) pairs: "meta" (weather only, the chosen dish),
+    # "token" for each piece of text as GPT produces it, then "done" with
+    # the same payload /generate/caption returns, or "error". Completed
+    # captions are stored in the same caches as the non-streaming calls.
+    # data["variant"] asks for a different caption, as regenerate_caption.
+    if mode not in CAPTION_MODES:
+        yield "error", {"error": "Invalid mode"}
+        return
+    func, _, field = CAPTION_MODES[mode]
+    key_arg = data.get(field)
+    variant = bool(data.get('variant'))
+    hashtags = settings_service.get_hashtags()
+
+    if mode == 'weather' and not key_arg:
+        yield "done", generate_weather_caption(key_arg)
+        return
+
+    if not variant:
+        _, state = func.cache.lookup(make_key((key_arg,), {}), record=False)
+        if state is not None:
+            result = func(key_arg)
+            yield "done", result if isinstance(result, dict) else {"caption": result}
+            return
+
+    if mode == 'sales':
+        prompt = _sales_prompt(key_arg)
+        to_result = lambda caption: {"caption": caption}
+    elif mode == 'weather':
+        selected_dish = _pick_weather_dish()
+        prompt = _weather_prompt(key_arg, selected_dish)
+        to_result = lambda caption: {"caption": caption, "dish_name": selected_dish}
+        yield "meta", {"dish_name": selected_dish}
+    else:
+        prompt = _holiday_prompt(key_arg)
+        to_result = lambda caption: caption
+
+    store_key = caption_store.content_key(MODEL, prompt)
+    text = _stored_completion(store_key, variant)
+    _record_cache(mode, "miss" if text is None else "hit")
+    if text is None:
+        parts = []
+        try:
+            with _instrumented("chat_stream", MODEL, mode) as call:
+                stream = openai_client.stream(lambda client: client.chat.completions.create(
+                    model=MODEL,
+                    messages=[{"role": "user", "content": prompt}],
+                    stream=True,
+                    stream_options={"include_usage": True}
+                ))
+                for chunk in stream:
+                    # The last chunk carries usage and no choices
+                    if getattr(chunk, "usage", None) is not None:
+                        call["usage"] = chunk.usage
+                    piece = chunk.choices[0].delta.content if chunk.choices else None
+                    if piece:
+                        parts.append(piece)
+                        yield "token", {"text": piece}
+        except Exception as e:
+            print(f"❌ Error streaming {mode} caption: {e}")
+            yield "error", {"caption": f"⚠️ Error generating caption: {str(e)}" + "\n\n" + hashtags}
+            return
+        text = "".join(parts).strip()
+        caption_store.get_store().add(store_key, text, MODEL, prompt)
+        yield "token", {"text": "\n\n" + hashtags}
+    else:
+        yield "token", {"text": text + "\n\n" + hashtags}
+
+    result = to_result(text + "\n\n" + hashtags)
+    func.prime(result, key_arg)
+    yield "done", result if isinstance(result, dict) else {"caption": result}
+
+def generate_image(prompt, mode="image"):
     try:
-        response = client.images.generate(
-            model="dall-e-3",
-            prompt=prompt,
-            n=1,
-            size="1024x1024"
-        )
+        with _instrumented("image", IMAGE_MODEL, mode) as call:
+            response = openai_client.call(lambda client: client.images.generate(
+                model=IMAGE_MODEL,
+                prompt=prompt,
+                n=1,
+                size="1024x1024"
+            ))
+            call["images"] = len(response.data)
         return response.data[0].url
     except Exception as e:
         print(f"❌ Error generating image: {e}")
@@ -0,0 +1,217 @@
+import sqlite3
+import datetime
+import threading
+from flask import current_app
+
+from app.db import SQLiteDB
+
+# Local copy of Square orders and their line items, filled incrementally by
+# square_service.sync_orders() so sales queries never re-scan Square.
+# daily_dish_sales holds per-day, per-dish rollups; days touched by a sync
+# are queued in dirty_days and recomputed by refresh_rollups().
+# sync_state.rollups_through records the sync watermark the rollups were
+# last brought up to; it is NULL until a location's first refresh.
+# sync_state.covered_from is the first day (ISO date) from which every
+# order is in the store; earlier days need a backfill.
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS orders ("
+    " order_id TEXT PRIMARY KEY,"
+    " location_id TEXT NOT NULL,"
+    " state TEXT,"
+    " created_at TEXT NOT NULL,"
+    " updated_at TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS orders_location_created ON orders (location_id, created_at)",
+    "CREATE TABLE IF NOT EXISTS line_items ("
+    " order_id TEXT NOT NULL,"
+    " uid TEXT NOT NULL,"
+    " name TEXT NOT NULL,"
+    " variation_name TEXT,"
+    " quantity REAL NOT NULL,"
+    " PRIMARY KEY (order_id, uid))",
+    "CREATE TABLE IF NOT EXISTS daily_dish_sales ("
+    " location_id TEXT NOT NULL,"
+    " day TEXT NOT NULL,"
+    " name TEXT NOT NULL,"
+    " sold REAL NOT NULL,"
+    " PRIMARY KEY (location_id, day, name))",
+    "CREATE TABLE IF NOT EXISTS dirty_days ("
+    " location_id TEXT NOT NULL,"
+    " day TEXT NOT NULL,"
+    " PRIMARY KEY (location_id, day))",
+    "CREATE TABLE IF NOT EXISTS sync_state ("
+    " location_id TEXT PRIMARY KEY,"
+    " last_updated_at TEXT,"
+    " last_synced_at TEXT,"
+    " rollups_through TEXT,"
+    " covered_from TEXT)",
+)
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def normalize_time(value):
+    # Square sends RFC 3339 timestamps with and without fractional seconds
+    # ("...:05Z" vs "...:05.123Z"), which don't order correctly as strings.
+    # Everything stored or compared goes through this fixed UTC format.
+    parsed = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return parsed.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def get_store():
+    path = current_app.config["ORDER_STORE_PATH"]
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = OrderStore(path)
+        return store
+
+
+class OrderStore:
+    def __init__(self, path):
+        self.db = SQLiteDB(path, schema=SCHEMA)
+        for column in ("rollups_through", "covered_from"):
+            try:
+                # Stores created before the column existed
+                self.db.execute(f"ALTER TABLE sync_state ADD COLUMN {column} TEXT")
+            except sqlite3.OperationalError:
+                pass
+
+    def upsert_orders(self, location_id, orders):
+        # Orders are keyed by id; an order is only rewritten when Square
+        # reports a newer updated_at than the copy we already hold.
+        changed = 0
+        with self.db.transaction() as conn:
+            for order in orders:
+                order_id = order.get("id")
+                updated_at = order.get("updated_at") or order.get("created_at")
+                if not order_id or not updated_at:
+                    continue
+                updated_at = normalize_time(updated_at)
+                row = conn.execute(
+                    "SELECT updated_at, location_id, created_at FROM orders WHERE order_id = ?", (order_id,)
+                ).fetchone()
+                if row is not None and normalize_time(row[0]) >= updated_at:
+                    continue
+                order_location = order.get("location_id") or location_id
+                created_at = normalize_time(order.get("created_at") or updated_at)
+                conn.execute(
+                    "INSERT OR REPLACE INTO orders (order_id, location_id, state, created_at, updated_at)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (order_id, order_location, order.get("state"), created_at, updated_at),
+                )
+                # Both the old and the new day of this order need re-rolling
+                if row is not None:
+                    self._mark_dirty(conn, row[1], row[2][:10])
+                self._mark_dirty(conn, order_location, created_at[:10])
+                conn.execute("DELETE FROM line_items WHERE order_id = ?", (order_id,))
+                for index, line_item in enumerate(order.get("line_items", [])):
+                    conn.execute(
+                        "INSERT INTO line_items (order_id, uid, name, variation_name, quantity)"
+                        " VALUES (?, ?, ?, ?, ?)",
+                        (order_id, line_item.get("uid") or str(index),
+                         line_item.get("name", "Unnamed Item"), line_item.get("variation_name"),
+                         float(line_item.get("quantity", "1"))),
+                    )
+                changed += 1
+        return changed
+
+    def _mark_dirty(self, conn, location_id, day):
+        conn.execute("INSERT OR IGNORE INTO dirty_days (location_id, day) VALUES (?, ?)", (location_id, day))
+
+    def refresh_rollups(self, location_id):
+        # Recompute only the days that changed since the last refresh
+        with self.db.transaction() as conn:
+            state = conn.execute(
+                "SELECT last_updated_at, rollups_through FROM sync_state WHERE location_id = ?", (location_id,)
+            ).fetchone()
+            if state is not None and state[1] is None:
+                # Orders synced before rollups existed: queue every day once
+                conn.execute(
+                    "INSERT OR IGNORE INTO dirty_days (location_id, day)"
+                    " SELECT DISTINCT location_id, substr(created_at, 1, 10) FROM orders WHERE location_id = ?",
+                    (location_id,),
+                )
+            days = [row[0] for row in conn.execute(
+                "SELECT day FROM dirty_days WHERE location_id = ?", (location_id,)
+            ).fetchall()]
+            for day in days:
+                next_day = (datetime.date.fromisoformat(day) + datetime.timedelta(days=1)).isoformat()
+                conn.execute("DELETE FROM daily_dish_sales WHERE location_id = ? AND day = ?", (location_id, day))
+                conn.execute(
+                    "INSERT INTO daily_dish_sales (location_id, day, name, sold)"
+                    " SELECT o.location_id, ?, li.name, SUM(li.quantity) FROM line_items li"
+                    " JOIN orders o ON o.order_id = li.order_id"
+                    " WHERE o.location_id = ? AND o.state = 'COMPLETED'"
+                    " AND o.created_at >= ? AND o.created_at < ?"
+                    " GROUP BY li.name",
+                    (day, location_id, day, next_day),
+                )
+            conn.execute("DELETE FROM dirty_days WHERE location_id = ?", (location_id,))
+            if state is not None:
+                conn.execute(
+                    "UPDATE sync_state SET rollups_through = ? WHERE location_id = ?",
+                    (state[0] or "", location_id),
+                )
+        return len(days)
+
+    def get_sync_state(self, location_id):
+        row = self.db.execute(
+            "SELECT last_updated_at, last_synced_at FROM sync_state WHERE location_id = ?", (location_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"last_updated_at": row[0], "last_synced_at": row[1]}
+
+    def set_sync_state(self, location_id, last_updated_at, last_synced_at):
+        if last_updated_at:
+            last_updated_at = normalize_time(last_updated_at)
+        # Upsert, so rollups_through survives
+        self.db.execute(
+            "INSERT INTO sync_state (location_id, last_updated_at, last_synced_at) VALUES (?, ?, ?)"
+            " ON CONFLICT (location_id) DO UPDATE SET"
+            " last_updated_at = excluded.last_updated_at, last_synced_at = excluded.last_synced_at",
+            (location_id, last_updated_at, last_synced_at),
+        )
+
+    def get_covered_from(self, location_id):
+        row = self.db.execute(
+            "SELECT covered_from FROM sync_state WHERE location_id = ?", (location_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_covered_from(self, location_id, day):
+        self.db.execute(
+            "INSERT INTO sync_state (location_id, covered_from) VALUES (?, ?)"
+            " ON CONFLICT (location_id) DO UPDATE SET covered_from = excluded.covered_from",
+            (location_id, day),
+        )
+
+    def top_dishes(self, location_id, start, end, limit=5):
+        # start/end are ISO dates, both inclusive; summed from the rollups
+        rows = self.db.execute(
+            "SELECT name, SUM(sold) AS total FROM daily_dish_sales"
+            " WHERE location_id = ? AND day >= ? AND day <= ?"
+            " GROUP BY name ORDER BY total DESC, name LIMIT ?",
+            (location_id, start, end, limit),
+        ).fetchall()
+        return [{"name": name, "sold": int(sold)} for name, sold in rows]
+
+    def dish_totals(self, location_id, start, end):
+        # Every dish's total for the range, for merging across locations
+        return self.db.execute(
+            "SELECT name, SUM(sold) FROM daily_dish_sales"
+            " WHERE location_id = ? AND day >= ? AND day <= ? GROUP BY name",
+            (location_id, start, end),
+        )
+
+    def daily_sales(self, location_id, start, end):
+        rows = self.db.execute(
+            "SELECT day, name, sold FROM daily_dish_sales"
+            " WHERE location_id = ? AND day >= ? AND day <= ? ORDER BY day",
+            (location_id, start, end),
+        ).fetchall()
+        return rows
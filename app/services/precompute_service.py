@@ -0,0 +1,306 @@
+import os
+import json
+import time
+import fcntl
+import datetime
+import threading
+import multiprocessing
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from app import metrics
+from app.utils import get_executor, submit_in_app_context, write_json_atomic
+from app.services import square_service, weather_service, holiday_service, openai_service, image_service
+
+# The day's content pool: captions and images for yesterday's top dishes,
+# today's weather and tomorrow's holiday, built off-peak by
+# build_content_pool() and kept as one JSON file per UTC day in
+# CONTENT_POOL_DIR. The caption and image endpoints the dashboard tabs
+# call answer from it first (pooled_caption, pooled_image), so the
+# morning's first clicks don't wait on GPT or DALL-E.
+
+# A pooled weather caption still fits if the weather has only drifted this
+# many degrees (F) since it was built, with the same description
+WEATHER_TEMP_TOLERANCE = 5
+
+_pool = {"date": None, "data": None}
+_pool_lock = threading.Lock()
+_scheduler_started = False
+
+
+def _today():
+    return datetime.datetime.utcnow().date()
+
+
+def _pool_path(day):
+    return os.path.join(current_app.config["CONTENT_POOL_DIR"], f"{day.isoformat()}.json")
+
+
+def _read_pool(day):
+    path = _pool_path(day)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"❌ Ignoring unreadable content pool {path}: {e}")
+        return None
+
+
+def _prune_pools(directory, keep_days):
+    cutoff = (_today() - datetime.timedelta(days=keep_days)).isoformat()
+    for name in os.listdir(directory):
+        if name.endswith(".json") and name[:-5] < cutoff:
+            os.remove(os.path.join(directory, name))
+
+
+def _failed(caption):
+    return not caption or caption.startswith("⚠️")
+
+
+def _build_sales():
+    dishes = square_service.get_top_dishes()
+    names = [dish["name"] for dish in dishes if dish.get("sold")]
+    if not names:
+        raise RuntimeError("No sales data")
+    captions = openai_service.generate_captions(names)
+    executor = get_executor("precompute_images", 4)
+    images = {name: submit_in_app_context(executor, image_service.get_random_image_for_dish, name) for name in names}
+    posts = []
+    for name in names:
+        caption = captions[name]["caption"]
+        posts.append({
+            "dish_name": name,
+            "caption": None if _failed(caption) else caption,
+            "image_url": images[name].result()
+        })
+    return {"dishes": dishes, "posts": posts}
+
+
+def _build_weather():
+    # Exactly what /api/weather/current returns and the weather tab captions
+    weather_data = weather_service.get_current_weather()
+    if not weather_data:
+        raise RuntimeError("No weather data")
+    result = openai_service.generate_weather_caption(weather_data)
+    if _failed(result["caption"]):
+        raise RuntimeError(result["caption"])
+    dish_name = result.get("dish_name")
+    return {
+        "weather_data": weather_data,
+        "caption": result["caption"],
+        "dish_name": dish_name,
+        "image_url": image_service.get_random_image_for_dish(dish_name) if dish_name else None
+    }
+
+
+def _build_holiday():
+    info = holiday_service.get_holiday_info()
+    caption = openai_service.generate_holiday_caption(info["message"])
+    if _failed(caption):
+        raise RuntimeError(caption)
+    image_url = openai_service.generate_image(openai_service.holiday_image_prompt(caption), mode="holiday")
+    return {"info": info, "caption": caption, "image_url": image_url}
+
+
+SECTIONS = {
+    "sales": _build_sales,
+    "weather": _build_weather,
+    "holiday": _build_holiday,
+}
+
+
+def _prime(pool):
+    # Make the pool's captions what the caption endpoints answer with
+    sales = pool.get("sales") or {}
+    for post in sales.get("posts", []):
+        if post["caption"]:
+            openai_service.generate_caption.prime({"caption": post["caption"]}, post["dish_name"])
+    weather = pool.get("weather")
+    if weather:
+        openai_service.generate_weather_caption.prime(
+            {"caption": weather["caption"], "dish_name": weather["dish_name"]}, weather["weather_data"])
+    holiday = pool.get("holiday")
+    if holiday:
+        openai_service.generate_holiday_caption.prime(holiday["caption"], holiday["info"]["message"])
+
+
+def _remember(day, pool):
+    with _pool_lock:
+        _pool["date"] = day
+        _pool["data"] = pool
+
+
+def build_content_pool(force=False):
+    # Returns the pool for today, building it unless it already exists.
+    # Only one process builds at a time; the others return None.
+    day = _today()
+    if not force:
+        existing = get_content_pool()
+        if existing is not None:
+            return existing
+
+    directory = current_app.config["CONTENT_POOL_DIR"]
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, ".lock"), "w") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print("❌ Content pool is already being built by another process")
+            return None
+        if not force:
+            # Another process may have finished it since the check above
+            existing = _read_pool(day)
+            if existing is not None:
+                _prime(existing)
+                _remember(day, existing)
+                return existing
+
+        start = time.perf_counter()
+        with metrics.route("precompute"):
+            executor = get_executor("precompute", len(SECTIONS))
+            futures = {name: submit_in_app_context(executor, build) for name, build in SECTIONS.items()}
+        pool = {"date": day.isoformat(), "generated_at": round(time.time()), "errors": {}}
+        for name, future in futures.items():
+            try:
+                pool[name] = future.result()
+            except Exception as e:
+                print(f"❌ Content pool section {name} failed: {e}")
+                pool[name] = None
+                pool["errors"][name] = str(e)
+        pool["elapsed_ms"] = round((time.perf_counter() - start) * 1000)
+
+        write_json_atomic(_pool_path(day), pool)
+        try:
+            _prune_pools(directory, current_app.config.get("CONTENT_POOL_KEEP_DAYS", 7))
+        except OSError as e:
+            print(f"❌ Error pruning content pools: {e}")
+    _prime(pool)
+    _remember(day, pool)
+    return pool
+
+
+def get_content_pool():
+    # Today's pool, or None if it hasn't been built. Read from disk once
+    # per process and day; loading it primes this worker's caches.
+    day = _today()
+    with _pool_lock:
+        if _pool["date"] == day:
+            return _pool["data"]
+    pool = _read_pool(day)
+    if pool is None:
+        return None
+    _prime(pool)
+    _remember(day, pool)
+    return pool
+
+
+def _same_weather(pooled, requested):
+    if not isinstance(requested, dict):
+        return False
+    try:
+        drift = abs(float(pooled["temp"]) - float(requested.get("temp")))
+    except (TypeError, ValueError):
+        return False
+    same_description = str(pooled.get("description", "")).lower() == str(requested.get("description", "")).lower()
+    return same_description and drift <= WEATHER_TEMP_TOLERANCE
+
+
+def pooled_caption(mode, data):
+    # The caption /generate/caption would return for this request, if
+    # today's pool has one; None otherwise (and always for variants).
+    # Hits are primed into the caption caches.
+    if mode not in SECTIONS or data.get("variant"):
+        return None
+    pool = get_content_pool()
+    section = (pool or {}).get(mode)
+    if not section:
+        return None
+    if mode == "sales":
+        dish_name = data.get("dish_name")
+        for post in section.get("posts", []):
+            if post["dish_name"] == dish_name and post["caption"]:
+                return {"caption": post["caption"]}
+    elif mode == "weather":
+        weather_data = data.get("weather_data")
+        if _same_weather(section["weather_data"], weather_data):
+            result = {"caption": section["caption"], "dish_name": section["dish_name"]}
+            openai_service.generate_weather_caption.prime(result, weather_data)
+            return result
+    elif mode == "holiday":
+        if section["info"]["message"] == data.get("holiday_message"):
+            return {"caption": section["caption"]}
+    return None
+
+
+def pooled_image(mode, data):
+    # The image /generate/image would return for this request, if today's
+    # pool has one for the same dish (sales, weather) or caption (holiday);
+    # None otherwise, and always for variants
+    if mode not in SECTIONS or data.get("variant"):
+        return None
+    pool = get_content_pool()
+    section = (pool or {}).get(mode)
+    if not section:
+        return None
+    if mode == "sales":
+        dish_name = data.get("dish_name")
+        for post in section.get("posts", []):
+            if post["dish_name"] == dish_name:
+                return post["image_url"]
+    elif mode == "weather":
+        if section["dish_name"] and section["dish_name"] == data.get("dish_name"):
+            return section["image_url"]
+    elif mode == "holiday":
+        if section["caption"] == data.get("caption"):
+            return section["image_url"]
+    return None
+
+
+def _seconds_until(run_at):
+    hour, minute = (int(part) for part in run_at.split(":"))
+    now = datetime.datetime.utcnow()
+    target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if target <= now:
+        target += datetime.timedelta(days=1)
+    return (target - now).total_seconds()
+
+
+def start_scheduler(app):
+    # Opt-in daily build at CONTENT_POOL_RUN_AT (UTC "HH:MM"; unset by
+    # default, since every build spends OpenAI credits). Every worker runs
+    # the thread, the file lock lets one of them do the work.
+    global _scheduler_started
+    run_at = app.config.get("CONTENT_POOL_RUN_AT")
+    if not run_at or _scheduler_started:
+        return
+    # Not in multiprocessing children (image_pipeline's spawned workers
+    # re-import the main module, and with it create_app), nor in flask CLI
+    # commands, which load the app too
+    if multiprocessing.parent_process() is not None or click.get_current_context(silent=True) is not None:
+        return
+    _scheduler_started = True
+
+    def loop():
+        while True:
+            time.sleep(_seconds_until(run_at))
+            with app.app_context():
+                try:
+                    build_content_pool()
+                except Exception as e:
+                    print(f"❌ Error building content pool: {e}")
+
+    threading.Thread(target=loop, name="content-pool", daemon=True).start()
+
+
+@click.command("precompute-content")
+@click.option("--force", is_flag=True, help="Rebuild even if today's pool exists.")
+@with_appcontext
+def precompute_command(force):
+    # For cron: flask --app run precompute-content
+    pool = build_content_pool(force=force)
+    if pool is None:
+        raise click.ClickException("Content pool is being built by another process")
+    click.echo(f"Content pool for {pool['date']} built in {pool.get('elapsed_ms')} ms, errors: {pool['errors'] or 'none'}")
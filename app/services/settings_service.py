@@ -3,6 +3,12 @@ import os
 
 SETTINGS_PATH = "settings.json"
 DEFAULT_HASHTAGS = "#vietspot #vietspotNYC #vietnamese #vietfood"
+# Alternate names -> library dish, used when picking images for a dish
+# (accents and case don't matter, e.g. "Chicken Bánh Mì" -> "Chicken Sandwich")
+DEFAULT_DISH_ALIASES = {
+    "Banhmi": "Sandwich",
+    "Banh Mi": "Sandwich"
+}
 
 def get_settings():
     if not os.path.exists(SETTINGS_PATH):
@@ -14,9 +20,16 @@ def get_settings():
         return {"hashtags": DEFAULT_HASHTAGS}
 
 def save_settings(data):
+    # Merge, so saving one section keeps the others
+    settings = get_settings()
+    settings.update(data)
     with open(SETTINGS_PATH, "w") as f:
-        json.dump(data, f, indent=4)
+        json.dump(settings, f, indent=4)
 
 def get_hashtags():
     settings = get_settings()
     return settings.get("hashtags", DEFAULT_HASHTAGS)
+
+def get_dish_aliases():
+    settings = get_settings()
+    return settings.get("dish_aliases", DEFAULT_DISH_ALIASES)
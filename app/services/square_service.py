@@ -1,58 +1,308 @@
-import requests
+import time
+import heapq
 import datetime
+from collections import Counter
 from flask import current_app
-from app.utils import ttl_cache
+from app import http_client
+from app.utils import ttl_cache, clear_caches, get_executor, submit_in_app_context
+from app.services import order_store
+
+SEARCH_URL = "https://connect.squareup.com/v2/orders/search"
+PAGE_SIZE = 500
 
-@ttl_cache(ttl_seconds=600)
-def get_top_dishes():
-    token = current_app.config["SQUARE_ACCESS_TOKEN"]
-    location_id = current_app.config["SQUARE_LOCATION_ID"]
-    
-    today = datetime.datetime.utcnow().date()
-    yesterday = today - datetime.timedelta(days=1)
-    start_time = f"{yesterday}T00:00:00Z"
-    end_time = f"{yesterday}T23:59:59Z"
 
-    url = "https://connect.squareup.com/v2/orders/search"
-    headers = {
+def get_location_ids():
+    return list(current_app.config.get("SQUARE_LOCATION_IDS") or [])
+
+
+def _headers():
+    token = current_app.config["SQUARE_ACCESS_TOKEN"]
+    return {
         "Authorization": f"Bearer {token}",
         "Content-Type": "application/json"
     }
 
+
+def _format_time(dt):
+    return dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _search_orders(location_id, field, start_at, end_at=None):
+    # Yields pages of orders whose created_at/updated_at (field) falls in
+    # [start_at, end_at), oldest first, paging through all cursors
+    time_range = {"start_at": start_at}
+    if end_at:
+        time_range["end_at"] = end_at
     body = {
         "location_ids": [location_id],
+        "limit": PAGE_SIZE,
         "query": {
             "filter": {
                 "date_time_filter": {
-                    "created_at": {
-                        "start_at": start_time,
-                        "end_at": end_time
-                    }
-                },
-                "state_filter": {
-                    "states": ["COMPLETED"]
+                    field: time_range
                 }
             },
             "sort": {
-                "sort_field": "CREATED_AT",
-                "sort_order": "DESC"
+                # Square requires sorting by the filtered field
+                "sort_field": field.upper(),
+                "sort_order": "ASC"
             }
         }
     }
+    while True:
+        # orders/search is a read, so it is safe to retry
+        response = http_client.post(SEARCH_URL, headers=_headers(), json=body, idempotent=True)
+        response.raise_for_status()
+        data = response.json()
+        yield data.get("orders", [])
+        cursor = data.get("cursor")
+        if not cursor:
+            break
+        body["cursor"] = cursor
+
+
+def sync_orders(location_id=None):
+    # Pull every order updated since the last sync into the local order
+    # store. The first sync backfills SQUARE_SYNC_LOOKBACK_DAYS; older days
+    # are fetched on demand by backfill_orders.
+    location_id = location_id or current_app.config["SQUARE_LOCATION_ID"]
+    store = order_store.get_store()
+    now = datetime.datetime.utcnow()
+
+    state = store.get_sync_state(location_id)
+    first_sync = not (state and state["last_updated_at"])
+    if not first_sync:
+        # Small overlap so orders updated while the last sync ran aren't missed
+        last = datetime.datetime.fromisoformat(state["last_updated_at"][:19])
+        start = last - datetime.timedelta(minutes=5)
+    else:
+        start = now - datetime.timedelta(days=current_app.config.get("SQUARE_SYNC_LOOKBACK_DAYS", 7))
+
+    last_updated_at = state["last_updated_at"] if state else None
+    if last_updated_at:
+        last_updated_at = order_store.normalize_time(last_updated_at)
+    changed = 0
+    pages = 0
+    for orders in _search_orders(location_id, "updated_at", _format_time(start)):
+        changed += store.upsert_orders(location_id, orders)
+        pages += 1
+        for order in orders:
+            if not order.get("updated_at"):
+                continue
+            # Compared normalized: raw Square timestamps don't order as strings
+            updated_at = order_store.normalize_time(order["updated_at"])
+            if last_updated_at is None or updated_at > last_updated_at:
+                last_updated_at = updated_at
 
+    store.set_sync_state(location_id, last_updated_at, _format_time(now))
+    if first_sync and store.get_covered_from(location_id) is None:
+        # Every order created since start has been updated since, so the
+        # first whole day after it is complete
+        store.set_covered_from(location_id, (start.date() + datetime.timedelta(days=1)).isoformat())
+    return {"location_id": location_id, "pages": pages, "changed": changed}
+
+
+def backfill_orders(location_id, since):
+    # Fetches the orders created from since (a date) up to the first day
+    # the store already covers, so ranges reaching further back than the
+    # first sync have complete totals. Returns the date the store now
+    # covers from.
+    store = order_store.get_store()
+    today = datetime.datetime.utcnow().date()
+    covered_from = store.get_covered_from(location_id)
+    # Unknown coverage (stores from before it was tracked): fetch it all
+    covered_from = datetime.date.fromisoformat(covered_from) if covered_from else today
+    if since >= covered_from:
+        return covered_from
+
+    start_at = _format_time(datetime.datetime.combine(since, datetime.time()))
+    end_at = _format_time(datetime.datetime.combine(covered_from, datetime.time()))
+    for orders in _search_orders(location_id, "created_at", start_at, end_at):
+        store.upsert_orders(location_id, orders)
+    store.set_covered_from(location_id, since.isoformat())
+    store.refresh_rollups(location_id)
+    return since
+
+
+@ttl_cache(ttl_seconds=300, max_entries=32, flight_timeout=120)
+def ensure_backfilled(location_id, since):
+    # Concurrent reports over the same range share one backfill
+    return backfill_orders(location_id, since)
+
+
+@ttl_cache(ttl_seconds=300, max_entries=8, flight_timeout=60)
+def ensure_synced(location_id):
+    # At most one sync per location every 5 minutes; concurrent callers
+    # share the running one. Rollups are brought up to date afterwards.
+    result = sync_orders(location_id)
+    result["rollup_days"] = order_store.get_store().refresh_rollups(location_id)
+    return result
+
+
+def resync(location_ids=None):
+    # Manual sync: pull new orders, bring the rollups up to date and drop
+    # cached answers built from the old ones
+    store = order_store.get_store()
+    results = []
+    for location_id in location_ids or get_location_ids():
+        result = sync_orders(location_id)
+        result["rollup_days"] = store.refresh_rollups(location_id)
+        results.append(result)
+    # Through clear_caches so other workers' shared copies go too
+    for func in (ensure_synced, ensure_backfilled, get_top_dishes, get_sales_report):
+        clear_caches(func.cache.name)
+    return results
+
+
+def _sync_or_fallback(location_id):
+    # Returns False if there is no local data to answer from
     try:
-        response = requests.post(url, headers=headers, json=body)
-        data = response.json()
-        
-        item_counter = {}
-        for order in data.get("orders", []):
-            for line_item in order.get("line_items", []):
-                name = line_item.get("name", "Unnamed Item")
-                quantity = int(float(line_item.get("quantity", "1")))
-                item_counter[name] = item_counter.get(name, 0) + quantity
-        
-        top_items = sorted(item_counter.items(), key=lambda x: x[1], reverse=True)[:5]
-        return [{"name": name, "sold": count} for name, count in top_items]
+        ensure_synced(location_id)
+    except Exception as e:
+        print(f"❌ Error syncing Square orders: {e}")
+        store = order_store.get_store()
+        if store.get_sync_state(location_id) is None:
+            return False
+        store.refresh_rollups(location_id)
+    return True
+
+
+def _sync_locations(location_ids):
+    # {location_id: (has_data, elapsed_ms)}, syncing all locations at once
+    # so latency tracks the slowest one
+    def run(location_id):
+        started = time.perf_counter()
+        ok = _sync_or_fallback(location_id)
+        return ok, (time.perf_counter() - started) * 1000
+
+    if len(location_ids) == 1:
+        return {location_ids[0]: run(location_ids[0])}
+    executor = get_executor("square", 8)
+    futures = {loc: submit_in_app_context(executor, run, loc) for loc in location_ids}
+    return {loc: future.result() for loc, future in futures.items()}
+
+
+def _rank(item):
+    # Most sold first, then by name
+    name, sold = item
+    return -sold, name
+
+
+def _merge_top(row_sets, limit):
+    # Stream every location's (name, sold) rows into one Counter and pick
+    # the top K with a heap instead of sorting everything. Ties go by name,
+    # like OrderStore.top_dishes.
+    counter = Counter()
+    for rows in row_sets:
+        for name, sold in rows:
+            counter[name] += sold
+    top = heapq.nsmallest(limit, counter.items(), key=_rank)
+    return [{"name": name, "sold": int(sold)} for name, sold in top]
+
+
+@ttl_cache(ttl_seconds=600, max_entries=8, flight_timeout=30,
+           stale_seconds=1800, max_age=1800)
+def get_top_dishes():
+    # Yesterday's top 5, combined across every configured location
+    location_ids = get_location_ids()
+    yesterday = datetime.datetime.utcnow().date() - datetime.timedelta(days=1)
+
+    synced = _sync_locations(location_ids) if location_ids else {}
+    available = [loc for loc, (ok, _) in synced.items() if ok]
+    if not available:
+        return [{"name": "⚠️ Error fetching data", "sold": 0}]
+
+    try:
+        store = order_store.get_store()
+        day = yesterday.isoformat()
+        if len(available) == 1:
+            return store.top_dishes(available[0], day, day, limit=5)
+        return _merge_top((store.dish_totals(loc, day, day) for loc in available), 5)
     except Exception as e:
         print(f"❌ Error parsing Square orders: {e}")
         return [{"name": "⚠️ Error fetching data", "sold": 0}]
+
+
+def _period_start(day, granularity):
+    if granularity == "week":
+        return day - datetime.timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    return day
+
+
+def _backfill_locations(location_ids, start):
+    # {location_id: date its orders are complete from}, after fetching
+    # what's missing back to start, at most SQUARE_BACKFILL_MAX_DAYS ago
+    today = datetime.datetime.utcnow().date()
+    since = max(start, today - datetime.timedelta(days=current_app.config.get("SQUARE_BACKFILL_MAX_DAYS", 366)))
+
+    def run(location_id):
+        try:
+            return ensure_backfilled(location_id, since)
+        except Exception as e:
+            print(f"❌ Error backfilling Square orders: {e}")
+            covered_from = order_store.get_store().get_covered_from(location_id)
+            return datetime.date.fromisoformat(covered_from) if covered_from else today
+
+    if len(location_ids) == 1:
+        return {location_ids[0]: run(location_ids[0])}
+    executor = get_executor("square", 8)
+    futures = {loc: submit_in_app_context(executor, run, loc) for loc in location_ids}
+    return {loc: future.result() for loc, future in futures.items()}
+
+
+@ttl_cache(ttl_seconds=600, max_entries=64, flight_timeout=30)
+def get_sales_report(start, end, limit=5, granularity=None, location_ids=None):
+    # start/end are inclusive datetime.date values. Answered from the daily
+    # rollups, per location and combined, optionally bucketed by
+    # day/week/month. Days before the store's history are backfilled first;
+    # if some still aren't covered (too old, or Square failed) "partial" is
+    # true and "covered_from" says where complete data begins.
+    location_ids = list(location_ids) if location_ids else get_location_ids()
+    synced = _sync_locations(location_ids) if location_ids else {}
+    available = [loc for loc, (ok, _) in synced.items() if ok]
+    if not available:
+        return None
+    covered = _backfill_locations(available, start)
+    covered_from = max(covered.values())
+
+    store = order_store.get_store()
+    first, last = start.isoformat(), end.isoformat()
+    locations = {}
+    for loc, (ok, elapsed_ms) in synced.items():
+        locations[loc] = {
+            "status": "ok" if ok else "error",
+            "elapsed_ms": round(elapsed_ms),
+            "covered_from": covered[loc].isoformat() if ok else None,
+            "dishes": store.top_dishes(loc, first, last, limit=limit) if ok else [],
+        }
+
+    report = {
+        "start": first,
+        "end": last,
+        "covered_from": covered_from.isoformat(),
+        "partial": start < covered_from,
+        "limit": limit,
+        "granularity": granularity,
+        "dishes": _merge_top((store.dish_totals(loc, first, last) for loc in available), limit),
+        "locations": locations,
+    }
+
+    if granularity:
+        buckets = {}
+        for loc in available:
+            for day, name, sold in store.daily_sales(loc, first, last):
+                period = _period_start(datetime.date.fromisoformat(day), granularity).isoformat()
+                buckets.setdefault(period, Counter())[name] += sold
+        report["periods"] = [
+            {
+                "period": period,
+                "dishes": [
+                    {"name": name, "sold": int(sold)}
+                    for name, sold in heapq.nsmallest(limit, counter.items(), key=_rank)
+                ]
+            }
+            for period, counter in sorted(buckets.items())
+        ]
+    return report
@@ -1,44 +1,178 @@
-import requests
+import time
+import bisect
+import string
 import datetime
 from flask import current_app
-from app.utils import ttl_cache
+from app import http_client
+from app.utils import ttl_cache, make_key, get_executor, submit_in_app_context
 
-@ttl_cache(ttl_seconds=600)
-def get_current_weather(city="New York"):
+FORECAST_URL = "https://api.openweathermap.org/data/2.5/forecast"
+# OpenWeather publishes the 5-day forecast in 3-hour blocks aligned to UTC
+BLOCK_SECONDS = 3 * 3600
+
+
+def _until_next_block(snapshot, stored_at):
+    if snapshot is None:
+        # Don't sit on a failed fetch for a whole block
+        return 60
+    next_block = (int(stored_at) // BLOCK_SECONDS + 1) * BLOCK_SECONDS
+    return max(next_block - stored_at, 60)
+
+
+@ttl_cache(ttl_seconds=BLOCK_SECONDS, max_entries=32, flight_timeout=15,
+           stale_seconds=900, ttl_func=_until_next_block)
+def get_snapshot(city="New York"):
+    # One forecast download per city and block, parsed into a list sorted
+    # by time plus a per-day index, so every query below is answered
+    # without another network call.
     api_key = current_app.config["WEATHER_API_KEY"]
-    url = f"https://api.openweathermap.org/data/2.5/weather?q={city}&appid={api_key}&units=imperial"
-    
+    params = {"q": city, "appid": api_key, "units": "imperial"}
+
     try:
-        response = requests.get(url)
+        response = http_client.get(FORECAST_URL, params=params)
         if response.status_code != 200:
             return None
         data = response.json()
-        return {
-            "condition": data["weather"][0]["main"],
-            "description": data["weather"][0]["description"],
-            "temp": data["main"]["temp"]
-        }
     except Exception as e:
-        print(f"❌ Error fetching weather: {e}")
+        print(f"❌ Error fetching forecast: {e}")
         return None
 
-def get_tomorrow_forecast(city="New York"):
-    api_key = current_app.config["WEATHER_API_KEY"]
-    url = f"https://api.openweathermap.org/data/2.5/forecast?q={city}&appid={api_key}&units=imperial"
-    
-    try:
-        response = requests.get(url)
-        data = response.json()
-        tomorrow = datetime.datetime.utcnow().date() + datetime.timedelta(days=1)
-        entries = [entry for entry in data["list"] if entry["dt_txt"].startswith(str(tomorrow))]
-        
-        if entries:
-            mid_entry = entries[len(entries)//2]
-            return {
-                "description": mid_entry['weather'][0]['description'].capitalize(),
-                "temp": mid_entry['main']['temp']
-            }
+    entries = []
+    for item in sorted(data.get("list", []), key=lambda x: x["dt"]):
+        entries.append({
+            "dt": item["dt"],
+            "dt_txt": item["dt_txt"],
+            "condition": item["weather"][0]["main"],
+            "description": item["weather"][0]["description"],
+            "temp": item["main"]["temp"]
+        })
+
+    days = {}
+    for index, entry in enumerate(entries):
+        day = entry["dt_txt"][:10]
+        if day not in days:
+            days[day] = [index, index + 1]
+        else:
+            days[day][1] = index + 1
+
+    return {
+        "city": city,
+        "fetched_at": time.time(),
+        "times": [entry["dt"] for entry in entries],
+        "entries": entries,
+        "days": days
+    }
+
+
+def _entry_near(snapshot, timestamp):
+    times = snapshot["times"]
+    if not times:
         return None
-    except Exception as e:
-        print(f"❌ Error fetching forecast: {e}")
+    index = bisect.bisect_left(times, timestamp)
+    candidates = [i for i in (index - 1, index) if 0 <= i < len(times)]
+    closest = min(candidates, key=lambda i: abs(times[i] - timestamp))
+    return snapshot["entries"][closest]
+
+
+def _current_from(snapshot):
+    entry = _entry_near(snapshot, time.time())
+    if entry is None:
+        return None
+    return {
+        "condition": entry["condition"],
+        "description": entry["description"],
+        "temp": entry["temp"]
+    }
+
+
+def _day_from(snapshot, day):
+    # Midday-ish conditions plus the temperature range for one UTC day
+    bounds = snapshot["days"].get(day.isoformat())
+    if not bounds:
+        return None
+    entries = snapshot["entries"][bounds[0]:bounds[1]]
+    mid_entry = entries[len(entries) // 2]
+    temps = [entry["temp"] for entry in entries]
+    return {
+        "date": day.isoformat(),
+        "condition": mid_entry["condition"],
+        "description": mid_entry["description"].capitalize(),
+        "temp": mid_entry["temp"],
+        "temp_min": min(temps),
+        "temp_max": max(temps)
+    }
+
+
+def get_current_weather(city="New York"):
+    snapshot = get_snapshot(city)
+    if not snapshot:
         return None
+    return _current_from(snapshot)
+
+
+def get_day_forecast(day, city="New York"):
+    snapshot = get_snapshot(city)
+    if not snapshot:
+        return None
+    return _day_from(snapshot, day)
+
+
+def get_tomorrow_forecast(city="New York"):
+    tomorrow = datetime.datetime.utcnow().date() + datetime.timedelta(days=1)
+    forecast = get_day_forecast(tomorrow, city)
+    if not forecast:
+        return None
+    return {
+        "description": forecast["description"],
+        "temp": forecast["temp"]
+    }
+
+
+def normalize_city(city):
+    # "  new   york" and "New York" share one cache entry
+    return string.capwords(" ".join(city.split()))
+
+
+def get_weather_for_cities(cities):
+    # Cached snapshots are answered from memory; missing cities are fetched
+    # concurrently. Concurrent batches asking for the same city share one
+    # fetch through get_snapshot's single-flight.
+    unique = []
+    for city in cities:
+        name = normalize_city(city)
+        if name and name not in unique:
+            unique.append(name)
+
+    cache = get_snapshot.cache
+    states = {city: cache.lookup(make_key((city,), {}), record=False)[1] for city in unique}
+    missing = [city for city in unique if states[city] is None]
+
+    futures = {}
+    if missing:
+        executor = get_executor("weather", current_app.config.get("WEATHER_MAX_CONCURRENCY", 8))
+        futures = {city: submit_in_app_context(executor, get_snapshot, city) for city in missing}
+
+    now = time.time()
+    tomorrow = datetime.datetime.utcnow().date() + datetime.timedelta(days=1)
+    results = {}
+    for city in unique:
+        try:
+            snapshot = futures[city].result() if city in futures else get_snapshot(city)
+        except Exception as e:
+            print(f"❌ Error fetching weather for {city}: {e}")
+            snapshot = None
+        if not snapshot:
+            results[city] = {"status": "error", "current": None, "tomorrow": None}
+            continue
+        age = now - snapshot["fetched_at"]
+        results[city] = {
+            "status": "ok",
+            "current": _current_from(snapshot),
+            "tomorrow": _day_from(snapshot, tomorrow),
+            "source": "network" if city in futures else "cache",
+            "freshness": states[city] or "fresh",
+            "fetched_at": round(snapshot["fetched_at"]),
+            "age_seconds": round(age),
+            "expires_in": round(_until_next_block(snapshot, snapshot["fetched_at"]) - age)
+        }
+    return results
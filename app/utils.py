@@ -1,23 +1,462 @@
+import os
+import sys
+import json
 import time
+import tempfile
+import threading
 import functools
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app, has_app_context, Response, stream_with_context
 
-def ttl_cache(ttl_seconds):
+from app import metrics
+
+_MISSING = object()
+
+# Every cache created through ttl_cache registers itself here so it can be
+# inspected or cleared from the API (see /api/debug/cache).
+_registry = {}
+_registry_lock = threading.Lock()
+
+# Optional shared (L2) store behind every in-process cache, set up from
+# Config.CACHE_BACKEND by configure_cache_backend()
+_backend = None
+
+# Named, process-wide thread pools (cache refresh, dashboard fan-out, ...)
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def _freeze(value):
+    # Turn dicts/lists/sets (e.g. the weather_data dict) into hashable tuples
+    # so equal arguments always map to the same key.
+    if isinstance(value, dict):
+        return ("__dict__",) + tuple(sorted((str(k), _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return (type(value).__name__,) + tuple(_freeze(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return ("__set__",) + tuple(sorted(repr(_freeze(v)) for v in value))
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return repr(value)
+
+
+def make_key(args, kwargs):
+    return (_freeze(args), _freeze(kwargs))
+
+
+def approx_size(value, _seen=None):
+    # Rough deep size of a cached value, good enough for a byte budget.
+    if _seen is None:
+        _seen = set()
+    if id(value) in _seen:
+        return 0
+    _seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(approx_size(k, _seen) + approx_size(v, _seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(approx_size(v, _seen) for v in value)
+    return size
+
+
+class TTLCache:
+    # Entries are fresh for ttl_seconds, or for ttl_func(value, stored_at)
+    # when the lifetime depends on the value. With stale_seconds > 0 an
+    # expired entry can still be served for that long (while it gets
+    # revalidated), but never past max_age.
+    def __init__(self, name, ttl_seconds, max_entries=128, max_bytes=None, stale_seconds=0, max_age=None,
+                 ttl_func=None):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.ttl_func = ttl_func
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.stale_seconds = stale_seconds
+        self.max_age = max_age if max_age is not None else ttl_seconds + stale_seconds
+        self._data = OrderedDict()  # key -> (value, stored_at, size, ttl)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    def lookup(self, key, record=True):
+        # Returns (value, state) where state is "fresh", "stale" or None
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, stored_at, _, ttl = entry
+                age = now - stored_at
+                if age < ttl:
+                    self._data.move_to_end(key)
+                    if record:
+                        self.hits += 1
+                    return value, "fresh"
+                if age < min(ttl + self.stale_seconds, self.max_age):
+                    self._data.move_to_end(key)
+                    if record:
+                        self.stale_hits += 1
+                    return value, "stale"
+                self._remove(key)
+                self.expirations += 1
+            if record:
+                self.misses += 1
+            return _MISSING, None
+
+    def entry_ttl(self, value, stored_at):
+        if self.ttl_func is None:
+            return self.ttl_seconds
+        return self.ttl_func(value, stored_at)
+
+    def expires_at(self, value, stored_at):
+        # When the entry can no longer be served, even as stale
+        ttl = self.entry_ttl(value, stored_at)
+        return stored_at + min(ttl + self.stale_seconds, self.max_age)
+
+    def get(self, key, default=_MISSING, record=True):
+        value, state = self.lookup(key, record=record)
+        return value if state == "fresh" else default
+
+    def start_refresh(self, key):
+        # Only one background refresh per key at a time
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            self.refreshes += 1
+            return True
+
+    def end_refresh(self, key, failed=False):
+        with self._lock:
+            self._refreshing.discard(key)
+            if failed:
+                self.refresh_errors += 1
+
+    def set(self, key, value, stored_at=None):
+        size = approx_size(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            # Never let one huge value flush the whole cache
+            return
+        if stored_at is None:
+            stored_at = time.time()
+        ttl = self.entry_ttl(value, stored_at)
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, stored_at, size, ttl)
+            self._bytes += size
+            self._evict()
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "name": self.name,
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "stale_seconds": self.stale_seconds,
+                "max_age": self.max_age,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "refreshes": self.refreshes,
+                "refresh_errors": self.refresh_errors,
+            }
+
+    def _remove(self, key):
+        size = self._data.pop(key)[2]
+        self._bytes -= size
+
+    def _evict(self):
+        # Least recently used entries go first
+        while self._data and (
+            (self.max_entries is not None and len(self._data) > self.max_entries)
+            or (self.max_bytes is not None and self._bytes > self.max_bytes)
+        ):
+            key = next(iter(self._data))
+            self._remove(key)
+            self.evictions += 1
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    # Makes sure only one caller per key runs the upstream call; concurrent
+    # callers for the same key wait for it and share the result.
+    def __init__(self, timeout=30):
+        self.timeout = timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+        self.timeouts = 0
+
+    def do(self, key, func, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            if call.done.wait(self.timeout):
+                if call.error is not None:
+                    raise call.error
+                return call.result
+            # The leader is taking too long for this key; don't hold the
+            # request hostage, make our own call instead.
+            with self._lock:
+                self.timeouts += 1
+            return func(*args, **kwargs)
+
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "timeouts": self.timeouts,
+            }
+
+
+def configure_cache_backend(config):
+    global _backend
+    from app.cache_backend import create_backend
+    _backend = create_backend(config)
+    return _backend
+
+
+def _backend_get(cache, key):
+    if _backend is None:
+        return None
+    try:
+        return _backend.get(cache.name, key)
+    except Exception as e:
+        print(f"❌ Cache backend read failed for {cache.name}: {e}")
+        return None
+
+
+def _backend_set(cache, key, value, stored_at):
+    if _backend is None:
+        return
+    try:
+        _backend.set(cache.name, key, value, stored_at, cache.expires_at(value, stored_at))
+    except Exception as e:
+        print(f"❌ Cache backend write failed for {cache.name}: {e}")
+
+
+def get_cache_stats():
+    with _registry_lock:
+        caches = list(_registry.values())
+    stats = {}
+    for cache in caches:
+        stats[cache.name] = cache.stats()
+        flight = getattr(cache, "flight", None)
+        if flight is not None:
+            stats[cache.name]["single_flight"] = flight.stats()
+        if _backend is not None:
+            try:
+                stats[cache.name]["shared"] = _backend.stats(cache.name)
+            except Exception as e:
+                stats[cache.name]["shared"] = {"error": str(e)}
+    return stats
+
+
+def clear_caches(name=None):
+    with _registry_lock:
+        caches = [c for n, c in _registry.items() if name is None or n == name]
+    for cache in caches:
+        cache.clear()
+        if _backend is not None:
+            try:
+                _backend.clear(cache.name)
+            except Exception as e:
+                print(f"❌ Cache backend clear failed for {cache.name}: {e}")
+    return [cache.name for cache in caches]
+
+
+def get_executor(name, max_workers):
+    # Created on first use so nothing is started before gunicorn forks
+    with _executors_lock:
+        executor = _executors.get(name)
+        if executor is None:
+            executor = _executors[name] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        return executor
+
+
+def submit_in_app_context(executor, func, *args, **kwargs):
+    # Service functions read current_app.config, so pool threads need the
+    # app context of the request that submitted the work (and its route,
+    # for metrics)
+    app = current_app._get_current_object()
+    route = metrics.current_route()
+
+    def run():
+        with app.app_context(), metrics.route(route):
+            return func(*args, **kwargs)
+    return executor.submit(run)
+
+
+def _schedule_refresh(cache, key, load, args, kwargs):
+    if not cache.start_refresh(key):
+        return
+    # Service functions read current_app.config, so the worker needs the
+    # app context of the request that triggered the refresh.
+    app = current_app._get_current_object() if has_app_context() else None
+
+    def run():
+        failed = False
+        try:
+            if app is not None:
+                with app.app_context():
+                    _call_loader(cache, key, load, args, kwargs)
+            else:
+                _call_loader(cache, key, load, args, kwargs)
+        except Exception as e:
+            failed = True
+            print(f"❌ Background refresh failed for {cache.name}: {e}")
+        finally:
+            cache.end_refresh(key, failed)
+
+    try:
+        get_executor("cache-refresh", 4).submit(run)
+    except RuntimeError:
+        # Interpreter shutting down
+        cache.end_refresh(key, True)
+
+
+def _call_loader(cache, key, load, args, kwargs):
+    if cache.flight is None:
+        return load(key, args, kwargs)
+    return cache.flight.do(key, load, key, args, kwargs)
+
+
+def ttl_cache(ttl_seconds, max_entries=128, max_bytes=None, single_flight=True, flight_timeout=30,
+              stale_seconds=0, max_age=None, ttl_func=None):
     def decorator(func):
-        cache = {}
-        @functools.wraps(func)
-        def wrapper(*args, **kwargs):
-            now = time.time()
-            # Convert args and kwargs to a string representation to be hashable
-            key = str(args) + str(kwargs)
-            if key in cache:
-                value, timestamp = cache[key]
-                elapsed = now - timestamp
-                if elapsed < ttl_seconds:
-                    # print(f"📦 Using cached result for {func.__name__} — {ttl_seconds - elapsed:.0f}s remaining")
-                    return value
+        name = f"{func.__module__}.{func.__qualname__}"
+        cache = TTLCache(name, ttl_seconds, max_entries=max_entries, max_bytes=max_bytes,
+                         stale_seconds=stale_seconds, max_age=max_age, ttl_func=ttl_func)
+        cache.flight = SingleFlight(timeout=flight_timeout) if single_flight else None
+        with _registry_lock:
+            _registry[name] = cache
+
+        def load(key, args, kwargs):
+            # Another caller (or another worker, via the shared backend) may
+            # have filled the cache while we queued
+            value = cache.get(key, record=False)
+            if value is not _MISSING:
+                return value
+            entry = _backend_get(cache, key)
+            if entry is not None and time.time() - entry[1] < cache.entry_ttl(entry[0], entry[1]):
+                cache.set(key, entry[0], stored_at=entry[1])
+                return entry[0]
             result = func(*args, **kwargs)
-            cache[key] = (result, now)
-            # print(f"🆕 Cache updated for {func.__name__}")
+            stored_at = time.time()
+            cache.set(key, result, stored_at=stored_at)
+            _backend_set(cache, key, result, stored_at)
             return result
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = make_key(args, kwargs)
+            value, state = cache.lookup(key)
+            if state is None:
+                # L1 miss: warm it from the shared store, keeping the
+                # original timestamp so freshness is the same in every worker
+                entry = _backend_get(cache, key)
+                if entry is not None:
+                    cache.set(key, entry[0], stored_at=entry[1])
+                    value, state = cache.lookup(key, record=False)
+            if state == "fresh":
+                return value
+            if state == "stale":
+                # Serve the expired value now and revalidate in the background
+                _schedule_refresh(cache, key, load, args, kwargs)
+                return value
+            return _call_loader(cache, key, load, args, kwargs)
+
+        def prime(value, *args, **kwargs):
+            # Store a result computed elsewhere (e.g. a streamed completion)
+            # as if func(*args, **kwargs) had returned it
+            key = make_key(args, kwargs)
+            stored_at = time.time()
+            cache.set(key, value, stored_at=stored_at)
+            _backend_set(cache, key, value, stored_at)
+
+        wrapper.cache = cache
+        wrapper.cache_clear = cache.clear
+        wrapper.prime = prime
         return wrapper
     return decorator
+
+
+def write_json_atomic(path, data):
+    # Write to a temp file and rename, so other workers never read half a file
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def sse_event(data, event=None):
+    # One server-sent event frame carrying a JSON payload
+    frame = f"event: {event}\n" if event else ""
+    return frame + f"data: {json.dumps(data)}\n\n"
+
+
+def sse_response(events):
+    # Streams a generator of sse_event frames; the headers stop proxies
+    # (nginx) from buffering them
+    return Response(stream_with_context(events), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -7,12 +7,64 @@ const client = axios.create({
     },
 });
 
+// Reads a server-sent event stream, calling onEvent(event, payload) for each
+// frame. Stops at the first value onEvent returns and resolves with it
+// (undefined if the stream ends first).
+const readSSE = async (response, onEvent) => {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) return undefined;
+        buffer += decoder.decode(value, { stream: true });
+        const frames = buffer.split('\n\n');
+        buffer = frames.pop();
+        for (const frame of frames) {
+            const event = (frame.match(/^event: (.*)$/m) || [])[1];
+            const payload = JSON.parse((frame.match(/^data: (.*)$/m) || [])[1] || '{}');
+            const result = onEvent(event, payload);
+            if (result !== undefined) {
+                reader.cancel();
+                return result;
+            }
+        }
+    }
+};
+
+export const getDashboard = () => client.get('/dashboard');
 export const getTopDishes = () => client.get('/sales/top-dishes');
 export const getCurrentWeather = () => client.get('/weather/current');
 export const getForecast = () => client.get('/weather/forecast');
+export const getWeatherForCities = (cities) => client.get('/weather', { params: { cities: cities.join(',') } });
 export const getHoliday = () => client.get('/holiday');
+export const getUpcomingHolidays = (params) => client.get('/holidays/upcoming', { params });
 
 export const generateCaption = (mode, data) => client.post('/generate/caption', { mode, ...data });
+export const generateCaptions = (dishNames) => client.post('/generate/captions', { dish_names: dishNames });
+// Streams a caption over server-sent events. onToken receives the text so far
+// (and the suggested dish for weather mode); resolves with the final result.
+export const streamCaption = async (mode, data, onToken) => {
+    const response = await fetch(`${client.defaults.baseURL}/generate/caption/stream`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ mode, ...data }),
+    });
+    if (!response.ok || !response.body) throw new Error(`Caption stream failed: ${response.status}`);
+
+    let text = '';
+    let dishName = null;
+    const result = await readSSE(response, (event, payload) => {
+        if (event === 'meta') dishName = payload.dish_name;
+        if (event === 'token') {
+            text += payload.text;
+            onToken?.(text, dishName);
+        }
+        if (event === 'done') return payload;
+        if (event === 'error') return { caption: payload.caption || payload.error, dish_name: null };
+    });
+    return result ?? { caption: text, dish_name: dishName };
+};
 export const generateImage = (mode, data) => client.post('/generate/image', { mode, ...data });
 export const postToInstagram = (imageUrl, caption) => client.post('/instagram/post', { image_url: imageUrl, caption });
 export const refreshInstagramToken = () => client.post('/instagram/refresh_token');
@@ -20,6 +72,31 @@ export const getInstagramTokenStatus = () => client.get('/instagram/token_status
 
 export const getImages = () => client.get('/images');
 export const uploadImage = (formData) => client.post('/images/upload', formData, { headers: { 'Content-Type': 'multipart/form-data' } });
+// Uploads [{ file, dishName }] in one request. onResult is called with each
+// file's result ({ index, filename, ok, url, error, ... }) as it completes;
+// resolves with { uploaded, failed }.
+export const uploadImagesBulk = async (items, onResult) => {
+    const formData = new FormData();
+    for (const item of items) {
+        formData.append('images', item.file);
+        formData.append('dish_names', item.dishName);
+    }
+    const response = await fetch(`${client.defaults.baseURL}/images/upload/bulk?stream=1`, {
+        method: 'POST',
+        body: formData,
+    });
+    if (!response.ok || !response.body) throw new Error(`Bulk upload failed: ${response.status}`);
+
+    let uploaded = 0;
+    const result = await readSSE(response, (event, payload) => {
+        if (event === 'image') {
+            if (payload.ok) uploaded++;
+            onResult?.(payload);
+        }
+        if (event === 'done') return payload;
+    });
+    return result ?? { uploaded, failed: items.length - uploaded };
+};
 export const deleteImage = (publicId, dishName) => client.delete(`/images?public_id=${encodeURIComponent(publicId)}&dish_name=${encodeURIComponent(dishName)}`);
 export const updateImageCategory = (publicId, oldDish, newDish) => client.put('/images/category', { public_id: publicId, old_dish: oldDish, new_dish: newDish });
 
@@ -1,41 +1,30 @@
 import React, { useEffect } from 'react';
-import { getHoliday, generateCaption, generateImage } from '../api/client';
+import { streamCaption, generateImage } from '../api/client';
 import ContentCard from './ContentCard';
 import { CalendarHeart } from 'lucide-react';
 
 const HolidayTab = ({ state, setState }) => {
     const { holiday, caption, imageUrl, loadingHoliday, loadingCaption, loadingImage } = state;
 
+    // Holiday info is loaded by the Dashboard page; caption it as soon as
+    // it arrives
     useEffect(() => {
-        if (!holiday) {
-            fetchHolidayData();
+        if (holiday && !caption && !loadingCaption) {
+            handleGenerateContent(holiday.message);
         }
-    }, []);
-
-    const fetchHolidayData = async () => {
-        try {
-            const res = await getHoliday();
-            const holidayData = res.data;
-            setState(prev => ({ ...prev, holiday: holidayData, loadingHoliday: false }));
-
-            if (holidayData) {
-                handleGenerateContent(holidayData.message);
-            }
-        } catch (error) {
-            console.error("Failed to fetch holiday", error);
-            setState(prev => ({ ...prev, loadingHoliday: false }));
-        }
-    };
+    }, [holiday]);
 
     const handleGenerateContent = (message) => {
         handleGenerateCaption(message);
     };
 
-    const handleGenerateCaption = async (message) => {
+    const handleGenerateCaption = async (message, variant = false) => {
         setState(prev => ({ ...prev, loadingCaption: true }));
         try {
-            const res = await generateCaption('holiday', { holiday_message: message });
-            const newCaption = res.data.caption;
+            const result = await streamCaption('holiday', { holiday_message: message, variant }, (partial) => {
+                setState(prev => ({ ...prev, caption: partial }));
+            });
+            const newCaption = result.caption;
             setState(prev => ({ ...prev, caption: newCaption, loadingCaption: false }));
             handleGenerateImage(newCaption);
         } catch (error) {
@@ -44,10 +33,10 @@ const HolidayTab = ({ state, setState }) => {
         }
     };
 
-    const handleGenerateImage = async (captionText) => {
+    const handleGenerateImage = async (captionText, variant = false) => {
         setState(prev => ({ ...prev, loadingImage: true }));
         try {
-            const res = await generateImage('holiday', { caption: captionText });
+            const res = await generateImage('holiday', { caption: captionText, variant });
             setState(prev => ({ ...prev, imageUrl: res.data.image_url, loadingImage: false }));
         } catch (error) {
             console.error(error);
@@ -79,8 +68,8 @@ const HolidayTab = ({ state, setState }) => {
                     title="Holiday Special"
                     caption={caption}
                     imageUrl={imageUrl}
-                    onRegenerateCaption={() => holiday && handleGenerateCaption(holiday.message)}
-                    onRegenerateImage={() => caption && handleGenerateImage(caption)}
+                    onRegenerateCaption={() => holiday && handleGenerateCaption(holiday.message, true)}
+                    onRegenerateImage={() => caption && handleGenerateImage(caption, true)}
                     isLoadingCaption={loadingCaption}
                     isLoadingImage={loadingImage}
                 />
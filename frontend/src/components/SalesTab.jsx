@@ -1,30 +1,18 @@
 import React, { useEffect } from 'react';
-import { getTopDishes, generateCaption, generateImage } from '../api/client';
+import { streamCaption, generateImage } from '../api/client';
 import ContentCard from './ContentCard';
 import { Trophy } from 'lucide-react';
 
 const SalesTab = ({ state, setState }) => {
     const { dishes, selectedDish, caption, imageUrl, loadingDishes, loadingCaption, loadingImage } = state;
 
+    // Top dishes are loaded by the Dashboard page; generate for the first
+    // one as soon as they arrive
     useEffect(() => {
-        if (dishes.length === 0) {
-            fetchDishes();
+        if (dishes.length > 0 && !selectedDish) {
+            handleSelectDish(dishes[0], true);
         }
-    }, []);
-
-    const fetchDishes = async () => {
-        try {
-            const res = await getTopDishes();
-            setState(prev => ({ ...prev, dishes: res.data, loadingDishes: false }));
-            if (res.data.length > 0) {
-                // Initial selection, trigger generation
-                handleSelectDish(res.data[0], true);
-            }
-        } catch (error) {
-            console.error("Failed to fetch dishes", error);
-            setState(prev => ({ ...prev, loadingDishes: false }));
-        }
-    };
+    }, [dishes]);
 
     const handleSelectDish = async (dish, forceGenerate = false) => {
         // If selecting the same dish and we already have content, do nothing unless forced
@@ -40,23 +28,25 @@ const SalesTab = ({ state, setState }) => {
         handleGenerateImage(dish.name); // This will call with "" variant initially, which is fine
     };
 
-    const handleGenerateCaption = async (dishName) => {
+    const handleGenerateCaption = async (dishName, variant = false) => {
         setState(prev => ({ ...prev, loadingCaption: true }));
         const fullDishName = state.dishVariant ? `${state.dishVariant} ${dishName}` : dishName;
         try {
-            const res = await generateCaption('sales', { dish_name: fullDishName });
-            setState(prev => ({ ...prev, caption: res.data.caption, loadingCaption: false }));
+            const result = await streamCaption('sales', { dish_name: fullDishName, variant }, (partial) => {
+                setState(prev => ({ ...prev, caption: partial }));
+            });
+            setState(prev => ({ ...prev, caption: result.caption, loadingCaption: false }));
         } catch (error) {
             console.error(error);
             setState(prev => ({ ...prev, loadingCaption: false }));
         }
     };
 
-    const handleGenerateImage = async (dishName) => {
+    const handleGenerateImage = async (dishName, variant = false) => {
         setState(prev => ({ ...prev, loadingImage: true }));
         const fullDishName = state.dishVariant ? `${state.dishVariant} ${dishName}` : dishName;
         try {
-            const res = await generateImage('sales', { dish_name: fullDishName });
+            const res = await generateImage('sales', { dish_name: fullDishName, variant });
             setState(prev => ({ ...prev, imageUrl: res.data.image_url, loadingImage: false }));
         } catch (error) {
             console.error(error);
@@ -128,8 +118,8 @@ const SalesTab = ({ state, setState }) => {
                     title={selectedDish ? `Promote: ${state.dishVariant ? state.dishVariant + ' ' : ''}${selectedDish.name}` : 'Select a dish'}
                     caption={caption}
                     imageUrl={imageUrl}
-                    onRegenerateCaption={() => selectedDish && handleGenerateCaption(selectedDish.name)}
-                    onRegenerateImage={() => selectedDish && handleGenerateImage(selectedDish.name)}
+                    onRegenerateCaption={() => selectedDish && handleGenerateCaption(selectedDish.name, true)}
+                    onRegenerateImage={() => selectedDish && handleGenerateImage(selectedDish.name, true)}
                     isLoadingCaption={loadingCaption}
                     isLoadingImage={loadingImage}
                 />
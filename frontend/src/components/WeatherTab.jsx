@@ -1,56 +1,31 @@
 import React, { useEffect } from 'react';
-import { getCurrentWeather, getForecast, generateCaption, generateImage } from '../api/client';
+import { streamCaption, generateImage } from '../api/client';
 import ContentCard from './ContentCard';
 import { CloudSun, Thermometer } from 'lucide-react';
 
 const WeatherTab = ({ state, setState }) => {
     const { weather, forecast, caption, suggestedDish, imageUrl, loadingWeather, loadingCaption, loadingImage } = state;
 
+    // Weather and forecast are loaded by the Dashboard page; caption the
+    // current weather as soon as it arrives
     useEffect(() => {
-        if (!weather) {
-            fetchWeatherData();
+        if (weather && !caption && !loadingCaption) {
+            handleGenerateContent(weather);
         }
-    }, []);
-
-    const fetchWeatherData = async () => {
-        try {
-            const [currentRes, forecastRes] = await Promise.all([
-                getCurrentWeather(),
-                getForecast()
-            ]);
-
-            // We need to update state with data AND trigger generation if needed
-            // But setState is async-ish in batching, so we can't rely on state immediately.
-            // Let's use local variables for the logic.
-            const weatherData = currentRes.data;
-            const forecastData = forecastRes.data;
-
-            setState(prev => ({
-                ...prev,
-                weather: weatherData,
-                forecast: forecastData,
-                loadingWeather: false
-            }));
-
-            if (weatherData) {
-                handleGenerateContent(weatherData);
-            }
-        } catch (error) {
-            console.error("Failed to fetch weather", error);
-            setState(prev => ({ ...prev, loadingWeather: false }));
-        }
-    };
+    }, [weather]);
 
     const handleGenerateContent = (weatherData) => {
         handleGenerateCaption(weatherData);
     };
 
-    const handleGenerateCaption = async (weatherData) => {
+    const handleGenerateCaption = async (weatherData, variant = false) => {
         setState(prev => ({ ...prev, loadingCaption: true }));
         try {
-            const res = await generateCaption('weather', { weather_data: weatherData });
-            const newCaption = res.data.caption;
-            const newDish = res.data.dish_name;
+            const result = await streamCaption('weather', { weather_data: weatherData, variant }, (partial, dish) => {
+                setState(prev => ({ ...prev, caption: partial, suggestedDish: dish }));
+            });
+            const newCaption = result.caption;
+            const newDish = result.dish_name;
 
             setState(prev => ({
                 ...prev,
@@ -66,11 +41,11 @@ const WeatherTab = ({ state, setState }) => {
         }
     };
 
-    const handleGenerateImage = async (dishName) => {
+    const handleGenerateImage = async (dishName, variant = false) => {
         setState(prev => ({ ...prev, loadingImage: true }));
         try {
             // For weather mode, we now pass dish_name to get library image
-            const res = await generateImage('weather', { dish_name: dishName });
+            const res = await generateImage('weather', { dish_name: dishName, variant });
             setState(prev => ({ ...prev, imageUrl: res.data.image_url, loadingImage: false }));
         } catch (error) {
             console.error(error);
@@ -119,8 +94,8 @@ const WeatherTab = ({ state, setState }) => {
                     title="Weather-Based Recommendation"
                     caption={caption}
                     imageUrl={imageUrl}
-                    onRegenerateCaption={() => weather && handleGenerateCaption(weather)}
-                    onRegenerateImage={() => caption && handleGenerateImage(caption)}
+                    onRegenerateCaption={() => weather && handleGenerateCaption(weather, true)}
+                    onRegenerateImage={() => suggestedDish && handleGenerateImage(suggestedDish, true)}
                     isLoadingCaption={loadingCaption}
                     isLoadingImage={loadingImage}
                 />
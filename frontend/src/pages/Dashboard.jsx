@@ -1,5 +1,6 @@
-import React, { useState } from 'react';
+import React, { useEffect, useState } from 'react';
 import { TrendingUp, CloudSun, CalendarHeart } from 'lucide-react';
+import { getDashboard, getTopDishes, getCurrentWeather, getForecast, getHoliday } from '../api/client';
 import SalesTab from '../components/SalesTab';
 import WeatherTab from '../components/WeatherTab';
 import HolidayTab from '../components/HolidayTab';
@@ -42,6 +43,37 @@ const Dashboard = () => {
         loadingImage: false
     });
 
+    // One round trip for every tab's data. Each section is applied on its
+    // own; a section that failed or timed out is fetched again from its
+    // own endpoint so the others aren't held back.
+    useEffect(() => {
+        const ok = (section) => section && section.status === 'ok';
+        const retry = (request, apply) => request()
+            .then(res => apply(res.data))
+            .catch(error => {
+                console.error('Failed to fetch dashboard section', error);
+                apply(null);
+            });
+
+        const applySales = (dishes) => setSalesState(prev => ({ ...prev, dishes: dishes || [], loadingDishes: false }));
+        const applyWeather = (weather) => setWeatherState(prev => ({ ...prev, weather, loadingWeather: false }));
+        const applyForecast = (forecast) => setWeatherState(prev => ({ ...prev, forecast }));
+        const applyHoliday = (holiday) => setHolidayState(prev => ({ ...prev, holiday, loadingHoliday: false }));
+
+        getDashboard()
+            .then(res => res.data)
+            .catch(error => {
+                console.error('Failed to fetch dashboard', error);
+                return {};
+            })
+            .then(dashboard => {
+                ok(dashboard.sales) ? applySales(dashboard.sales.data) : retry(getTopDishes, applySales);
+                ok(dashboard.weather) ? applyWeather(dashboard.weather.data) : retry(getCurrentWeather, applyWeather);
+                ok(dashboard.forecast) ? applyForecast(dashboard.forecast.data) : retry(getForecast, applyForecast);
+                ok(dashboard.holiday) ? applyHoliday(dashboard.holiday.data) : retry(getHoliday, applyHoliday);
+            });
+    }, []);
+
     const tabs = [
         { id: 'sales', label: 'Sales Content', icon: TrendingUp },
         { id: 'weather', label: 'Weather Content', icon: CloudSun },
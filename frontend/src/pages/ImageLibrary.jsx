@@ -1,5 +1,5 @@
 import React, { useEffect, useState } from 'react';
-import { getImages, uploadImage, deleteImage, updateImageCategory } from '../api/client';
+import { getImages, uploadImagesBulk, deleteImage, updateImageCategory } from '../api/client';
 import { Trash2, Upload, Image as ImageIcon, Edit2, Eye, X } from 'lucide-react';
 
 const ImageLibrary = () => {
@@ -108,22 +108,25 @@ const ImageLibrary = () => {
 
         setUploading(true);
         try {
-            let successCount = 0;
-            for (const item of filesToUpload) {
-                const formData = new FormData();
-                formData.append('image', item.file);
-                formData.append('dish_name', item.dishName);
-
-                try {
-                    await uploadImage(formData);
-                    successCount++;
-                } catch (e) {
-                    console.error(`Failed to upload ${item.file.name}`, e);
+            // One request for the whole batch; each file is dropped from
+            // staging as soon as it has been uploaded, or rejected as a
+            // near-duplicate of a library image
+            const duplicates = [];
+            const { uploaded } = await uploadImagesBulk(filesToUpload, (result) => {
+                const item = filesToUpload[result.index];
+                if (result.ok) {
+                    setStagedFiles(prev => prev.filter(f => f.id !== item.id));
+                } else if (result.duplicates) {
+                    duplicates.push(result.filename);
+                    setStagedFiles(prev => prev.filter(f => f.id !== item.id));
+                } else {
+                    console.error(`Failed to upload ${result.filename}`, result.error);
                 }
-            }
+            });
 
-            alert(`Successfully uploaded ${successCount} images!`);
-            setStagedFiles([]); // Clear staging
+            // Files that failed stay staged so they can be retried
+            alert(`Successfully uploaded ${uploaded} images!` +
+                (duplicates.length ? `\nSkipped ${duplicates.length} already in the library: ${duplicates.join(', ')}` : ''));
             await fetchImages(); // Refresh library
         } catch (error) {
             console.error("Batch upload critical failure", error);
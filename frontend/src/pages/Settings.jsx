@@ -4,6 +4,7 @@ import { Save, Hash } from 'lucide-react';
 
 const Settings = () => {
     const [hashtags, setHashtags] = useState('');
+    const [aliases, setAliases] = useState('');
     const [loading, setLoading] = useState(true);
     const [saving, setSaving] = useState(false);
     const [message, setMessage] = useState(null);
@@ -33,6 +34,8 @@ const Settings = () => {
         try {
             const res = await getSettings();
             setHashtags(res.data.hashtags);
+            // One "Alias = Dish" pair per line
+            setAliases(Object.entries(res.data.dish_aliases || {}).map(([alias, dish]) => `${alias} = ${dish}`).join('\n'));
         } catch (error) {
             console.error("Failed to fetch settings", error);
             setMessage({ type: 'error', text: 'Failed to load settings.' });
@@ -46,7 +49,12 @@ const Settings = () => {
         setSaving(true);
         setMessage(null);
         try {
-            await updateSettings({ hashtags });
+            const dishAliases = {};
+            aliases.split('\n').forEach(line => {
+                const [alias, dish] = line.split('=').map(part => part && part.trim());
+                if (alias && dish) dishAliases[alias] = dish;
+            });
+            await updateSettings({ hashtags, dish_aliases: dishAliases });
             setMessage({ type: 'success', text: 'Settings saved successfully!' });
         } catch (error) {
             console.error("Failed to save settings", error);
@@ -115,6 +123,23 @@ const Settings = () => {
                             />
                         </div>
 
+                        <div className="mb-6">
+                            <label htmlFor="aliases" className="block text-sm font-medium text-gray-700 mb-2">
+                                Dish Aliases
+                            </label>
+                            <p className="text-sm text-gray-500 mb-3">
+                                Other names for library dishes, one per line, used when picking images (e.g. "Banh Mi = Sandwich").
+                            </p>
+                            <textarea
+                                id="aliases"
+                                rows="4"
+                                className="w-full p-3 border border-gray-300 rounded-lg focus:ring-2 focus:ring-blue-500 focus:border-transparent transition-all font-mono text-sm"
+                                value={aliases}
+                                onChange={(e) => setAliases(e.target.value)}
+                                placeholder="Banh Mi = Sandwich"
+                            />
+                        </div>
+
                         {message && (
                             <div className={`mb-4 p-3 rounded-lg text-sm ${message.type === 'success' ? 'bg-green-50 text-green-700' : 'bg-red-50 text-red-700'}`}>
                                 {message.text}
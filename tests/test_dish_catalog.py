@@ -0,0 +1,78 @@
+import pytest
+from flask import Flask
+
+from app.services.dish_catalog import DishCatalog, apply_aliases, normalize
+
+ALIASES = {"Banhmi": "Sandwich", "Banh Mi": "Sandwich"}
+
+LIBRARY = {
+    "1": ("Chicken Sandwich", "https://img/chicken-sandwich"),
+    "2": ("Pork Sandwich", "https://img/pork-sandwich"),
+    "3": ("Phở Bò", "https://img/pho-bo"),
+    "4": ("Spring Rolls", "https://img/spring-rolls"),
+    "5": ("Uncategorized", "https://img/uncategorized"),
+}
+
+
+@pytest.fixture
+def catalog():
+    with Flask(__name__).app_context():
+        yield DishCatalog(lambda: dict(LIBRARY))
+
+
+def test_normalize_ignores_case_accents_and_punctuation():
+    assert normalize("Bánh  Mì!") == "banh mi"
+    assert normalize(None) == ""
+
+
+@pytest.mark.parametrize("key, expected", [
+    ("chicken banh mi", "chicken sandwich"),
+    ("chicken banhmi", "chicken sandwich"),
+    ("banh mi", "sandwich"),
+    # Whole words only
+    ("banhmix", "banhmix"),
+    ("pho bo", "pho bo"),
+])
+def test_apply_aliases_replaces_whole_words(key, expected):
+    assert apply_aliases(key, ALIASES) == expected
+
+
+def test_apply_aliases_normalizes_the_alias_table():
+    assert apply_aliases("chicken banh mi", {"Bánh Mì": "Sandwich"}) == "chicken sandwich"
+
+
+@pytest.mark.parametrize("dish_name, expected", [
+    ("Chicken Sandwich", ("https://img/chicken-sandwich",)),
+    ("pho bo", ("https://img/pho-bo",)),
+    ("Chicken Bánh Mì", ("https://img/chicken-sandwich",)),
+    # Every word matches, in any order
+    ("Sandwich Chicken", ("https://img/chicken-sandwich",)),
+    # A single word matches every dish that has it
+    ("Sandwich", ("https://img/chicken-sandwich", "https://img/pork-sandwich")),
+    ("Roll", ("https://img/spring-rolls",)),
+])
+def test_find_images_matches(catalog, dish_name, expected):
+    assert catalog.find_images(dish_name, ALIASES) == expected
+
+
+@pytest.mark.parametrize("dish_name", [
+    # Shares a word with a dish, but isn't it
+    "Chicken Wings",
+    "Beef Pho Bo",
+    "Beef Banh Mi",
+    "Uncategorized",
+    "",
+])
+def test_find_images_never_returns_another_dish(catalog, dish_name):
+    assert catalog.find_images(dish_name, ALIASES) == ()
+
+
+def test_write_through_changes_are_visible(catalog):
+    assert "Chicken Wings" not in catalog.dish_names()
+    catalog.add("6", "Chicken Wings", "https://img/chicken-wings")
+    assert catalog.find_images("Chicken Wings") == ("https://img/chicken-wings",)
+    catalog.add("6", "Spring Rolls")
+    assert catalog.find_images("Chicken Wings") == ()
+    assert catalog.find_images("Spring Rolls") == ("https://img/spring-rolls", "https://img/chicken-wings")
+    catalog.remove("6")
+    assert catalog.find_images("Spring Rolls") == ("https://img/spring-rolls",)
@@ -0,0 +1,98 @@
+import random
+
+import pytest
+
+from app.image_pipeline import hamming
+from app.services.hash_index import HashIndex, MAX_DISTANCE
+from app.services.image_store import ImageStore
+
+
+def flip(value, bits, rng):
+    for position in rng.sample(range(64), bits):
+        value ^= 1 << position
+    return value
+
+
+@pytest.fixture
+def library():
+    # Random hashes plus near copies of some of them, as a real library has
+    rng = random.Random(1)
+    hashes = {f"img{i}": rng.getrandbits(64) for i in range(2000)}
+    for i in range(300):
+        hashes[f"copy{i}"] = flip(hashes[f"img{i}"], rng.randint(0, 12), rng)
+    return hashes
+
+
+def linear_scan(hashes, value, max_distance):
+    return sorted(
+        (hamming(value, other), key) for key, other in hashes.items() if hamming(value, other) <= max_distance
+    )
+
+
+@pytest.mark.parametrize("max_distance", [0, 3, 4, 6, MAX_DISTANCE, 16])
+def test_find_matches_a_linear_scan(library, max_distance):
+    index = HashIndex(lambda: dict(library))
+    rng = random.Random(max_distance)
+    queries = [flip(library[f"img{i}"], rng.randint(0, 10), rng) for i in range(0, 300, 3)]
+    queries += [rng.getrandbits(64) for _ in range(50)]
+    for value in queries:
+        assert sorted(index.find(value, max_distance)) == linear_scan(library, value, max_distance)
+
+
+def test_claim_is_exclusive_only_when_asked():
+    index = HashIndex(lambda: {"a": 0})
+    assert index.claim("b", 1, 2) == [(1, "a")]
+    assert len(index) == 1
+    assert index.claim("c", 1, 2, exclusive=False) == [(1, "a")]
+    assert index.claim("d", 2 ** 64 - 1, 2) == []
+    assert len(index) == 3
+
+
+def test_add_and_remove_keep_buckets_in_step():
+    index = HashIndex(lambda: {"a": 0})
+    index.add("a", 2 ** 40)
+    assert index.find(0, 0) == []
+    assert index.find(2 ** 40, 0) == [(0, "a")]
+    index.remove("a")
+    assert index.find(2 ** 40, 0) == []
+    assert index._buckets == {}
+
+
+def test_groups_link_chains_of_near_duplicates():
+    index = HashIndex(lambda: {"a": 0, "b": 0b11, "c": 0b1111, "d": 2 ** 63 - 1})
+    assert index.groups(2) == [{"a", "b", "c"}]
+
+
+def image(public_id, phash):
+    return {"public_id": public_id, "dish_name": "Ramen", "url": f"https://img/{public_id}",
+            "created_at": "2024-05-01T00:00:00Z", "phash": f"{phash:016x}"}
+
+
+def test_workers_see_each_others_uploads_and_deletes(tmp_path):
+    # One index per gunicorn worker over the same shared store
+    store = ImageStore(str(tmp_path / "images.sqlite3"))
+    worker_a = HashIndex(store.hashes, store.hashes_version)
+    worker_b = HashIndex(store.hashes, store.hashes_version)
+    assert worker_b.find(0b1011, 2) == []
+
+    assert worker_a.claim("pending:a", 0b1011, 2) == []
+    store.upsert([image("ramen", 0b1011)], 0)
+    worker_a.add("ramen", 0b1011)
+    worker_a.remove("pending:a")
+
+    assert worker_b.claim("pending:b", 0b1001, 2) == [(1, "ramen")]
+
+    store.delete("ramen")
+    assert worker_b.find(0b1001, 2) == []
+
+
+def test_claims_survive_a_reload(tmp_path):
+    store = ImageStore(str(tmp_path / "images.sqlite3"))
+    index = HashIndex(store.hashes, store.hashes_version)
+    assert index.claim("pending:a", 0, 2) == []
+    # Another worker's upload forces a reload
+    store.upsert([image("other", 2 ** 64 - 1)], 0)
+    assert index.claim("pending:b", 1, 2) == [(1, "pending:a")]
+    index.remove("pending:a")
+    store.set_hash("more", "00000000000000ff")
+    assert index.find(0, 2) == []
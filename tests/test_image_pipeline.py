@@ -0,0 +1,78 @@
+import io
+
+import pytest
+from PIL import Image
+
+from app.image_pipeline import process_image, hash_image, hamming
+
+
+def encode(img, fmt, **params):
+    out = io.BytesIO()
+    img.save(out, fmt, **params)
+    return out.getvalue()
+
+
+def gradient(size=(4000, 3000)):
+    # Something with structure, so hashes and resampling are meaningful
+    img = Image.linear_gradient("L").resize(size)
+    return Image.merge("RGB", (img, img.transpose(Image.Transpose.FLIP_LEFT_RIGHT), img))
+
+
+def decode(data):
+    img = Image.open(io.BytesIO(data))
+    assert img.format == "JPEG"
+    return img
+
+
+@pytest.mark.parametrize("make, fmt", [
+    pytest.param(lambda: gradient(), "JPEG", id="jpeg-RGB"),
+    pytest.param(lambda: gradient().convert("CMYK"), "JPEG", id="jpeg-CMYK"),
+    pytest.param(lambda: gradient().convert("L"), "JPEG", id="jpeg-L"),
+    pytest.param(lambda: gradient().convert("P"), "GIF", id="gif-P"),
+    pytest.param(lambda: gradient().convert("P"), "PNG", id="png-P"),
+    pytest.param(lambda: gradient().convert("RGBA"), "PNG", id="png-RGBA"),
+    pytest.param(lambda: gradient().convert("LA"), "PNG", id="png-LA"),
+    pytest.param(lambda: gradient().convert("1"), "PNG", id="png-1"),
+    pytest.param(lambda: gradient().convert("CMYK"), "TIFF", id="tiff-CMYK"),
+    pytest.param(lambda: gradient().convert("L").convert("I").point(lambda v: v * 256).convert("I;16"), "PNG",
+                 id="png-I;16"),
+])
+def test_large_images_of_every_mode_are_resized(make, fmt):
+    data, phash = process_image(encode(make(), fmt), max_width=1440)
+    img = decode(data)
+    assert img.size == (1440, 1080)
+    assert img.mode in ("RGB", "L")
+    assert 0 <= phash < 2 ** 64
+
+
+def test_small_16_bit_image_is_scaled_not_clipped():
+    img = Image.new("I;16", (400, 300), 128 * 256)
+    data, _ = process_image(encode(img, "PNG"))
+    # Mid grey stays mid grey instead of saturating to white
+    assert 120 <= decode(data).convert("L").getpixel((200, 150)) <= 136
+
+
+def test_palette_transparency_is_kept_until_jpeg():
+    img = gradient((2000, 1500)).convert("P")
+    data, _ = process_image(encode(img, "GIF", transparency=0), max_width=1000)
+    assert decode(data).size == (1000, 750)
+
+
+def test_exif_orientation_is_applied_to_the_limited_width():
+    img = gradient((4000, 3000))
+    exif = Image.Exif()
+    exif[0x0112] = 6  # rotated 90°: 3000 wide once upright
+    data, _ = process_image(encode(img, "JPEG", exif=exif), max_width=1440)
+    assert decode(data).size == (1440, 1920)
+
+
+def test_small_images_are_not_upscaled():
+    data, _ = process_image(encode(gradient((800, 600)), "PNG"), max_width=1440)
+    assert decode(data).size == (800, 600)
+
+
+def test_recompressed_copy_hashes_close():
+    original = gradient((3000, 2000))
+    _, phash = process_image(encode(original, "JPEG", quality=95))
+    copy = encode(original.resize((600, 400)), "JPEG", quality=40)
+    assert hamming(phash, hash_image(copy)) <= 6
@@ -0,0 +1,100 @@
+import pytest
+
+from app.services.order_store import OrderStore, normalize_time
+
+LOCATION = "L1"
+
+
+def order(order_id, created_at, items, updated_at=None, state="COMPLETED"):
+    return {
+        "id": order_id,
+        "location_id": LOCATION,
+        "state": state,
+        "created_at": created_at,
+        "updated_at": updated_at or created_at,
+        "line_items": [{"uid": name, "name": name, "quantity": str(quantity)} for name, quantity in items],
+    }
+
+
+@pytest.fixture
+def store(tmp_path):
+    return OrderStore(str(tmp_path / "orders.sqlite3"))
+
+
+def quantities(store):
+    return store.db.execute("SELECT order_id, name, quantity FROM line_items ORDER BY order_id, name").fetchall()
+
+
+def rollups(store):
+    return sorted(store.daily_sales(LOCATION, "0000-00-00", "9999-99-99"))
+
+
+def dirty_days(store):
+    return sorted(row[0] for row in store.db.execute("SELECT day FROM dirty_days").fetchall())
+
+
+def test_timestamps_normalize_to_one_sortable_format():
+    assert normalize_time("2024-05-01T12:00:05Z") == "2024-05-01T12:00:05.000000Z"
+    assert normalize_time("2024-05-01T14:00:05.5+02:00") == "2024-05-01T12:00:05.500000Z"
+    assert normalize_time("2024-05-01T12:00:05Z") < normalize_time("2024-05-01T12:00:05.123Z")
+
+
+def test_newer_copy_of_an_order_replaces_its_line_items(store):
+    assert store.upsert_orders(LOCATION, [order("a", "2024-05-01T12:00:00Z", [("Ramen", 2)])]) == 1
+    assert store.upsert_orders(LOCATION, [order("a", "2024-05-01T12:00:00Z", [("Gyoza", 1)],
+                                                updated_at="2024-05-01T12:30:00Z")]) == 1
+    assert quantities(store) == [("a", "Gyoza", 1.0)]
+
+
+def test_older_copy_of_an_order_is_ignored(store):
+    store.upsert_orders(LOCATION, [order("a", "2024-05-01T12:00:00Z", [("Ramen", 2)],
+                                         updated_at="2024-05-01T12:00:05.500Z")])
+    # Without fractional seconds, but earlier
+    assert store.upsert_orders(LOCATION, [order("a", "2024-05-01T12:00:00Z", [("Ramen", 9)],
+                                                updated_at="2024-05-01T12:00:05Z")]) == 0
+    assert quantities(store) == [("a", "Ramen", 2.0)]
+
+
+def test_refresh_recomputes_only_dirty_days(store):
+    store.upsert_orders(LOCATION, [
+        order("a", "2024-05-01T12:00:00Z", [("Ramen", 2)]),
+        order("b", "2024-05-02T12:00:00Z", [("Gyoza", 3)]),
+    ])
+    assert store.refresh_rollups(LOCATION) == 2
+    assert store.refresh_rollups(LOCATION) == 0
+
+    store.upsert_orders(LOCATION, [order("c", "2024-05-02T18:00:00Z", [("Gyoza", 1), ("Ramen", 1)])])
+    assert dirty_days(store) == ["2024-05-02"]
+    assert store.refresh_rollups(LOCATION) == 1
+    assert rollups(store) == [
+        ("2024-05-01", "Ramen", 2.0),
+        ("2024-05-02", "Gyoza", 4.0),
+        ("2024-05-02", "Ramen", 1.0),
+    ]
+
+
+def test_moved_or_cancelled_order_rerolls_both_days(store):
+    store.upsert_orders(LOCATION, [order("a", "2024-05-01T12:00:00Z", [("Ramen", 2)])])
+    store.refresh_rollups(LOCATION)
+
+    store.upsert_orders(LOCATION, [order("a", "2024-05-03T12:00:00Z", [("Ramen", 2)],
+                                         updated_at="2024-05-03T12:00:01Z")])
+    assert dirty_days(store) == ["2024-05-01", "2024-05-03"]
+    store.refresh_rollups(LOCATION)
+    assert rollups(store) == [("2024-05-03", "Ramen", 2.0)]
+
+    store.upsert_orders(LOCATION, [order("a", "2024-05-03T12:00:00Z", [("Ramen", 2)],
+                                         updated_at="2024-05-04T00:00:00Z", state="CANCELED")])
+    store.refresh_rollups(LOCATION)
+    assert rollups(store) == []
+
+
+def test_first_refresh_backfills_orders_synced_before_rollups(store):
+    store.upsert_orders(LOCATION, [order("a", "2024-05-01T12:00:00Z", [("Ramen", 2)])])
+    store.set_sync_state(LOCATION, "2024-05-01T12:00:00Z", "2024-05-01T12:05:00Z")
+    # As if synced by a version without rollups
+    store.db.execute("DELETE FROM dirty_days")
+
+    assert store.refresh_rollups(LOCATION) == 1
+    assert rollups(store) == [("2024-05-01", "Ramen", 2.0)]
+    assert store.refresh_rollups(LOCATION) == 0
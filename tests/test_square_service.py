@@ -0,0 +1,81 @@
+import datetime
+from unittest import mock
+
+import pytest
+
+from app import create_app
+from app.services import square_service
+from app.utils import clear_caches
+
+TODAY = datetime.datetime.utcnow().date()
+
+
+def day(days_ago):
+    return TODAY - datetime.timedelta(days=days_ago)
+
+
+# One order of one Pho every 3 days, going back 400 days
+ORDERS = [
+    {"id": f"o{back}", "location_id": "L1", "state": "COMPLETED",
+     "created_at": f"{day(back).isoformat()}T12:00:00Z", "updated_at": f"{day(back).isoformat()}T12:00:00Z",
+     "line_items": [{"uid": "1", "name": "Pho", "quantity": "1"}]}
+    for back in range(0, 400, 3)
+]
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+def search(url, headers, json, idempotent):
+    # orders/search over ORDERS, honouring the date filter
+    (field, time_range), = json["query"]["filter"]["date_time_filter"].items()
+    assert json["query"]["sort"]["sort_field"] == field.upper()
+    return FakeResponse({"orders": [
+        order for order in ORDERS
+        if order[field] >= time_range["start_at"] and order[field] < time_range.get("end_at", "~")
+    ]})
+
+
+@pytest.fixture
+def client(tmp_path):
+    app = create_app()
+    app.config.update(ORDER_STORE_PATH=str(tmp_path / "orders.sqlite3"), SQUARE_ACCESS_TOKEN="token",
+                      SQUARE_LOCATION_ID="L1", SQUARE_LOCATION_IDS=["L1"], SQUARE_BACKFILL_MAX_DAYS=366)
+    clear_caches()
+    with mock.patch("app.http_client.post", side_effect=search) as post:
+        yield app.test_client(), post
+    clear_caches()
+
+
+def sold(start, end):
+    return sum(1 for order in ORDERS if start.isoformat() <= order["created_at"][:10] <= end.isoformat())
+
+
+def test_range_before_the_first_sync_is_backfilled(client):
+    client, post = client
+    report = client.get(f"/api/sales/top-dishes?start={day(60)}").get_json()
+    assert report["partial"] is False
+    assert report["dishes"] == [{"name": "Pho", "sold": sold(day(60), day(1))}]
+
+    # Already covered: no second backfill
+    calls = post.call_count
+    report = client.get(f"/api/sales/top-dishes?start={day(30)}&end={day(2)}").get_json()
+    assert report["dishes"] == [{"name": "Pho", "sold": sold(day(30), day(2))}]
+    assert post.call_count == calls
+
+
+def test_range_older_than_the_backfill_limit_is_flagged(client):
+    client, _ = client
+    report = client.get("/api/sales/top-dishes?start=2020-01-01&granularity=month").get_json()
+    assert report["start"] == "2020-01-01"
+    assert report["partial"] is True
+    assert report["covered_from"] == day(366).isoformat()
+    assert report["dishes"] == [{"name": "Pho", "sold": sold(day(366), day(1))}]
@@ -0,0 +1,189 @@
+import threading
+import time
+
+import pytest
+
+from app import utils
+from app.utils import SingleFlight, TTLCache, approx_size, ttl_cache
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(utils.time, "time", clock)
+    return clock
+
+
+def make_key(*args, **kwargs):
+    return utils.make_key(args, kwargs)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_least_recently_used_entry_is_evicted_first():
+    cache = TTLCache("lru", 60, max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b", default=None) is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_byte_budget_evicts_until_it_fits():
+    value = "x" * 1000
+    size = approx_size(value)
+    cache = TTLCache("bytes", 60, max_entries=None, max_bytes=int(size * 2.5))
+    for key in "abc":
+        cache.set(key, value)
+    assert cache.get("a", default=None) is None
+    assert cache.stats()["entries"] == 2
+    assert cache.stats()["bytes"] == 2 * size
+
+
+def test_value_larger_than_the_budget_is_not_cached():
+    cache = TTLCache("huge", 60, max_bytes=100)
+    cache.set("small", 1)
+    cache.set("big", "x" * 1000)
+    assert cache.get("big", default=None) is None
+    assert cache.get("small") == 1
+
+
+def test_replacing_an_entry_updates_the_byte_count():
+    cache = TTLCache("replace", 60)
+    cache.set("a", "x" * 1000)
+    cache.set("a", "x")
+    assert cache.stats()["bytes"] == approx_size("x")
+
+
+def test_entry_expires_after_its_ttl(clock):
+    cache = TTLCache("ttl", 10)
+    cache.set("a", 1)
+    clock.now += 9
+    assert cache.get("a") == 1
+    clock.now += 2
+    assert cache.get("a", default=None) is None
+    assert cache.stats()["expirations"] == 1
+
+
+def test_lookup_states_follow_ttl_stale_window_and_max_age(clock):
+    cache = TTLCache("states", 10, stale_seconds=20, max_age=25)
+    cache.set("a", 1)
+    clock.now += 9
+    assert cache.lookup("a") == (1, "fresh")
+    clock.now += 2
+    assert cache.lookup("a") == (1, "stale")
+    # max_age cuts the stale window short of ttl + stale_seconds
+    clock.now += 14
+    assert cache.lookup("a") == (utils._MISSING, None)
+    assert cache.stats()["expirations"] == 1
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    flight = SingleFlight(timeout=5)
+    release = threading.Event()
+    calls = []
+
+    def load():
+        calls.append(1)
+        release.wait(5)
+        return "value"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do("key", load))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    wait_for(lambda: flight.stats()["coalesced"] == 4)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert results == ["value"] * 5
+    assert len(calls) == 1
+    assert flight.stats() == {"in_flight": 0, "leaders": 1, "coalesced": 4, "timeouts": 0}
+
+
+def test_single_flight_shares_the_leaders_error():
+    flight = SingleFlight(timeout=5)
+    started = threading.Event()
+    release = threading.Event()
+
+    def load():
+        started.set()
+        release.wait(5)
+        raise ValueError("upstream down")
+
+    errors = []
+
+    def call():
+        try:
+            flight.do("key", load)
+        except ValueError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=call)
+    follower.start()
+    wait_for(lambda: flight.stats()["coalesced"] == 1)
+    release.set()
+    leader.join()
+    follower.join()
+    assert len(errors) == 2 and errors[0] is errors[1]
+
+
+def test_single_flight_follower_gives_up_after_timeout():
+    flight = SingleFlight(timeout=0.05)
+    release = threading.Event()
+    leader = threading.Thread(target=flight.do, args=("key", lambda: release.wait(5)))
+    leader.start()
+    wait_for(lambda: flight.stats()["in_flight"] == 1)
+    assert flight.do("key", lambda: "own call") == "own call"
+    release.set()
+    leader.join()
+    assert flight.stats()["timeouts"] == 1
+
+
+def test_stale_value_is_served_while_it_is_revalidated(clock):
+    values = iter(["v1", "v2", "v3"])
+    calls = []
+
+    @ttl_cache(ttl_seconds=10, stale_seconds=20)
+    def load(key):
+        calls.append(key)
+        return next(values)
+
+    try:
+        assert load("k") == "v1"
+        clock.now += 5
+        assert load("k") == "v1"
+        assert len(calls) == 1
+
+        # Expired but within the stale window: old value now, refresh behind
+        clock.now += 10
+        assert load("k") == "v1"
+        wait_for(lambda: load.cache.lookup(make_key("k"), record=False)[1] == "fresh")
+        assert load("k") == "v2"
+        assert len(calls) == 2
+
+        # Past the stale window the caller waits for a new value
+        clock.now += 31
+        assert load("k") == "v3"
+        stats = load.cache.stats()
+        assert stats["stale_hits"] == 1 and stats["refreshes"] == 1
+    finally:
+        utils.clear_caches(load.cache.name)